@@ -0,0 +1,319 @@
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from typing import List, Sequence
+
+from streams import create_stream
+from streams.directory import IMAGE_EXTENSIONS
+from images.image_type import ImageType
+from viewer import load_class, parse_additional_args
+
+
+METADATA_FILE = "metadata.jsonl"   # one json line per finished frame (used for resuming)
+RUN_FILE = "run.json"              # arguments of the run
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Headless (offline) processing of recorded inputs")
+    parser.add_argument('--inputs', '--input', '-i', nargs='+', required=True,
+                        help='Input streams: image directories, video files, images, or session '
+                             'directories (one subdirectory per stream)')
+    parser.add_argument('--inference', '-f', default="filters.Nothing",
+                        help="Inference class to use")
+    parser.add_argument('--output', '-o', required=True,
+                        help="Output directory for images and metadata")
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help="Number of parallel worker processes")
+    parser.add_argument('--chunk', type=int, default=16,
+                        help="Number of consecutive frames handed to a worker at once "
+                             "(stateful inference classes only see continuity within a chunk)")
+    parser.add_argument('--batch-size', '-b', type=int, default=1,
+                        help="Number of consecutive frames passed to the inference class at once "
+                             "(e.g., batched neural network passes; only for classes that support it)")
+    parser.add_argument('--format', default="png",
+                        help="Image format for the outputs")
+    parser.add_argument('--no-render', action='store_true',
+                        help="Only store structured results (e.g., detections), skip drawing output images "
+                             "(for inference classes that support it)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted run, skipping frames that are already done")
+
+    # Remaining arguments are collected for parse_additional_args
+    args, unknown_args = parser.parse_known_args()
+    return args, unknown_args
+
+
+def expand_inputs(inputs):
+    """Expand session directories (without images, but with subdirectories) into one input per subdirectory"""
+    expanded = []
+    for identifier in inputs:
+        if os.path.isdir(identifier) and not any(
+                os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS for filename in os.listdir(identifier)):
+            subdirectories = sorted(
+                os.path.join(identifier, name) for name in os.listdir(identifier)
+                if os.path.isdir(os.path.join(identifier, name)))
+            if not subdirectories:
+                raise ValueError("No images or streams found in {}".format(identifier))
+            expanded.extend(subdirectories)
+        else:
+            expanded.append(identifier)
+    return expanded
+
+
+def load_finished_frames(output):
+    """Frame indices with a complete metadata line"""
+    finished = set()
+    path = os.path.join(output, METADATA_FILE)
+    if not os.path.exists(path):
+        return finished
+
+    with open(path) as fp:
+        for line in fp:
+            try:
+                finished.add(json.loads(line)["frame"])
+            except (ValueError, KeyError):
+                pass  # partially written line of an interrupted run
+    return finished
+
+
+## Worker (one inference instance and one set of streams per process)
+
+_worker = {}
+
+
+def init_worker(inference_name: str, class_kwargs: dict, inputs, output: str, format: str, render: bool,
+                finished=None):
+    _worker["inference"] = load_class(inference_name)(**class_kwargs)
+    _worker["inference"].render = render
+    _worker["streams"] = list(map(create_stream, inputs))
+    _worker["output"] = output
+    _worker["format"] = format
+    _worker["finished"] = finished  # barrier, so each worker of a pool runs finish_worker once
+    _worker["last"] = None          # (index, sources) of the last frame processed
+
+
+def process_frames(indices: Sequence[int]) -> List[dict]:
+    """
+    Process one or more frames with a single process() call
+
+    The images of consecutive frames are passed as extra streams (micro-batching), which
+    only works for inference classes that process images independently (BATCHABLE).
+    """
+    streams = _worker["streams"]
+    inference = _worker["inference"]
+    stream_count = len(streams)
+    if len(indices) > 1 and not inference.BATCHABLE:
+        # e.g., batching disabled by the instance's arguments
+        return [metadata for index in indices for metadata in process_frames([index])]
+
+    sources, input_images, missing = [], [], []
+    for index in indices:
+        for stream in streams:
+            stream.seek(index)
+        frame_sources = [stream.source() for stream in streams]
+        images = [stream.get() for stream in streams]
+        if any(image is None for image in images):
+            # e.g., a frame that fails to decode, or a video with an overestimated frame count
+            missing.append({
+                "frame": index,
+                "inputs": frame_sources,
+                "outputs": {},
+                "results": {},
+                "latency": 0.0,
+                "missing": [str(s) for (s, image) in enumerate(images) if image is None],
+            })
+            continue
+        sources.append(frame_sources)
+        input_images.extend(images)
+
+    indices = [index for index in indices if index not in {frame["frame"] for frame in missing}]
+    if not indices:
+        return missing
+
+    _start = time.perf_counter()
+    output_images = inference.process(input_images)
+    latency = (time.perf_counter() - _start) / len(indices)
+
+    metadata = []
+    for f, index in enumerate(indices):
+        if len(indices) == 1:
+            frame_outputs, frame_results = output_images, inference.results
+        else:
+            # image names of extra streams: str(f * stream_count + s) -> str(s)
+            names = {str(f * stream_count + s): str(s) for s in range(stream_count)}
+            frame_outputs = {names[key]: image for (key, image) in output_images.items() if key in names}
+            frame_results = {names[key]: result for (key, result) in inference.results.items() if key in names}
+        metadata.append(write_frame(index, sources[f], frame_outputs, frame_results, latency))
+
+    _worker["last"] = (indices[-1], sources[-1])
+    return sorted(metadata + missing, key=lambda frame: frame["frame"])
+
+
+def finish_worker(_=None) -> List[dict]:
+    """
+    Flush the inference class after the last frame of this worker (e.g., cloud requests still
+    in flight), and close it
+
+    Flushed outputs are written for the last frame processed, marked "flushed".
+    """
+    if _worker["finished"] is not None:
+        try:
+            _worker["finished"].wait(timeout=60)
+        except threading.BrokenBarrierError:
+            pass  # a worker didn't show up; flush anyway
+
+    inference = _worker["inference"]
+    output_images = inference.flush()
+    metadata = []
+    if _worker["last"] is not None and (output_images or inference.results):
+        index, sources = _worker["last"]
+        metadata.append(dict(write_frame(index, sources, output_images, inference.results, 0.0), flushed=True))
+    inference.close()
+    return metadata
+
+
+def write_frame(index: int, sources: list, frame_outputs: dict, frame_results: dict, latency: float) -> dict:
+    """Write the output images and large results of a frame; returns its metadata"""
+    outputs = {}
+    for name, image in frame_outputs.items():
+        if image is not None:
+            directory = name.replace(os.sep, "_")
+            os.makedirs(os.path.join(_worker["output"], directory), exist_ok=True)
+            path = os.path.join(directory, "{:06d}.{}".format(index, _worker["format"]))
+            cv2.imwrite(os.path.join(_worker["output"], path), image.get(ImageType.OPENCV))
+            outputs[name] = path
+
+    results = {
+        name: serialise_results(stream_results, name, index)
+        for (name, stream_results) in frame_results.items()
+    }
+
+    return {
+        "frame": index,
+        "inputs": sources,
+        "outputs": outputs,
+        "results": results,
+        "latency": latency,
+    }
+
+
+def serialise_results(results: dict, name: str, index: int) -> dict:
+    """Json-compatible results; large arrays are written to separate files (png for uint8 images, npy otherwise)"""
+    serialised = {}
+    for key, value in results.items():
+        if isinstance(value, np.ndarray) and value.size > 1024:
+            directory = os.path.join("results", name.replace(os.sep, "_"), key)
+            os.makedirs(os.path.join(_worker["output"], directory), exist_ok=True)
+            if value.dtype == np.uint8 and value.ndim in (2, 3):
+                path = os.path.join(directory, "{:06d}.png".format(index))
+                cv2.imwrite(os.path.join(_worker["output"], path), value)
+            else:
+                path = os.path.join(directory, "{:06d}.npy".format(index))
+                np.save(os.path.join(_worker["output"], path), value)
+            serialised[key] = path
+        elif isinstance(value, np.ndarray):
+            serialised[key] = value.tolist()
+        else:
+            serialised[key] = value
+    return serialised
+
+
+def run(frames, workers, chunk, batch_size, initargs):
+    """Yield the metadata of processed frames, in order"""
+    batches = [frames[i:i+batch_size] for i in range(0, len(frames), batch_size)]
+
+    if workers <= 1:
+        init_worker(*initargs)
+        for metadata in map(process_frames, batches):
+            yield from metadata
+        yield from finish_worker()
+        return
+
+    finished = multiprocessing.Barrier(workers)
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=initargs + (finished,)) as pool:
+        for metadata in pool.imap(process_frames, batches, chunksize=max(1, chunk // batch_size)):
+            yield from metadata
+        # one task per worker: each waits at the barrier, so no worker takes two
+        for metadata in pool.map(finish_worker, range(workers), chunksize=1):
+            yield from metadata
+
+
+def main(args: argparse.Namespace, class_args: argparse.Namespace):
+    print(args)
+    print(class_args)
+
+    inputs = expand_inputs(args.inputs)
+    streams = list(map(create_stream, inputs))
+    frame_count = min(len(stream) for stream in streams)
+    for stream in streams:
+        stream.stop()
+
+    os.makedirs(args.output, exist_ok=True)
+    run_info = {
+        "inference": args.inference,
+        "arguments": vars(class_args),
+        "inputs": inputs,
+        "frames": frame_count,
+    }
+    run_path = os.path.join(args.output, RUN_FILE)
+    if os.path.exists(os.path.join(args.output, METADATA_FILE)) and not args.resume:
+        raise SystemExit("Output directory {} contains a previous run; use --resume to continue it".format(
+            args.output))
+    if args.resume and os.path.exists(run_path):
+        with open(run_path) as fp:
+            previous = json.load(fp)
+        if any(previous.get(key) != run_info[key] for key in ["inference", "arguments", "inputs"]):
+            print("!! WARNING: resuming a run with different inference or inputs")
+    with open(run_path, "w") as fp:
+        json.dump(run_info, fp, indent=2)
+
+    finished = load_finished_frames(args.output)
+    frames = [index for index in range(frame_count) if index not in finished]
+    print("[batch] {} streams, {} frames, {} done, {} to process with {} worker(s)".format(
+        len(inputs), frame_count, frame_count - len(frames), len(frames), args.workers))
+
+    batch_size = args.batch_size
+    if batch_size > 1 and not load_class(args.inference).BATCHABLE:
+        print("!! WARNING: {} doesn't support batching; using --batch-size 1".format(args.inference))
+        batch_size = 1
+
+    initargs = (args.inference, vars(class_args), inputs, args.output, args.format, not args.no_render)
+    processed = 0
+    missing = 0
+    latency = 0.0
+    _start = time.perf_counter()
+
+    with open(os.path.join(args.output, METADATA_FILE), "a") as fp:
+        try:
+            for metadata in run(frames, args.workers, args.chunk, batch_size, initargs):
+                fp.write(json.dumps(metadata) + "\n")
+                fp.flush()
+                if metadata.get("flushed"):
+                    continue  # results of the last frame, completed after the end of the streams
+                processed += 1
+                latency += metadata["latency"]
+                if "missing" in metadata:
+                    missing += 1
+                if processed % 100 == 0:
+                    print("[batch] {}/{} frames".format(processed, len(frames)))
+        except KeyboardInterrupt:
+            print("[batch] interrupted; continue with --resume")
+
+    elapsed = time.perf_counter() - _start
+    print("[batch] processed {} frames in {:.1f}s: {:.2f} fps ({:.1f}ms mean inference latency)".format(
+        processed, elapsed, processed / elapsed if elapsed else 0.0,
+        1000 * latency / (processed - missing) if processed > missing else 0.0))
+    if missing:
+        print("!! WARNING: {} frames skipped, missing input images (see 'missing' in {})".format(missing, METADATA_FILE))
+
+
+if __name__ == '__main__':
+    args, unknown_args = parse_args()
+    class_args = parse_additional_args(
+        unknown_args, load_class(args.inference).ARGUMENTS, reserved=('i', 'f', 'o', 'w', 'b'))
+    main(args, class_args)
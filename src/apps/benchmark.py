@@ -0,0 +1,147 @@
+import argparse
+import json
+import platform
+import re
+import time
+import cv2
+import numpy as np
+
+from benchmarks import CASES, RESOLUTIONS, measure, synthetic_frame
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark conversions, inference classes and streams")
+    parser.add_argument('--cases', '-c', default=".*",
+                        help="Regular expression selecting the benchmark cases to run")
+    parser.add_argument('--resolutions', '-r', nargs='+', default=["vga", "hd"], choices=RESOLUTIONS.keys(),
+                        help="Synthetic frame sizes")
+    parser.add_argument('--repeat', '-n', type=int, default=100,
+                        help="Maximum number of timed calls per case")
+    parser.add_argument('--max-time', type=float, default=10.0,
+                        help="Maximum time per case and resolution (in seconds)")
+    parser.add_argument('--output', '-o',
+                        help="Write results as json to this file")
+    parser.add_argument('--compare',
+                        help="Earlier results (json) to compare against")
+    parser.add_argument('--list', action='store_true',
+                        help="List the available cases")
+    parser.add_argument('--quantize', nargs='+', metavar='MODEL',
+                        help="Compare FP32 and INT8 versions of these MXNet models (instead of running the cases)")
+    parser.add_argument('--images',
+                        help="Directory with evaluation images for --quantize")
+    parser.add_argument('--calibration',
+                        help="Directory with calibration images for --quantize (default: --images)")
+    return parser.parse_args()
+
+
+def run_case(name, setup, resolution, repeat, max_time):
+    result = {"case": name, "resolution": resolution}
+    frame = synthetic_frame(*RESOLUTIONS[resolution])
+    try:
+        func = setup(frame)
+    except (ModuleNotFoundError, FileNotFoundError) as ex:
+        result["skipped"] = str(ex)
+        return result
+    except Exception as ex:  # e.g., an OpenCV build without CascadeClassifier: don't stop the other cases
+        result["failed"] = "{}: {}".format(type(ex).__name__, ex)
+        return result
+
+    try:
+        result.update(measure(func, repeat=repeat, max_time=max_time))
+    except Exception as ex:
+        result["failed"] = "{}: {}".format(type(ex).__name__, ex)
+    return result
+
+
+def compare(results, baseline):
+    """Print the p50 latency change against an earlier run"""
+    previous = {(r["case"], r["resolution"]): r for r in baseline["results"] if "p50_ms" in r}
+    print()
+    print("{:<40} {:>6} {:>10} {:>10} {:>8}".format("case", "res", "p50 (old)", "p50 (new)", "change"))
+    for result in results:
+        key = (result["case"], result["resolution"])
+        if key in previous and "p50_ms" in result:
+            old, new = previous[key]["p50_ms"], result["p50_ms"]
+            print("{:<40} {:>6} {:>8.2f}ms {:>8.2f}ms {:>+7.1f}%".format(
+                key[0], key[1], old, new, 100 * (new - old) / old))
+
+
+def run_quantization(models, images_dir, calibration_dir, repeat, max_time):
+    from benchmarks.quantization import compare_quantized
+    from streams.directory import DirectoryStream
+
+    stream = DirectoryStream(images_dir)
+    images = [stream.get() for _ in range(len(stream))]
+    if not images:
+        raise SystemExit("No images found in {}".format(images_dir))
+    if not calibration_dir or calibration_dir == images_dir:
+        print("NOTE: evaluating on the calibration images; use --calibration for a separate set")
+
+    results = []
+    print("{:<28} {:>12} {:>12} {:>8}  {}".format("model", "FP32 calls/s", "INT8 calls/s", "speedup", "agreement"))
+    for model in models:
+        result = compare_quantized(model, images, calibration_dir or images_dir, repeat, max_time)
+        results.append(result)
+        print("{:<28} {:>12.1f} {:>12.1f} {:>7.2f}x  {}".format(
+            model, result["fp32"]["throughput"], result["int8"]["throughput"], result["speedup"],
+            ", ".join("{} {:.3f}".format(key, value) for (key, value) in result["agreement"].items())))
+    return results
+
+
+def main(args: argparse.Namespace):
+    if args.quantize:
+        if not args.images:
+            raise SystemExit("--quantize needs --images")
+        results = run_quantization(args.quantize, args.images, args.calibration, args.repeat, args.max_time)
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "platform": platform.platform(),
+                           "quantization": results}, fp, indent=2)
+            print("Results written to", args.output)
+        return
+
+    cases = [(name, setup) for (name, setup) in CASES if re.search(args.cases, name)]
+    if args.list:
+        for name, _ in cases:
+            print(name)
+        return
+
+    results = []
+    print("{:<40} {:>6} {:>10} {:>10} {:>10} {:>10}".format("case", "res", "calls/s", "p50", "p95", "p99"))
+    for name, setup in cases:
+        for resolution in args.resolutions:
+            result = run_case(name, setup, resolution, args.repeat, args.max_time)
+            results.append(result)
+            if "skipped" in result:
+                print("{:<40} {:>6} skipped ({})".format(name, resolution, result["skipped"]))
+            elif "failed" in result:
+                print("{:<40} {:>6} FAILED ({})".format(name, resolution, result["failed"]))
+            else:
+                print("{:<40} {:>6} {:>10.1f} {:>8.2f}ms {:>8.2f}ms {:>8.2f}ms".format(
+                    name, resolution, result["throughput"], result["p50_ms"], result["p95_ms"], result["p99_ms"]))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "results": results,
+    }
+
+    failed = [result for result in results if "failed" in result]
+    if failed:
+        print("!! {} of {} case(s) failed".format(len(failed), len(results)))
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+        print("Results written to", args.output)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp))
+
+
+if __name__ == '__main__':
+    main(parse_args())
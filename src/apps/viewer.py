@@ -1,10 +1,13 @@
 import argparse
 import cv2
 import importlib
+import time
 from typing import Sequence
 
 from streams import create_stream
 from images.image_type import ImageType
+from plugins import print_plugins
+from profiling import PROFILER, timed
 
 
 argparse.ArgumentDefaultsHelpFormatter
@@ -17,17 +20,25 @@ def parse_args():
                         help='Input stream or streams (camera id:int, image path:str)')
     parser.add_argument('--inference', '-f', type=load_class, default=load_class("filters.Nothing"),
                         help="Inference class to use")
+    parser.add_argument('--list', action='store_true',
+                        help="List the available inference classes (with arguments) and stream types")
+    parser.add_argument('--profile', action='store_true',
+                        help="Time the pipeline stages, and show frame rate and timings on the outputs")
+    parser.add_argument('--trace',
+                        help="Write a Chrome trace (json) of all timed stages to this file")
+    parser.add_argument('--stats-every', type=float, default=0,
+                        help="Print timings (and update the trace) every N seconds (default: on exit)")
 
     # Remaining arguments are collected for parse_additional_args
     args, unknown_args = parser.parse_known_args()
     return args, unknown_args
 
 
-def parse_additional_args(input: Sequence[str], arg_defs: dict):
-    """Parse class-specific arguments"""
+def parse_additional_args(input: Sequence[str], arg_defs: dict, reserved=('i', 'f')):
+    """Parse class-specific arguments (reserved: shorthands already taken by the app)"""
     parser = argparse.ArgumentParser()
 
-    shorthands = {'i', 'f'}
+    shorthands = set(reserved)
     for _key, _type in arg_defs.items():
         args = ['--{}'.format(_key)]
         if _key[0] not in shorthands:
@@ -60,17 +71,38 @@ def main(args: argparse.Namespace, class_args: argparse.Namespace):
     for shortcut, descr in inference.KEYSTROKES.items():
         print("|  {}  {}".format(shortcut, descr))
 
+    if args.profile or args.trace:
+        PROFILER.enable(trace_path=args.trace)
+    last_stats = time.time()
+
     try:
         while True:
-            input_images = list(stream.get(ImageType.OPENCV) for stream in input_streams)
-            output_images = inference.process(input_images)
-
-            for name, image in output_images.items():
-                if image is not None:
-                    frame_image = image.get(ImageType.OPENCV)
-                    cv2.imshow(WINDOW_NAME + "::{}".format(name), frame_image)
+            with timed("frame"):
+                input_images = []
+                for i, stream in enumerate(input_streams):
+                    with timed("stream.get", i):
+                        input_images.append(stream.get(ImageType.OPENCV))
+
+                with timed("inference.process"):
+                    output_images = inference.process(input_images)
+
+                for name, image in output_images.items():
+                    if image is not None:
+                        with timed("display", name):
+                            frame_image = image.get(ImageType.OPENCV)
+                            if args.profile:
+                                # draw on a copy; output images may be cached inputs
+                                frame_image = PROFILER.overlay(frame_image.copy())
+                            cv2.imshow(WINDOW_NAME + "::{}".format(name), frame_image)
+
+                with timed("display.waitkey"):
+                    keystroke = chr(cv2.waitKey(1) & 0xFF)
+
+            if args.stats_every and time.time() - last_stats > args.stats_every:
+                PROFILER.dump()
+                PROFILER.write_trace()
+                last_stats = time.time()
 
-            keystroke = chr(cv2.waitKey(1) & 0xFF)
             if keystroke == 'q':
                 break
             elif keystroke in inference.KEYSTROKES:
@@ -79,9 +111,17 @@ def main(args: argparse.Namespace, class_args: argparse.Namespace):
     finally:
         for stream in input_streams:
             stream.stop()
+        inference.close()
+
+        if PROFILER.enabled:
+            PROFILER.dump()
+            PROFILER.write_trace()
 
 
 if __name__ == '__main__':
     args, unknown_args = parse_args()
+    if args.list:
+        print_plugins()
+        raise SystemExit()
     class_args = parse_additional_args(unknown_args, args.inference.ARGUMENTS)
     main(args, class_args)
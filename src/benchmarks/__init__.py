@@ -0,0 +1,2 @@
+from .harness import measure, synthetic_frame, RESOLUTIONS
+from .cases import CASES
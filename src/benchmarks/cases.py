@@ -0,0 +1,220 @@
+import importlib
+import os
+import tempfile
+import cv2
+import numpy as np
+
+from images import convert
+from images.image import Image
+from images.image_type import ImageType
+
+# Benchmark cases: (name, setup) pairs, where setup(frame) prepares everything
+# that shouldn't be timed and returns the function to be timed.
+# Setup may raise ModuleNotFoundError for optional dependencies, or FileNotFoundError
+# for model files that haven't been downloaded (case is skipped).
+
+
+## Image conversions and caching
+
+def conversion_case(source_type: ImageType, target_type: ImageType):
+    def setup(frame):
+        img = convert.convert(frame, ImageType.OPENCV, source_type) if source_type != ImageType.OPENCV else frame
+        return lambda: convert.convert(img, source_type, target_type)
+    return setup
+
+
+def image_cached_case(target_type: ImageType):
+    """Repeated get() on the same Image (conversion cached after the first call)"""
+    def setup(frame):
+        image = Image(frame, opencv=True)
+        return lambda: image.get(target_type)
+    return setup
+
+
+def image_uncached_case(target_type: ImageType):
+    """New Image per call, like a stream delivering frames"""
+    def setup(frame):
+        return lambda: Image(frame, opencv=True).get(target_type)
+    return setup
+
+
+def encoder_case(**options):
+    """Upload encoding of cloud inference (OpenCV JPEG, see image.asbytes for PIL)"""
+    def setup(frame):
+        from cloud.encoder import UploadEncoder
+        encoder = UploadEncoder(**options)
+        return lambda: encoder.encode(Image(frame, opencv=True))
+    return setup
+
+
+## Inference classes
+
+def inference_case(classname: str, streams: int = 1, prepare=None, **kwargs):
+    def setup(frame):
+        # imported here, so import errors only skip this case
+        _mod, _class = classname.rsplit('.', 1)
+        inference_class = getattr(importlib.import_module("inference.{}".format(_mod)), _class)
+        inference = inference_class(**kwargs)
+        if prepare:
+            prepare(inference, frame)
+        frames = [np.roll(frame, 4 * i, axis=1) for i in range(streams)]
+        return lambda: inference.process([Image(f, copy=False, opencv=True) for f in frames])
+    return setup
+
+
+def prepare_stereo(inference, frame):
+    """Synthetic calibration of two parallel cameras (6cm baseline)"""
+    from inference.multiview import utils as mvutils
+
+    height, width = frame.shape[:2]
+    intrinsic = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+    camparams = {
+        "intrinsic": intrinsic,
+        "intrinsic_crop": intrinsic,
+        "distortion": np.zeros(5),
+    }
+    inference.camparams = {"0": camparams, "1": camparams}
+    inference.pairparams = {("0", "1"): mvutils.rectify_camera_pair(
+        camparams, camparams, (width, height), np.eye(3), np.array([[-6.0], [0.0], [0.0]]))}
+    inference.stage = inference.STAGES["RUNNING"]
+
+
+_LOADERS = {}
+
+
+def mxnet_case(model_name: str):
+    """Raw MxnetLoader process + visualise on CPU"""
+    def setup(frame):
+        import mxnet as mx
+        from dnn.mxnet import MxnetLoader
+
+        if model_name not in _LOADERS:
+            _LOADERS[model_name] = MxnetLoader(ctx=mx.context.cpu())
+            _LOADERS[model_name].load(model_name)
+        loader = _LOADERS[model_name]
+
+        def run():
+            image = Image(frame, copy=False, opencv=True)
+            loader.visualise(image, loader.process(image))
+            mx.nd.waitall()
+        return run
+    return setup
+
+
+def opencv_case(model_name: str):
+    """Raw OpencvLoader process + visualise (model files in CVLAB_MODELS)"""
+    def setup(frame):
+        from dnn.opencv import OpencvLoader
+
+        key = ("opencv", model_name)
+        if key not in _LOADERS:
+            loader = OpencvLoader()
+            loader.load(model_name)
+            _LOADERS[key] = loader
+        loader = _LOADERS[key]
+
+        def run():
+            image = Image(frame, copy=False, opencv=True)
+            loader.visualise(image, loader.process(image))
+        return run
+    return setup
+
+
+## Streams
+
+def image_stream_case(frame):
+    from streams.image import ImageStream
+
+    path = os.path.join(tempfile.mkdtemp(prefix="cvlab-bench-"), "frame.png")
+    cv2.imwrite(path, frame)
+    stream = ImageStream(path)
+    return lambda: stream.get().get(ImageType.OPENCV)
+
+
+def directory_stream_case(extension: str, count: int = 20):
+    def setup(frame):
+        from streams.directory import DirectoryStream
+
+        directory = tempfile.mkdtemp(prefix="cvlab-bench-")
+        for i in range(count):
+            cv2.imwrite(os.path.join(directory, "{:06d}.{}".format(i, extension)), np.roll(frame, i, axis=1))
+        stream = DirectoryStream(directory)
+
+        def run():
+            if stream.position >= len(stream):
+                stream.seek(0)
+            stream.get().get(ImageType.OPENCV)
+        return run
+    return setup
+
+
+def video_stream_case(frame, count: int = 20):
+    from streams.video import VideoStream
+
+    path = os.path.join(tempfile.mkdtemp(prefix="cvlab-bench-"), "video.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, frame.shape[1::-1])
+    for i in range(count):
+        writer.write(np.roll(frame, i, axis=1))
+    writer.release()
+    stream = VideoStream(path)
+
+    def run():
+        if stream.position >= len(stream):
+            stream.seek(0)
+        stream.get().get(ImageType.OPENCV)
+    return run
+
+
+CASES = [
+    ("convert.opencv-numpy", conversion_case(ImageType.OPENCV, ImageType.NUMPY)),
+    ("convert.numpy-opencv", conversion_case(ImageType.NUMPY, ImageType.OPENCV)),
+    ("convert.numpy-pillow", conversion_case(ImageType.NUMPY, ImageType.PILLOW)),
+    ("convert.pillow-numpy", conversion_case(ImageType.PILLOW, ImageType.NUMPY)),
+    ("convert.opencv-pillow", conversion_case(ImageType.OPENCV, ImageType.PILLOW)),
+    ("convert.pillow-opencv", conversion_case(ImageType.PILLOW, ImageType.OPENCV)),
+
+    ("image.cached-numpy", image_cached_case(ImageType.NUMPY)),
+    ("image.uncached-numpy", image_uncached_case(ImageType.NUMPY)),
+    ("image.uncached-pillow", image_uncached_case(ImageType.PILLOW)),
+    ("image.asbytes", lambda frame: Image(frame, opencv=True).asbytes),
+    ("cloud.encode", encoder_case()),
+    ("cloud.encode-640-100kb", encoder_case(max_side=640, max_bytes=100 * 1024)),
+
+    ("inference.filters.Nothing", inference_case("filters.Nothing")),
+    ("inference.filters.Edges", inference_case("filters.Edges")),
+    ("inference.classic.OpticalFlow", inference_case("classic.OpticalFlow")),
+    ("inference.classic.DenseOpticalFlow", inference_case("classic.DenseOpticalFlow")),
+    ("inference.classic.DenseOpticalFlow-farneback", inference_case("classic.DenseOpticalFlow", method="farneback")),
+    ("inference.detection.Faces", inference_case("detection.Faces")),
+    ("inference.detection.Faces-scaled", inference_case("detection.Faces", scale=0.5, full_every=5)),
+    ("inference.multiview.StereoVision", inference_case("multiview.StereoVision", streams=2, prepare=prepare_stereo)),
+    ("inference.multiview.Stitching", inference_case("multiview.Stitching", streams=2)),
+    # neural networks: skipped without the framework (mxnet) or the model files (opencv, in CVLAB_MODELS)
+    ("inference.classification.Classification", inference_case("classification.Classification")),
+    ("inference.classification.Classification-opencv",
+     inference_case("classification.Classification", loader="opencv", model="googlenet")),
+    ("inference.segmentation.Segmentation", inference_case("segmentation.Segmentation")),
+    ("inference.segmentation.Segmentation-opencv", inference_case("segmentation.Segmentation", loader="opencv", model="enet")),
+    ("inference.detection.Objects", inference_case("detection.Objects")),
+    ("inference.detection.Objects-opencv", inference_case("detection.Objects", loader="opencv")),
+    # cloud: local stand-in without latency (client-side overhead only; skipped without boto3)
+    ("inference.detection.CloudObjects", inference_case("detection.CloudObjects", cloud="fake:0")),
+    ("inference.detection.CloudObjects-mosaic", inference_case("detection.CloudObjects", streams=4, cloud="fake:0", mosaic=640)),
+    ("inference.detection.CloudFaces", inference_case("detection.CloudFaces", cloud="fake:0")),
+    ("inference.detection.CloudText", inference_case("detection.CloudText", cloud="fake:0")),
+
+    ("dnn.mxnet.mobilenet", mxnet_case("mobilenet")),
+    ("dnn.mxnet.resnet", mxnet_case("resnet")),
+    ("dnn.mxnet.yolo", mxnet_case("yolo")),
+    ("dnn.mxnet.ssd", mxnet_case("ssd")),
+    ("dnn.mxnet.deeplab", mxnet_case("deeplab")),
+    ("dnn.opencv.googlenet", opencv_case("googlenet")),
+    ("dnn.opencv.yolo", opencv_case("yolo")),
+    ("dnn.opencv.ssd", opencv_case("ssd")),
+    ("dnn.opencv.enet", opencv_case("enet")),
+
+    ("streams.ImageStream", image_stream_case),
+    ("streams.DirectoryStream-png", directory_stream_case("png")),
+    ("streams.DirectoryStream-jpg", directory_stream_case("jpg")),
+    ("streams.VideoStream-mjpg", video_stream_case),
+]
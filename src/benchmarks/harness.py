@@ -0,0 +1,72 @@
+import time
+import cv2
+import numpy as np
+
+# Synthetic frame sizes (width, height)
+RESOLUTIONS = {
+    "qvga": (320, 240),
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+}
+
+
+def synthetic_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """
+    Deterministic BGR test frame with gradients, shapes and noise
+
+    The shapes give feature detectors, matchers and trackers something
+    to work on; the noise avoids unrealistically good compression.
+    """
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = x[np.newaxis, :]
+    frame[..., 1] = y[:, np.newaxis]
+    frame[..., 2] = 128
+
+    scale = width / 640
+    for _ in range(40):
+        colour = tuple(int(c) for c in rng.randint(0, 255, 3))
+        centre = (int(rng.randint(0, width)), int(rng.randint(0, height)))
+        size = int(rng.randint(5, 60) * scale) + 1
+        if rng.rand() < 0.5:
+            cv2.circle(frame, centre, size, colour, -1)
+        else:
+            cv2.rectangle(frame, centre, (centre[0] + size, centre[1] + size), colour, -1)
+
+    noise = rng.randint(-8, 8, frame.shape)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def measure(func, repeat: int = 100, warmup: int = 3, max_time: float = 10.0) -> dict:
+    """
+    Time repeated calls of func (after a few warm-up calls)
+
+    Stops early after max_time seconds, but always measures at least 3 calls.
+    Returns throughput (calls/s) and latency percentiles (ms).
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    _start = time.perf_counter()
+    while len(latencies) < repeat:
+        _call = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - _call)
+        if len(latencies) >= 3 and time.perf_counter() - _start > max_time:
+            break
+    elapsed = time.perf_counter() - _start
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "iterations": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
@@ -0,0 +1,73 @@
+import numpy as np
+
+from dnn.tiling import box_iou
+from .harness import measure
+
+# FP32 vs INT8 comparison of an MXNet model on real images. Synthetic frames
+# are fine for timing, but agreement between the two only means something on
+# images with actual objects in them.
+
+
+def agreement(reference: dict, results: dict, iou: float = 0.5) -> dict:
+    """How well the results of one image match the (FP32) reference results"""
+    if "boxes" in reference:
+        # detection: fraction of reference boxes found again (same label, IoU >= iou)
+        if len(reference["boxes"]) == 0:
+            return {"recall": 1.0 if len(results["boxes"]) == 0 else 0.0}
+        overlaps = box_iou(reference["boxes"], results["boxes"]) if len(results["boxes"]) else \
+            np.zeros((len(reference["boxes"]), 0))
+        same_label = reference["labels"][:, np.newaxis] == results["labels"][np.newaxis, :]
+        found = ((overlaps >= iou) & same_label).any(axis=1)
+        return {"recall": float(found.mean())}
+
+    elif "label_map" in reference:
+        # segmentation: pixel agreement, and mean IoU over the classes present in either map
+        ref, res = reference["label_map"], results["label_map"]
+        classes = np.union1d(np.unique(ref), np.unique(res))
+        ious = [np.logical_and(ref == c, res == c).sum() / np.logical_or(ref == c, res == c).sum()
+                for c in classes]
+        return {"pixel_agreement": float((ref == res).mean()), "miou": float(np.mean(ious))}
+
+    else:
+        # classification: same top-1, and overlap of the top-k
+        top_k = len(reference["labels"])
+        return {
+            "top1": float(reference["labels"][0] == results["labels"][0]),
+            "topk_overlap": len(set(reference["labels"]) & set(results["labels"])) / top_k,
+        }
+
+
+def compare_quantized(model_name: str, images: list, calibration: str, repeat: int = 50,
+                      max_time: float = 30.0) -> dict:
+    """
+    Throughput of the FP32 and INT8 (CPU) versions of a model, and their agreement
+
+    images: evaluation images (ideally not the calibration images)
+    Returns {"fp32": {timings}, "int8": {timings}, "agreement": {mean metrics}}
+    """
+    import mxnet as mx
+    from dnn.mxnet import MxnetLoader
+
+    size = images[0].size[::-1]
+    loaders = {}
+    for variant, quantize in [("fp32", None), ("int8", calibration)]:
+        loaders[variant] = MxnetLoader(ctx=mx.context.cpu())
+        loaders[variant].load(model_name, warmup=(size,), quantize=quantize)
+
+    report = {"model": model_name, "images": len(images)}
+    for variant, loader in loaders.items():
+        position = [0]
+
+        def run():
+            image = images[position[0] % len(images)]
+            position[0] += 1
+            loader.process(image)
+            mx.nd.waitall()
+        report[variant] = measure(run, repeat=repeat, max_time=max_time)
+
+    metrics = [agreement(loaders["fp32"].results(image, loaders["fp32"].process(image)),
+                         loaders["int8"].results(image, loaders["int8"].process(image)))
+               for image in images]
+    report["agreement"] = {key: float(np.mean([m[key] for m in metrics])) for key in metrics[0]}
+    report["speedup"] = report["int8"]["throughput"] / report["fp32"]["throughput"]
+    return report
@@ -1,11 +1,14 @@
 import boto3
 import time
+import numpy as np
 from botocore.client import Config
 from typing import Dict, Any, Tuple
 from random import randint
 
 from images.image import Image
 from images.viz.pillow import draw_boundingbox, draw_point
+from profiling import PROFILER
+from .encoder import UploadEncoder, PayloadStats
 from .provider import CloudProvider, InferenceType
 
 
@@ -19,16 +22,35 @@ class AWSInference(CloudProvider):
     - https://docs.aws.amazon.com/rekognition/latest/dg/streaming-video.html
     - https://docs.aws.amazon.com/kinesisvideostreams/latest/dg/what-is-kinesis-video.html
     """
-    KEYSTROKES = {'r': "Reset tracking"}
+    KEYSTROKES = {'r': "Reset tracking", 'u': "Print latency per upload size"}
 
     def __init__(self):
         self.COLOURS = {}
-
-    def load(self, inference_type: InferenceType, debug: int = True) -> None:
-        config = Config(connect_timeout=1, read_timeout=3)
-        self.rekognition_client = boto3.client("rekognition", config=config)
+        self.config = None  # of the boto3 client (None for a given client)
+        self.encoder = UploadEncoder()
+        self.payloads = PayloadStats()
+
+    def load(self, inference_type: InferenceType, debug: int = True, client=None,
+             connections: int = 1, timeout: float = 3, retries: int = None, encoder: UploadEncoder = None) -> None:
+        """
+        client: Rekognition client to use instead of a new boto3 client (e.g., cloud.fake.FakeRekognitionClient)
+        connections: size of the connection pool, for concurrent requests (boto3 clients are thread-safe;
+                     see set_connections)
+        timeout: read timeout per request (s)
+        retries: total attempts per request (default: botocore's); set to 1 when retrying elsewhere
+        encoder: upload encoding (resolution, byte budget) of the frames
+        """
         self.inference_type = inference_type
         self.debug = debug
+        if encoder is not None:
+            self.encoder = encoder
+        if client is not None:
+            self.rekognition_client = client
+            return
+
+        options = {"retries": {"mode": "standard", "max_attempts": retries}} if retries else {}
+        self.config = Config(connect_timeout=1, read_timeout=timeout, max_pool_connections=max(connections, 1), **options)
+        self.rekognition_client = boto3.client("rekognition", config=self.config)
 
         print()
         print("!! WARNING: this inference type uses AWS Rekognition,")
@@ -37,37 +59,43 @@ class AWSInference(CloudProvider):
         print()
         input("Hit ENTER to confirm >>> ")
 
+    def set_connections(self, connections: int) -> None:
+        """Grow the connection pool (the pool size of a boto3 client is fixed, so this takes a new client)"""
+        if self.config is None or connections <= self.config.max_pool_connections:
+            return
+        self.config = self.config.merge(Config(max_pool_connections=connections))
+        # requests in flight finish on the previous client
+        self.rekognition_client = boto3.client("rekognition", config=self.config)
+
     def process(self, image: Image) -> Dict[str, Any]:
+        rekognition_image = image2rekimage(image, self.encoder)
         _start = time.perf_counter()
 
         if self.inference_type == InferenceType.DETECTION:
             rekognition_response = self.rekognition_client.detect_labels(
-                Image=image2rekimage(image),
+                Image=rekognition_image,
                 MinConfidence=50,
             )
-            return {
+            metadata = {
                 "detections": rekognition_response["Labels"],
-                "latency": time.perf_counter() - _start,
             }
 
         elif self.inference_type == InferenceType.FACE_DETECTION:
             rekognition_response = self.rekognition_client.detect_faces(
-                Image=image2rekimage(image),
+                Image=rekognition_image,
                 Attributes=["ALL"],
             )
-            return {
+            metadata = {
                 "faces": rekognition_response["FaceDetails"],
-                "latency": time.perf_counter() - _start,
             }
 
         elif self.inference_type == InferenceType.TEXT_EXTRACT:
             rekognition_response = self.rekognition_client.detect_text(
-                Image=image2rekimage(image),
+                Image=rekognition_image,
                 Filters={"WordFilter": {"MinConfidence": 50}},
             )
-            return {
+            metadata = {
                 "text": rekognition_response["TextDetections"],
-                "latency": time.perf_counter() - _start,
             }
 
         else:
@@ -75,6 +103,14 @@ class AWSInference(CloudProvider):
                 f"Unknown inference type inside {self.__class__.__name__}: {self.inference_type}"
             )
 
+        metadata["latency"] = time.perf_counter() - _start
+        # extra (paid) attempts by botocore
+        metadata["retries"] = rekognition_response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        metadata["payload_bytes"] = len(rekognition_image["Bytes"])
+        self.payloads.add(metadata["payload_bytes"], metadata["latency"])
+        PROFILER.record("aws.{}".format(self.inference_type.name.lower()), metadata["latency"], start=_start)
+        return metadata
+
     def visualise(self, image: Image, metadata: Dict[str, Any]) -> Image:
         img = image.aspil()
 
@@ -134,15 +170,74 @@ class AWSInference(CloudProvider):
         img_result = Image(img)
         return img_result
 
+    def results(self, image: Image, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        results = {}
+
+        if "detections" in metadata:
+            try:
+                parsed = parse_rek_detect(metadata["detections"], image.size)
+                instances = [(item["label"], item["confidence"], box)
+                             for item in parsed for box in item["instances"]]
+                results.update({
+                    "boxes": boxes_xyxy([box for (_, _, box) in instances]),
+                    "scores": np.array([confidence / 100 for (_, confidence, _) in instances], dtype=np.float32),
+                    "names": [label for (label, _, _) in instances],
+                    # all labels, including those without instances (e.g., 'Outdoors')
+                    "tags": [[item["label"], item["confidence"] / 100] for item in parsed],
+                })
+            except ValueError as ex:
+                print(f"!! Error parsing detections, skipping: {ex}")
+
+        if "faces" in metadata:
+            try:
+                parsed = parse_rek_faces(metadata["faces"], image.size)
+                landmark_names = sorted({name for face in parsed for name in face["landmarks"]})
+                landmarks = np.full((len(parsed), len(landmark_names), 2), np.nan, dtype=np.float32)
+                for i, face in enumerate(parsed):
+                    for j, name in enumerate(landmark_names):
+                        if name in face["landmarks"]:
+                            landmarks[i, j] = face["landmarks"][name]
+                results.update({
+                    "boxes": boxes_xyxy([face["boundingbox"] for face in parsed]),
+                    "scores": np.array([face["confidence"] / 100 for face in parsed], dtype=np.float32),
+                    "landmarks": landmarks,
+                    "landmark_names": landmark_names,
+                })
+            except ValueError as ex:
+                print(f"!! Error parsing detections, skipping: {ex}")
+
+        if "text" in metadata:
+            try:
+                parsed = parse_rek_text(metadata["text"], image.size)
+                results.update({
+                    "boxes": boxes_xyxy([text["boundingbox"] for text in parsed]),
+                    "scores": np.array([text["confidence"] / 100 for text in parsed], dtype=np.float32),
+                    "text": [text["label"] for text in parsed],
+                })
+            except ValueError as ex:
+                print(f"!! Error parsing detections, skipping: {ex}")
+
+        return results
+
     def handle_command(self, key):
         if key == 'r':
             print("Resetting colours")
             self.COLOURS = {}
+        elif key == 'u':
+            print("Upload latency: {}".format(self.payloads.report()))
+
+
 
+def boxes_xyxy(boxes) -> np.ndarray:
+    """(x, y, w, h) tuples -> N x 4 array of (x1, y1, x2, y2)"""
+    boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    return boxes
 
 
-def image2rekimage(image: Image) -> dict:
-    image_bytes = image.asbytes()
+def image2rekimage(image: Image, encoder: UploadEncoder = None) -> dict:
+    """Rekognition image of a frame; response coordinates are relative, so any (downscaled) encoding will do"""
+    image_bytes = encoder.encode(image) if encoder else image.asbytes()
     return {"Bytes": image_bytes}
 
 
@@ -0,0 +1,173 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import cv2
+import numpy as np
+
+from constants import CACHE
+from images.image import Image
+from images.image_type import ImageType
+from profiling import PROFILER
+from utils import save_to_cache, load_from_cache
+from .provider import InferenceType
+
+
+DISK_CACHE = "cloud-responses"
+
+
+def dhash(image: Image, size: int = 8) -> int:
+    """
+    Perceptual difference hash of an image (size * size bits)
+
+    Each bit tells whether a pixel of a tiny greyscale thumbnail is brighter than its
+    right neighbour, so the hash survives noise, compression and small lighting changes.
+    """
+    img = image.get(ImageType.OPENCV)
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(img, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ResponseCache:
+    """
+    Cache of cloud responses, for (near-)identical frames
+
+    Responses are keyed by the perceptual hash (dhash) of the frame and the inference type;
+    frames whose hash differs in at most `tolerance` bits (of 64) share a response. Since
+    the responses have relative coordinates, a response is valid for any frame size.
+
+    Entries are kept in memory (least recently used first out, and for at most ttl seconds),
+    and optionally on disk, in CVLAB_CACHE/cloud-responses, for disk_ttl seconds (at most
+    disk_size of them, oldest first out). Expired files are deleted when they are found:
+    at start-up, and when looking up responses.
+    """
+    def __init__(self, tolerance: int = 4, size: int = 256, ttl: float = 300, disk_ttl: float = None,
+                 disk_size: int = 10000):
+        self.tolerance = tolerance
+        self.size = size
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self.disk_size = disk_size
+        self.entries = OrderedDict()  # (inference type, hash) -> (time, response), least recently used first
+        self.disk_index = {}          # (inference type, hash) -> time, of the responses on disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if disk_ttl:
+            directory = os.path.join(CACHE, DISK_CACHE)
+            for filename in os.listdir(directory) if os.path.isdir(directory) else []:
+                name, _, digest = os.path.splitext(filename)[0].rpartition("-")
+                if name in InferenceType.__members__:
+                    self.disk_index[(name, int(digest, 16))] = os.path.getmtime(os.path.join(directory, filename))
+
+            now = time.time()
+            for key in [key for (key, stored) in self.disk_index.items() if now - stored > disk_ttl]:
+                self._forget(key)
+            self._shrink_disk()
+
+    def get(self, inference_type: InferenceType, image: Image) -> Optional[Dict[str, Any]]:
+        """Cached response for this frame, or None"""
+        key = (inference_type.name, dhash(image))
+        now = time.time()
+
+        match = self._lookup(self.entries, key, now, self.ttl)
+        if match is not None:
+            self.entries.move_to_end(match)
+            self._hit("cloud.cache.hit")
+            return self.entries[match][1]
+
+        match = self._lookup(self.disk_index, key, now, self.disk_ttl, expire=self._forget) if self.disk_ttl else None
+        if match is not None:
+            stored = load_from_cache(DISK_CACHE, self._filename(match))
+            if stored is not None:
+                self._remember(match, stored)
+                self.disk_hits += 1
+                self._hit("cloud.cache.disk_hit")
+                return stored[1]
+            del self.disk_index[match]  # removed by another process
+
+        self.misses += 1
+        PROFILER.count("cloud.cache.miss")
+        return None
+
+    def put(self, inference_type: InferenceType, image: Image, response: Dict[str, Any]):
+        key = (inference_type.name, dhash(image))
+        entry = (time.time(), response)
+        self._remember(key, entry)
+        if self.disk_ttl:
+            save_to_cache(DISK_CACHE, self._filename(key), entry)
+            self.disk_index[key] = entry[0]
+            self._shrink_disk()
+
+    def _lookup(self, entries: dict, key, now: float, ttl: float, expire=None):
+        """Key of the closest fresh entry within tolerance (drops expired ones, or passes them to expire)"""
+        if key in entries and now - self._time(entries[key]) <= ttl:
+            return key
+
+        best, best_distance = None, self.tolerance + 1
+        for other in list(entries):
+            if now - self._time(entries[other]) > ttl:
+                if expire:
+                    expire(other)
+                else:
+                    del entries[other]
+                continue
+            if other[0] == key[0]:
+                distance = hamming(other[1], key[1])
+                if distance < best_distance:
+                    best, best_distance = other, distance
+        return best
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _forget(self, key):
+        """Drop a response from the disk tier"""
+        del self.disk_index[key]
+        try:
+            os.remove(os.path.join(CACHE, DISK_CACHE, "{}.pkl".format(self._filename(key))))
+        except OSError:
+            pass  # already removed (e.g., by another process)
+        PROFILER.count("cloud.cache.disk_removed")
+
+    def _shrink_disk(self):
+        if len(self.disk_index) > self.disk_size:
+            for key in sorted(self.disk_index, key=self.disk_index.get)[:len(self.disk_index) - self.disk_size]:
+                self._forget(key)
+
+    def _hit(self, counter: str):
+        self.hits += 1
+        PROFILER.count(counter)
+        PROFILER.count("cloud.cache.saved_calls")
+
+    @staticmethod
+    def _time(entry) -> float:
+        return entry[0] if isinstance(entry, tuple) else entry
+
+    @staticmethod
+    def _filename(key) -> str:
+        return "{}-{:016x}".format(*key)
+
+    def report(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_calls": self.hits,
+            "entries": len(self.entries),
+            "disk_entries": len(self.disk_index),
+        }
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict
+
+import cv2
+import numpy as np
+
+from images.image import Image
+from images.image_type import ImageType
+from profiling import PROFILER
+
+
+MAX_PAYLOAD = 5 * 1024 * 1024  # Rekognition limit for image bytes
+
+
+class UploadEncoder:
+    """
+    JPEG encoding of frames for upload, to a target resolution and/or byte budget
+
+    Frames are downscaled (longest side at most max_side) and encoded with OpenCV, which is
+    several times faster than Image.asbytes() (PIL). Frames over max_bytes are re-encoded at
+    lower quality (down to min_quality), and then at lower resolution (down to MIN_SIDE on
+    the short side), until they fit. The quality and resolution that fitted are the starting
+    point for the next frame of the same size (i.e., typically of the same camera, so a large
+    camera doesn't degrade the others). Encoding is thread-safe.
+
+    Cloud responses have coordinates relative to the image, so they apply to the original
+    frame as well.
+    """
+    MIN_SIDE = 80  # Rekognition minimum image size (px)
+    MAX_SIZES = 16  # frame sizes to keep the quality and resolution of (least recently used are dropped)
+
+    def __init__(self, max_side: int = None, max_bytes: int = None, quality: int = 75, min_quality: int = 40):
+        self.max_side = max_side
+        self.max_bytes = min(max_bytes or MAX_PAYLOAD, MAX_PAYLOAD)
+        self.quality = quality
+        self.min_quality = min_quality
+        self.lock = threading.Lock()
+        self.current = OrderedDict()  # (height, width) -> (quality, extra downscaling) that fitted last
+
+    def encode(self, image: Image) -> bytes:
+        _start = time.perf_counter()
+        img = image.get(ImageType.OPENCV)
+        height, width = img.shape[:2]
+        with self.lock:
+            quality, extra = self.current.pop((height, width), (self.quality, 1.0))
+        limit = min(1.0, self.max_side / max(height, width)) if self.max_side else 1.0
+        min_extra = min(1.0, self.MIN_SIDE / (min(height, width) * limit))
+
+        while True:
+            scale = limit * extra
+            resized = img if scale >= 1 else \
+                cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+            data = self._jpeg(resized, quality)
+            if len(data) <= self.max_bytes:
+                break
+            if quality > self.min_quality:
+                quality = max(self.min_quality, quality - 10)
+            elif extra > min_extra:
+                extra = max(min_extra, extra * 0.75)
+            else:
+                PROFILER.count("cloud.encode.over_budget")
+                break  # the smallest encoding
+
+        # start from the quality (and scale) that fitted, but recover when frames get smaller again
+        if len(data) < self.max_bytes * 0.7:
+            if extra < 1:
+                extra = min(1.0, extra / 0.75)
+            else:
+                quality = min(self.quality, quality + 5)
+        with self.lock:
+            self.current[(height, width)] = (quality, extra)
+            while len(self.current) > self.MAX_SIZES:
+                self.current.popitem(last=False)
+        PROFILER.record("cloud.encode", time.perf_counter() - _start, start=_start)
+        return data
+
+    @staticmethod
+    def _jpeg(img: np.ndarray, quality: int) -> bytes:
+        ok, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return buffer.tobytes()
+
+
+class PayloadStats:
+    """Request latency versus upload size, to tune the encoder (thread-safe)"""
+    BUCKETS_KB = (25, 50, 100, 200, 400, 800)
+
+    def __init__(self, history: int = 10000):
+        self.lock = threading.Lock()
+        self.sizes = deque(maxlen=history)
+        self.latencies = deque(maxlen=history)
+
+    def add(self, size: int, latency: float):
+        with self.lock:
+            self.sizes.append(size)
+            self.latencies.append(latency)
+        PROFILER.count("cloud.upload_bytes", size)
+
+    def report(self) -> Dict[str, Any]:
+        """Mean latency per payload size bucket, and a linear fit: latency = overhead + size / throughput"""
+        with self.lock:
+            sizes = np.array(self.sizes, dtype=np.float64) / 1024
+            latencies = np.array(self.latencies, dtype=np.float64)
+        report = {"requests": len(sizes), "buckets": {}}
+        if len(sizes) == 0:
+            return report
+
+        report["mean_kb"] = float(sizes.mean())
+        report["mean_latency"] = float(latencies.mean())
+        edges = (0,) + self.BUCKETS_KB + (float("inf"),)
+        for low, high in zip(edges[:-1], edges[1:]):
+            selected = (sizes >= low) & (sizes < high)
+            if selected.any():
+                name = "{}-{}kb".format(low, high) if high != float("inf") else ">{}kb".format(low)
+                report["buckets"][name] = {"requests": int(selected.sum()), "mean_latency": float(latencies[selected].mean())}
+
+        if np.ptp(sizes) > 0:
+            slope, overhead = np.polyfit(sizes, latencies, 1)
+            report["overhead"] = float(overhead)
+            report["ms_per_kb"] = float(slope * 1000)
+        return report
@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Local stand-in for the Rekognition client, for testing and benchmarking the
+# cloud pipeline without network access or cost. Responses have the same
+# structure as the real ones (see the parse_rek_* functions in cloud.aws).
+
+
+BOUNDING_BOX = {"Left": 0.3, "Top": 0.25, "Width": 0.4, "Height": 0.5}
+
+
+class FakeRekognitionClient:
+    """
+    Mimics the detect_labels, detect_faces and detect_text calls of a boto3 Rekognition client
+
+    latency: mean response time (s); each call sleeps latency +/- jitter
+    bandwidth: uplink speed (bytes/s), adding upload time per image (default: no upload time)
+    failure_rate: fraction of calls failing with a ThrottlingException (as when exceeding the TPS limit)
+    """
+    def __init__(self, latency: float = 0.2, jitter: float = 0.05, bandwidth: float = None,
+                 failure_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0  # highest number of concurrent calls seen
+
+    def _call(self, operation: str, image: dict):
+        if "Bytes" not in image:
+            raise ClientError({"Error": {"Code": "InvalidParameterException", "Message": "No image bytes"}}, operation)
+
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            if self.bandwidth:
+                delay += len(image["Bytes"]) / self.bandwidth
+            fail = self.random.random() < self.failure_rate
+        try:
+            time.sleep(delay)
+            if fail:
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, operation)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def detect_labels(self, Image: dict, MinConfidence: float = 55, **kwargs) -> dict:
+        self._call("DetectLabels", Image)
+        return {
+            "Labels": [
+                {"Name": "Person", "Confidence": 98.9, "Parents": [],
+                 "Instances": [{"BoundingBox": dict(BOUNDING_BOX), "Confidence": 98.9}]},
+                {"Name": "Outdoors", "Confidence": 76.2, "Parents": [], "Instances": []},
+            ]
+        }
+
+    def detect_faces(self, Image: dict, Attributes=("DEFAULT",), **kwargs) -> dict:
+        self._call("DetectFaces", Image)
+        return {
+            "FaceDetails": [
+                {"Confidence": 99.9, "BoundingBox": dict(BOUNDING_BOX),
+                 "Landmarks": [{"Type": "eyeLeft", "X": 0.42, "Y": 0.4}, {"Type": "eyeRight", "X": 0.58, "Y": 0.4},
+                               {"Type": "nose", "X": 0.5, "Y": 0.5}],
+                 "Pose": {"Roll": 0.0, "Yaw": 0.0, "Pitch": 0.0}},
+            ]
+        }
+
+    def detect_text(self, Image: dict, Filters: dict = None, **kwargs) -> dict:
+        self._call("DetectText", Image)
+        geometry = {"BoundingBox": dict(BOUNDING_BOX, Height=0.05), "Polygon": []}
+        return {
+            "TextDetections": [
+                {"DetectedText": "cvlab", "Type": "LINE", "Id": 0, "Confidence": 97.1, "Geometry": geometry},
+                {"DetectedText": "cvlab", "Type": "WORD", "Id": 1, "ParentId": 0, "Confidence": 97.1,
+                 "Geometry": geometry},
+            ]
+        }
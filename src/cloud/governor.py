@@ -0,0 +1,158 @@
+import datetime
+import threading
+import time
+from typing import Any, Dict, List
+
+from profiling import PROFILER
+from utils import save_to_cache, load_from_cache, cache_lock
+
+
+GOVERNOR_CACHE = "cloud-governor"
+SYNC_CALLS = 20       # add this run's calls to the shared daily count every this many calls..
+SYNC_INTERVAL = 10.0  # ..or seconds
+SYNC_MARGIN = 100     # ..and for every request when fewer calls than this are left in the budget
+HISTORY_DAYS = 7      # keep the daily counts of this many days
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+class RequestGovernor:
+    """
+    Bound the rate and number of (paid) cloud requests
+
+    - rate: a token bucket refills at tps tokens per second (holding at most burst tokens),
+      and each call takes a token
+    - spend: at most daily_budget calls per (local) day, counted across runs and processes;
+      the count is shared in CVLAB_CACHE/cloud-governor, with a locked read-modify-write
+      every SYNC_CALLS calls or SYNC_INTERVAL seconds, and for every request near the end
+      of the budget (so concurrent runs can't overspend it)
+    - priority: streams are offered requests in order of their weight times the time since
+      their last request, so streams get shares of the requests in proportion to their
+      weights (and streams of the same weight take turns)
+
+    Requests acquire() the calls they will make (e.g., one per crop); calls beyond that are
+    counted when they are made: retries (see retry()), and retries inside the cloud client
+    (see charge()). Thread-safe.
+
+    Denied frames should fall back to cached or previous (stale) results.
+    """
+    def __init__(self, tps: float = None, daily_budget: int = None, priorities: Dict[str, float] = None,
+                 burst: float = None):
+        self.tps = tps
+        self.burst = burst or max(1.0, tps or 1.0)
+        self.daily_budget = daily_budget
+        self.priorities = priorities or {}
+        self.tokens = self.burst
+        self.refilled = time.perf_counter()
+        self.served = {}  # per stream: time of the last granted request
+        self.lock = threading.Lock()
+
+        self.day = _today()
+        self.calls_today = 0  # shared count (all runs), as of the last sync
+        self.unsynced = 0     # calls of this run since the last sync
+        self._sync()
+
+    def weight(self, key: str) -> float:
+        return self.priorities.get(key, 1.0)
+
+    def order(self, keys: List[str]) -> List[str]:
+        """Streams in the order they should be offered requests"""
+        now = time.perf_counter()
+        return sorted(keys, key=lambda key: -self.weight(key) * (now - self.served.get(key, 0.0)))
+
+    def acquire(self, key: str, calls: int = 1) -> bool:
+        """Whether a request of this many calls may be sent for this stream now (and count them if so)"""
+        with self.lock:
+            self._new_day()
+            if self.tps:
+                now = time.perf_counter()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.tps)
+                self.refilled = now
+                if self.tokens < 1.0:
+                    PROFILER.count("cloud.governor.throttled")
+                    return False
+
+            if not self._take(calls):
+                PROFILER.count("cloud.governor.over_budget")
+                return False
+
+            if self.tps:
+                self.tokens -= calls  # requests of several calls go into debt
+            self.served[key] = time.perf_counter()
+            PROFILER.count("cloud.governor.granted")
+            return True
+
+    def retry(self, calls: int = 1) -> bool:
+        """Whether a failed request may be retried (within the budget; not rate limited), and count it if so"""
+        with self.lock:
+            self._new_day()
+            if not self._take(calls):
+                PROFILER.count("cloud.governor.over_budget")
+                return False
+            PROFILER.count("cloud.governor.retries", calls)
+            return True
+
+    def charge(self, calls: int):
+        """Count calls that were made without asking (e.g., retries inside the cloud client)"""
+        if calls <= 0:
+            return
+        with self.lock:
+            self._new_day()
+            self.unsynced += calls
+            PROFILER.count("cloud.governor.charged", calls)
+            self._maybe_sync()
+
+    def close(self):
+        """Add the remaining calls of this run to the shared count"""
+        with self.lock:
+            if self.unsynced:
+                self._sync()
+
+    def _take(self, calls: int) -> bool:
+        if self.daily_budget is not None and \
+                self.daily_budget - self.calls_today - self.unsynced - calls < SYNC_MARGIN:
+            # near the end of the budget: check and count against the shared count
+            return self._sync(reserve=calls)
+        self.unsynced += calls
+        self._maybe_sync()
+        return True
+
+    def _new_day(self):
+        today = _today()
+        if today != self.day:
+            if self.unsynced:
+                self._sync()  # add the last calls to the previous day
+            self.day, self.calls_today, self.unsynced = today, 0, 0
+            self._sync()
+
+    def _maybe_sync(self):
+        if self.unsynced >= SYNC_CALLS or (self.unsynced and time.perf_counter() - self.synced > SYNC_INTERVAL):
+            self._sync()
+
+    def _sync(self, reserve: int = 0) -> bool:
+        """Add this run's calls to the shared count; with reserve, also take that many calls if within budget"""
+        with cache_lock(GOVERNOR_CACHE, "calls"):
+            days = load_from_cache(GOVERNOR_CACHE, "calls") or {}  # day -> calls
+            calls = days.get(self.day, 0) + self.unsynced
+            granted = self.daily_budget is None or calls + reserve <= self.daily_budget
+            if granted:
+                calls += reserve
+            if calls != days.get(self.day, 0):
+                days[self.day] = calls
+                oldest = (datetime.date.fromisoformat(self.day) - datetime.timedelta(days=HISTORY_DAYS)).isoformat()
+                save_to_cache(GOVERNOR_CACHE, "calls", {day: n for (day, n) in days.items() if day > oldest})
+
+        self.calls_today, self.unsynced, self.synced = calls, 0, time.perf_counter()
+        return granted
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            calls_today = self.calls_today + self.unsynced
+            return {
+                "tps": self.tps,
+                "tokens": round(self.tokens, 2),
+                "calls_today": calls_today,
+                "budget_left": None if self.daily_budget is None else max(0, self.daily_budget - calls_today),
+            }
@@ -0,0 +1,77 @@
+import math
+from typing import Any, Dict, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from images.image import Image
+from images.image_type import ImageType
+from profiling import PROFILER
+
+
+# Packing several (downscaled) frames into one image, so one cloud request covers
+# several streams; see CloudObjects --mosaic.
+
+Placement = Tuple[int, int, int, int]  # (x, y, w, h) of a frame in the mosaic (px)
+
+
+def pack(images: Sequence[Image], tile_width: int) -> Tuple[np.ndarray, List[Placement]]:
+    """
+    Frames on a grid of tiles, each downscaled to fit its tile (keeping the aspect ratio)
+
+    Tiles are tile_width wide, and as high as the tallest frame needs.
+    """
+    imgs = [image.get(ImageType.OPENCV) for image in images]
+    columns = math.ceil(math.sqrt(len(imgs)))
+    rows = math.ceil(len(imgs) / columns)
+    tile_height = int(round(max(tile_width * img.shape[0] / img.shape[1] for img in imgs)))
+
+    mosaic = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+    placements = []
+    for i, img in enumerate(imgs):
+        height, width = img.shape[:2]
+        scale = min(tile_width / width, tile_height / height)
+        w, h = int(width * scale), int(height * scale)
+        x, y = (i % columns) * tile_width, (i // columns) * tile_height
+        resized = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        mosaic[y:y + h, x:x + w] = resized if resized.ndim == 3 else resized[:, :, np.newaxis]
+        placements.append((x, y, w, h))
+    return mosaic, placements
+
+
+def split_labels(labels: List[Dict[str, Any]], placements: List[Placement], mosaic_size: Tuple[int, int],
+                 tolerance: float = 0.02) -> List[List[Dict[str, Any]]]:
+    """
+    Split Rekognition labels (detect_labels) of a mosaic to its frames
+
+    Instances are assigned to the frame that contains their box (up to tolerance, as a fraction
+    of the frame size) and get coordinates relative to that frame; instances straddling frames
+    are discarded, as are labels without instances (e.g., 'Outdoors'), which can't be attributed.
+    """
+    mosaic_width, mosaic_height = mosaic_size
+    per_frame = [[] for _ in placements]
+    for label in labels:
+        instances = [[] for _ in placements]
+        for instance in label.get("Instances", []):
+            if "BoundingBox" not in instance:
+                continue
+            box = instance["BoundingBox"]
+            x1, y1 = box["Left"] * mosaic_width, box["Top"] * mosaic_height
+            x2, y2 = x1 + box["Width"] * mosaic_width, y1 + box["Height"] * mosaic_height
+            for i, (x, y, w, h) in enumerate(placements):
+                margin_x, margin_y = tolerance * w, tolerance * h
+                if x1 >= x - margin_x and y1 >= y - margin_y and x2 <= x + w + margin_x and y2 <= y + h + margin_y:
+                    left, top = max(x1 - x, 0) / w, max(y1 - y, 0) / h
+                    right, bottom = min(x2 - x, w) / w, min(y2 - y, h) / h
+                    bounding_box = {"Left": left, "Top": top, "Width": right - left, "Height": bottom - top}
+                    instances[i].append(dict(instance, BoundingBox=bounding_box))
+                    break
+            else:
+                PROFILER.count("cloud.mosaic.straddling")
+
+        for i, frame_instances in enumerate(instances):
+            if frame_instances:
+                per_frame[i].append(dict(label, Instances=frame_instances,
+                                         Confidence=max(instance.get("Confidence", label["Confidence"])
+                                                        for instance in frame_instances)))
+    return per_frame
@@ -0,0 +1,130 @@
+import time
+from collections import deque, defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Tuple, Dict, Any
+
+from images.image import Image
+from profiling import PROFILER
+from .provider import CloudProvider
+
+Request = namedtuple("Request", ["image", "future", "submitted"])
+
+
+class PipelinedProvider:
+    """
+    Keep several cloud calls in flight, instead of one blocking call per frame per stream
+
+    Frames are submitted to a thread pool of `workers` threads per stream (the provider's
+    client should be thread-safe and pool its connections; the pool is grown to workers
+    times the number of streams as streams come in, see CloudProvider.set_connections),
+    and completed results are collected per stream, in one of two delivery modes:
+    - "latest": the newest completed result wins; older requests are abandoned, and frames
+      are dropped while a stream already has `workers` requests in flight (live viewing)
+    - "ordered": results are delivered in submission order, and submit() waits for the
+      oldest request when a stream is at its limit (no frames are skipped)
+
+    Failed calls are retried with exponential backoff (if the governor allows; retries are
+    charged to it, as are retries inside the provider's client); requests that take longer
+    than timeout seconds are given up on. Counters and round-trip times go to the profiler.
+    """
+    DELIVERY_MODES = ("latest", "ordered")
+
+    def __init__(self, provider: CloudProvider, workers: int = 4, delivery: str = "latest",
+                 retries: int = 2, backoff: float = 0.2, timeout: float = 5.0, governor=None):
+        if delivery not in self.DELIVERY_MODES:
+            raise ValueError("Unknown delivery mode '{}', options: {}".format(delivery, ", ".join(self.DELIVERY_MODES)))
+        self.provider = provider
+        self.workers = workers
+        self.delivery = delivery
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.governor = governor  # RequestGovernor, optional
+        self.executors = {}  # per stream: thread pool
+        self.requests = defaultdict(deque)  # per stream: requests in flight, in submission order
+
+    def accepts(self, key: str) -> bool:
+        """Whether submit() would take a frame of this stream now (rather than drop it)"""
+        return self.delivery == "ordered" or len(self.requests[key]) < self.workers
+
+    def submit(self, key: str, image: Image) -> bool:
+        """Start processing a frame of a stream; returns False if the frame was dropped"""
+        requests = self.requests[key]
+        if len(requests) >= self.workers:
+            if self.delivery == "latest":
+                PROFILER.count("cloud.dropped")
+                return False
+            wait([requests[0].future], timeout=max(0.0, self.timeout - (time.perf_counter() - requests[0].submitted)))
+
+        if key not in self.executors:
+            self.executors[key] = ThreadPoolExecutor(self.workers, thread_name_prefix="cloud{}".format(key))
+            self.provider.set_connections(self.workers * len(self.executors))
+        requests.append(Request(image, self.executors[key].submit(self._call, image), time.perf_counter()))
+        PROFILER.count("cloud.submitted")
+        return True
+
+    def collect(self, key: str) -> List[Tuple[Image, Dict[str, Any]]]:
+        """Completed (frame, metadata) pairs of a stream to deliver now, oldest first"""
+        requests = self.requests[key]
+        now = time.perf_counter()
+        delivered = []
+
+        if self.delivery == "ordered":
+            while requests and (requests[0].future.done() or now - requests[0].submitted > self.timeout):
+                self._deliver(requests.popleft(), now, delivered)
+        else:
+            completed = [i for (i, request) in enumerate(requests) if request.future.done()]
+            for i in range(completed[-1] + 1 if completed else 0):
+                request = requests.popleft()
+                if i == completed[-1]:
+                    self._deliver(request, now, delivered)
+                else:
+                    # superseded by a newer result
+                    request.future.cancel()
+                    PROFILER.count("cloud.superseded")
+            while requests and now - requests[0].submitted > self.timeout:
+                self._deliver(requests.popleft(), now, delivered)
+
+        return delivered
+
+    def _deliver(self, request: Request, now: float, delivered: list):
+        if not request.future.done():
+            PROFILER.count("cloud.timeouts")
+            return
+        try:
+            metadata = request.future.result()
+        except Exception as ex:
+            PROFILER.count("cloud.failed")
+            print("!! Cloud request failed, skipping: {}".format(ex))
+            return
+        PROFILER.record("cloud.roundtrip", now - request.submitted, start=request.submitted)
+        delivered.append((request.image, metadata))
+
+    def _call(self, image: Image) -> Dict[str, Any]:
+        for attempt in range(self.retries + 1):
+            try:
+                metadata = self.provider.process(image)
+            except Exception:  # network errors, throttling, ..
+                if attempt == self.retries or (self.governor and not self.governor.retry(self.provider.calls(image))):
+                    raise
+                PROFILER.count("cloud.retries")
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            if self.governor:
+                self.governor.charge(metadata.get("retries", 0))
+            return metadata
+
+    def wait(self):
+        """Wait until all requests in flight are done (or timed out), e.g. at the end of the streams"""
+        for requests in self.requests.values():
+            for request in requests:
+                wait([request.future], timeout=max(0.0, self.timeout - (time.perf_counter() - request.submitted)))
+
+    def close(self):
+        for requests in self.requests.values():
+            for request in requests:
+                request.future.cancel()
+        self.requests.clear()
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
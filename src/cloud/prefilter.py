@@ -0,0 +1,140 @@
+import weakref
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from images.image import Image
+from images.image_type import ImageType
+from profiling import PROFILER
+from .provider import CloudProvider
+
+
+PREFILTER_MODES = ("frame", "crops")
+
+
+class PrefilteredProvider(CloudProvider):
+    """
+    Cloud face detection behind a cheap local detector
+
+    The local detector (e.g., a Haar cascade) proposes candidate faces; frames without
+    candidates shouldn't be sent at all (see regions(), called before the request). Frames
+    with candidates are sent whole ("frame" mode), or only as padded crops around the
+    candidates ("crops" mode: one request per region, overlapping regions merged), with
+    the cloud results mapped back to (relative) full-frame coordinates.
+
+    Other calls are passed on to the wrapped provider.
+    """
+    MIN_CROP = 80  # Rekognition minimum image size (px)
+
+    def __init__(self, provider: CloudProvider, detector: Callable[[np.ndarray], np.ndarray],
+                 mode: str = "frame", padding: float = 0.5):
+        """
+        detector: frame (BGR) -> N x 4 array of candidate boxes (x1, y1, x2, y2)
+        padding: crops extend this fraction of the candidate size on each side
+        """
+        if mode not in PREFILTER_MODES:
+            raise ValueError("Unknown prefilter mode '{}', options: {}".format(mode, ", ".join(PREFILTER_MODES)))
+        self.provider = provider
+        self.detector = detector
+        self.mode = mode
+        self.padding = padding
+        self.KEYSTROKES = provider.KEYSTROKES
+        self.regions_of = weakref.WeakKeyDictionary()  # Image -> regions, computed once per frame
+
+    def load(self, *args, **kwargs) -> None:
+        self.provider.load(*args, **kwargs)
+
+    def set_connections(self, connections: int) -> None:
+        self.provider.set_connections(connections)
+
+    def regions(self, image: Image) -> np.ndarray:
+        """Padded regions (x1, y1, x2, y2; px) around the candidate faces in a frame"""
+        if image in self.regions_of:
+            return self.regions_of[image]
+
+        img = image.get(ImageType.OPENCV)
+        height, width = img.shape[:2]
+        boxes = np.asarray(self.detector(img), dtype=np.float32).reshape(-1, 4)
+        PROFILER.count("cloud.prefilter.candidates", len(boxes))
+
+        pad = (boxes[:, 2:] - boxes[:, :2]) * self.padding
+        regions = np.concatenate([boxes[:, :2] - pad, boxes[:, 2:] + pad], axis=1)
+        regions = merge_overlapping(regions)
+        # at least the minimum size (unless the frame is smaller), shifted inside the frame
+        frame = np.array([width, height], dtype=np.float32)
+        centres, sizes = (regions[:, :2] + regions[:, 2:]) / 2, regions[:, 2:] - regions[:, :2]
+        sizes = np.minimum(np.maximum(np.round(sizes), self.MIN_CROP), frame)
+        corners = np.clip(np.round(centres - sizes / 2), 0, frame - sizes)
+        regions = np.concatenate([corners, corners + sizes], axis=1).astype(np.int32)
+
+        self.regions_of[image] = regions
+        return regions
+
+    def calls(self, image: Image) -> int:
+        regions = self.regions(image)
+        return len(regions) if self.mode == "crops" else min(len(regions), 1)
+
+    def process(self, image: Image) -> Dict[str, Any]:
+        regions = self.regions(image)
+        if len(regions) == 0:
+            PROFILER.count("cloud.prefilter.skipped")
+            return {"faces": [], "calls": 0}
+        if self.mode == "frame":
+            return dict(self.provider.process(image), calls=1)
+
+        img = image.get(ImageType.OPENCV)
+        height, width = img.shape[:2]
+        faces, latency, payload, retries = [], 0.0, 0, 0
+        for x1, y1, x2, y2 in regions.tolist():
+            crop = Image(img[y1:y2, x1:x2], copy=False, opencv=True)
+            metadata = self.provider.process(crop)
+            faces += [crop_to_frame(face, (x1, y1, x2 - x1, y2 - y1), (width, height)) for face in metadata["faces"]]
+            latency += metadata.get("latency", 0.0)
+            payload += metadata.get("payload_bytes", 0)
+            retries += metadata.get("retries", 0)
+        PROFILER.count("cloud.prefilter.crops", len(regions))
+        return {"faces": faces, "latency": latency, "payload_bytes": payload, "calls": len(regions), "retries": retries}
+
+    def results(self, image: Image, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        return self.provider.results(image, metadata)
+
+    def visualise(self, image: Image, metadata: Dict[str, Any]) -> Image:
+        return self.provider.visualise(image, metadata)
+
+    def handle_command(self, key):
+        self.provider.handle_command(key)
+
+
+def merge_overlapping(boxes: np.ndarray) -> np.ndarray:
+    """Replace overlapping boxes (x1, y1, x2, y2) by their union, until none overlap"""
+    merged = [box for box in boxes]  # type: List[np.ndarray]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    merged[i] = np.concatenate([np.minimum(a[:2], b[:2]), np.maximum(a[2:], b[2:])])
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return np.array(merged, dtype=np.float32).reshape(-1, 4)
+
+
+def crop_to_frame(face: Dict[str, Any], crop, frame_size) -> Dict[str, Any]:
+    """Map a Rekognition face from relative crop coordinates to relative frame coordinates"""
+    (x, y, w, h), (width, height) = crop, frame_size
+    face = dict(face)
+    box = face["BoundingBox"]
+    face["BoundingBox"] = {
+        "Left": (x + box["Left"] * w) / width,
+        "Top": (y + box["Top"] * h) / height,
+        "Width": box["Width"] * w / width,
+        "Height": box["Height"] * h / height,
+    }
+    face["Landmarks"] = [dict(landmark, X=(x + landmark["X"] * w) / width, Y=(y + landmark["Y"] * h) / height)
+                         for landmark in face.get("Landmarks", [])]
+    return face
@@ -34,6 +34,26 @@ class CloudProvider:
         """
         raise NotImplementedError()
 
+    def set_connections(self, connections: int) -> None:
+        """
+        Make room for this many concurrent process() calls (e.g., grow a connection pool)
+        """
+        pass
+
+    def calls(self, image: Image) -> int:
+        """
+        Number of (paid) requests process() makes for an Image; 0 if it doesn't need any
+        """
+        return 1
+
+    def results(self, image: Image, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Compact, provider-independent results given the result of process()
+
+        Results are numpy arrays in image coordinates (see dnn.loader.ModelLoader.results).
+        """
+        raise NotImplementedError()
+
     def visualise(self, image: Image, metadata: Dict[str, Any]) -> Image:
         """
         Annotate the image given the result of process()
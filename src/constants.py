@@ -1,3 +1,6 @@
 import os
 
 CACHE = os.environ.get("CVLAB_CACHE", os.path.expanduser("~/.cvlab/"))
+
+# Local model files (e.g., for the OpenCV DNN loader)
+MODELS_DIR = os.environ.get("CVLAB_MODELS", os.path.join(CACHE, "models"))
@@ -0,0 +1,91 @@
+from typing import List, Tuple
+
+from profiling import PROFILER
+
+
+class ResolutionController:
+    """
+    Adapt the model input resolution to hold a target frame rate
+
+    Per-frame latencies are smoothed with an exponential moving average. When the average
+    stays above the frame budget (1 / fps) for `patience` frames, the resolution steps down;
+    when it stays below the budget by a margin, and the next level up is expected to fit
+    (latency scales with the number of pixels), it steps up. The margins (hysteresis) and
+    the patience keep the resolution from flip-flopping around the target, and the first
+    frames after a change (new input shapes are slow to run the first time) aren't counted.
+
+    Resolutions are the (short, max_size) arguments of the loaders' process_batch(),
+    stepping by 32 pixels between the bounds.
+    """
+    def __init__(self, fps: float, min_short: int = 224, max_short: int = 512, start: int = None,
+                 step: int = 32, aspect: float = 1.25, alpha: float = 0.2, hysteresis: float = 0.15,
+                 patience: int = 5, settle: int = 2):
+        """
+        fps: target frame rate
+        min_short, max_short: bounds of the short side of the model input (px)
+        start: initial short side (default: max_short)
+        aspect: max_size / short
+        alpha: weight of the newest latency in the moving average
+        hysteresis: step down above budget * (1 + hysteresis), up below budget * (1 - hysteresis)
+        patience: consecutive frames beyond a margin before changing
+        settle: frames not counted after a change
+        """
+        self.budget = 1.0 / fps
+        self.levels = list(range(min_short, max_short + 1, step))  # type: List[int]
+        self.aspect = aspect
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.patience = patience
+        self.settle = settle
+
+        start = start or max_short
+        self.level = min(range(len(self.levels)), key=lambda i: abs(self.levels[i] - start))
+        self.average = None
+        self.streak = 0    # consecutive frames over (> 0) or under (< 0) the budget
+        self.skip = settle
+
+    @property
+    def resolution(self) -> Tuple[int, int]:
+        """Current (short, max_size)"""
+        short = self.levels[self.level]
+        return short, int(round(short * self.aspect / 32) * 32)
+
+    def update(self, latency: float) -> Tuple[int, int]:
+        """Add the latency (s) of a frame; returns the resolution for the next frame"""
+        if self.skip > 0:
+            self.skip -= 1
+            return self.resolution
+
+        self.average = latency if self.average is None else self.alpha * latency + (1 - self.alpha) * self.average
+        PROFILER.record("adaptive.latency", self.average)
+
+        if self.average > self.budget * (1 + self.hysteresis):
+            self.streak = max(self.streak, 0) + 1
+        elif self.average < self.budget * (1 - self.hysteresis):
+            self.streak = min(self.streak, 0) - 1
+        else:
+            self.streak = 0
+
+        if self.streak >= self.patience and self.level > 0:
+            self._change(self.level - 1)
+        elif self.streak <= -self.patience and self.level < len(self.levels) - 1:
+            # only step up if the larger input is expected to fit the budget as well
+            growth = (self.levels[self.level + 1] / self.levels[self.level]) ** 2
+            if self.average * growth < self.budget:
+                self._change(self.level + 1)
+
+        return self.resolution
+
+    def _change(self, level: int):
+        before = self.resolution
+        direction = "up" if level > self.level else "down"
+        average = self.average
+        self.level = level
+        self.streak = 0
+        self.skip = self.settle
+        # expected latency at the new resolution, so the average doesn't need to start over
+        self.average *= (self.levels[level] / before[0]) ** 2
+
+        PROFILER.count("adaptive." + direction)
+        print("[adaptive] {:.1f}ms/frame (target {:.1f}ms): resolution {} from {} to {}".format(
+            1000 * average, 1000 * self.budget, direction, before, self.resolution))
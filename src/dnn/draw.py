@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+# Drawing helpers shared by the model loaders (no framework imports)
+
+
+def draw_captions(img: np.ndarray, captions, colour=(255, 255, 255), thickness=3, scale=1,
+                  offset=(20, 20), font=cv2.FONT_HERSHEY_SIMPLEX):
+    """Draw one or more strings at the bottom of the image"""
+    for i, caption in enumerate(reversed(captions)):
+        location = (offset[0], img.shape[0] - 40*i - offset[1])
+        cv2.putText(img, caption, location,
+                    fontFace=font, fontScale=scale, color=colour, thickness=thickness)
+
+    return img
+
+
+def voc_palette(num_classes: int = 256) -> np.ndarray:
+    """
+    Pascal VOC colour map as a (num_classes, 3) uint8 RGB lookup table
+
+    Same colours as gluoncv.utils.viz.get_color_pallete(.., "pascal_voc"): the bits
+    of the class id are spread over the high bits of the three channels.
+    """
+    ids = np.arange(num_classes)
+    palette = np.zeros((num_classes, 3), dtype=np.uint8)
+    for shift in range(8):
+        for channel in range(3):
+            palette[:, channel] |= (((ids >> (3 * shift + channel)) & 1) << (7 - shift)).astype(np.uint8)
+    return palette
+
+
+# Lookup tables for cv2.LUT: (1, 256, 3) uint8, RGB and BGR
+VOC_LUT = voc_palette().reshape(1, 256, 3)
+VOC_LUT_BGR = VOC_LUT[:, :, ::-1].copy()
+
+
+def draw_boxes(img: np.ndarray, boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray, class_names,
+               track_ids: np.ndarray = None, thickness=2, scale=0.5, font=cv2.FONT_HERSHEY_SIMPLEX):
+    """Draw labelled (x1, y1, x2, y2) boxes, one colour per class (or per track, if track ids are given)"""
+    palette = VOC_LUT_BGR[0]
+    for i, (box, score, label) in enumerate(zip(boxes.astype(np.int32), scores, labels)):
+        name = class_names[label] if label < len(class_names) else str(label)
+        if track_ids is None:
+            colour = tuple(int(c) for c in palette[(int(label) + 1) % len(palette)])
+            caption = "{} {:.2f}".format(name, score)
+        else:
+            colour = tuple(int(c) for c in palette[(int(track_ids[i]) % (len(palette) - 1)) + 1])
+            caption = "#{} {} {:.2f}".format(track_ids[i], name, score)
+        cv2.rectangle(img, (box[0], box[1]), (box[2], box[3]), colour, thickness)
+        cv2.putText(img, caption, (box[0], max(box[1] - 4, 10)), font, scale, colour, 1, cv2.LINE_AA)
+    return img
+
+
+def draw_segmentation(img: np.ndarray, label_map: np.ndarray, class_names, blend=0.5, show_labels=True,
+                      bgr=False, inplace=False) -> np.ndarray:
+    """
+    Blend a uint8 label map (same size as the image), coloured with the VOC palette, with the image,
+    and caption the largest classes (except the largest, usually background)
+
+    Colours come from a precomputed lookup table and class sizes from a bincount, so the only
+    full-frame array created is the colour image, which is also where the result is blended
+    into, unless inplace (then the image itself is overwritten).
+    """
+    colours = cv2.LUT(cv2.cvtColor(label_map, cv2.COLOR_GRAY2BGR), VOC_LUT_BGR if bgr else VOC_LUT)
+    out = img if inplace else colours
+    cv2.addWeighted(img, 1 - blend, colours, blend, 0, dst=out)
+
+    if show_labels:
+        counts = np.bincount(label_map.ravel())
+        top_ids = np.argsort(counts)[::-1][1:5]
+        captions = ["{} ({}px)".format(class_names[id] if id < len(class_names) else id, counts[id])
+                    for id in top_ids if counts[id] > 0]
+        draw_captions(out, captions)
+
+    return out
@@ -1,5 +1,6 @@
 from enum import Enum
 from typing import Dict, Any
+import importlib
 
 from images.image import Image
 
@@ -30,6 +31,17 @@ class ModelLoader:
         """
         raise NotImplementedError()
 
+    def results(self, image: Image, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Compact, framework-independent results given the result of process()
+
+        Results are numpy arrays in image coordinates, for example:
+        - classification -> labels, scores (top-k), names (all class names)
+        - object detection -> boxes (N x 4: x1, y1, x2, y2), scores, labels, names
+        - segmentation -> label_map (H x W, uint8), names
+        """
+        raise NotImplementedError()
+
     def visualise(self, image: Image, metadata: Dict[str, Any]) -> Image:
         """
         Annotate the image given the result of process()
@@ -47,3 +59,19 @@ class ModelType(Enum):
     DETECTION       = 1
     SEGMENTATION    = 2
 
+
+
+# Available loaders: name -> (module, class); imported when used, as frameworks are heavy to import
+LOADERS = {
+    "mxnet": ("dnn.mxnet", "MxnetLoader"),
+    "opencv": ("dnn.opencv", "OpencvLoader"),
+}
+
+
+def create_loader(name: str = "mxnet", **options) -> ModelLoader:
+    """Create a model loader by name, passing the given (not None) options to its constructor"""
+    if name not in LOADERS:
+        raise ValueError("Unknown model loader '{}', options: {}".format(name, ", ".join(LOADERS)))
+    _module, _class = LOADERS[name]
+    loader_class = getattr(importlib.import_module(_module), _class)
+    return loader_class(**{key: value for (key, value) in options.items() if value is not None})
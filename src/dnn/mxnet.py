@@ -1,11 +1,21 @@
-from typing import Dict, Any
+from collections import defaultdict, OrderedDict
+from typing import Dict, Any, List, Sequence, Tuple
+import hashlib
+import os
+import threading
+import time
 import mxnet as mx
 import gluoncv as gcv
 import numpy as np
 import cv2
 
+from constants import CACHE
 from images.image import Image
+from utils import save_to_cache, load_from_cache
+from profiling import PROFILER, timed
+from .draw import draw_captions, draw_segmentation
 from .loader import ModelLoader, ModelType
+from .preprocess import Preprocessor, cached, resize_geometry
 
 
 FRIENDLY_NAMES = {
@@ -33,73 +43,326 @@ FRIENDLY_NAMES = {
 }
 
 
+# Process-wide registry of loaded networks, shared by all loaders: (model name, ctx) -> network,
+# and (quantized model cache prefix, ctx) -> (network, class names)
+MODELS = {}
+WARM_SHAPES = set()  # (model name, ctx, input shape) that have been run at least once
+MODELS_LOCK = threading.RLock()
+
+QUANTIZED_CACHE = "mxnet-int8"  # cache namespace (folder) of quantized symbols and params
+
+
+def get_model(model_name: str, ctx, debug: bool = True):
+    """
+    Load a pretrained gluoncv network, or reuse it if it was loaded before in this process
+
+    Networks are hybridized with static memory allocation. Shapes aren't static,
+    as the batch size varies with the number of (changed) streams.
+    """
+    key = (model_name, str(ctx))
+    with MODELS_LOCK:
+        if key not in MODELS:
+            model = gcv.model_zoo.get_model(model_name, pretrained=True, ctx=ctx)
+            model.hybridize(static_alloc=True)
+            MODELS[key] = model
+        elif debug:
+            print("[mxnet] reusing loaded model {} on {}".format(model_name, ctx))
+        return MODELS[key]
+
+
+def get_quantized_model(model_name: str, ctx, calibration: str, input_size: Tuple[int, int] = (480, 640),
+                        num_calibration: int = 32, debug: bool = True):
+    """
+    INT8 version of a pretrained gluoncv network (CPU, MKL-DNN), calibrated on local images
+
+    The network is calibrated on (at most num_calibration) images from the calibration directory,
+    resized to the model input for input_size (height, width). The quantized symbol and params are
+    cached per model and calibration set, so calibration only runs once.
+
+    Returns the network and its class names (which the quantized network doesn't know about).
+    """
+    from streams.directory import DirectoryStream
+
+    if ctx.device_type != "cpu":
+        raise ValueError("[mxnet] INT8 quantization is only supported on CPU, not on {}".format(ctx))
+
+    stream = DirectoryStream(calibration)
+    files = stream.files[:num_calibration]
+    if not files:
+        raise ValueError("[mxnet] no calibration images found in {}".format(calibration))
+
+    # one cache entry per model, calibration set and input size
+    digest = hashlib.md5("\n".join(files + [str(input_size)]).encode()).hexdigest()[:8]
+    name = "{}-{}".format(model_name, digest)
+    prefix = os.path.join(CACHE, QUANTIZED_CACHE, name)
+
+    key = (prefix, str(ctx))
+    with MODELS_LOCK:
+        if key in MODELS:
+            if debug:
+                print("[mxnet] reusing quantized model {} on {}".format(name, ctx))
+            return MODELS[key]
+
+        classes = load_from_cache(QUANTIZED_CACHE, name + "-classes")
+        if classes is None or not os.path.exists(prefix + "-symbol.json"):
+            images = [stream.get() for _ in files]
+            classes = _quantize(model_name, ctx, images, input_size, prefix, debug)
+            save_to_cache(QUANTIZED_CACHE, name + "-classes", classes)
+        elif debug:
+            print("[mxnet] loading cached quantized model {}".format(prefix))
+
+        model = mx.gluon.SymbolBlock.imports(prefix + "-symbol.json", ["data"], prefix + "-0000.params", ctx=ctx)
+        model.hybridize(static_alloc=True)
+        MODELS[key] = (model, classes)
+        return MODELS[key]
+
+
+def _quantize(model_name: str, ctx, images: Sequence[Image], input_size: Tuple[int, int], prefix: str,
+              debug: bool = True) -> List[str]:
+    """Quantize the FP32 network, with naive (min/max) calibration; writes prefix-symbol.json and prefix-0000.params"""
+    _start = time.perf_counter()
+    model = get_model(model_name, ctx, debug)
+    size = resize_geometry(input_size[0], input_size[1], short=512, max_size=640)
+    calibration_data = Preprocessor().batch(images, size)[0].copy()
+
+    # export the (hybridized) network as a symbol; the graph is built by a first forward pass
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    model(mx.nd.array(calibration_data[:1], ctx=ctx))
+    model.export(prefix + "-fp32")
+    sym, arg_params, aux_params = mx.model.load_checkpoint(prefix + "-fp32", 0)
+
+    # fuse operators (conv + bn + relu, ..) for MKL-DNN before and after quantization
+    before, after = _quantization_backends()
+    sym = sym.get_backend_symbol(before)
+    qsym, qarg_params, qaux_params = mx.contrib.quantization.quantize_model(
+        sym=sym, arg_params=arg_params, aux_params=aux_params, data_names=("data",), label_names=(),
+        ctx=ctx, calib_mode="naive", calib_data=mx.io.NDArrayIter(calibration_data, batch_size=1),
+        num_calib_examples=len(images), quantized_dtype="auto")
+    qsym = qsym.get_backend_symbol(after)
+    mx.model.save_checkpoint(prefix, 0, qsym, qarg_params, qaux_params)
+
+    if debug:
+        print("[mxnet] quantized {} on {} images in {:.1f}s".format(
+            model_name, len(images), time.perf_counter() - _start))
+    return class_names(model)
+
+
+def _quantization_backends() -> Tuple[str, str]:
+    """MKL-DNN graph passes to run before and after quantize_model (renamed in MXNet 1.6)"""
+    version = tuple(int(v) for v in mx.__version__.split(".")[:2])
+    if version < (1, 6):
+        return "MKLDNN", "MKLDNN_POST_QUANTIZE"
+    return "MKLDNN_QUANTIZE", "MKLDNN_QUANTIZE"
+
+
+def class_names(model) -> List[str]:
+    classes = model.classes
+    if isinstance(classes, property):
+        # NOTE: a bug in gluoncv currently returns a property of a class, instead of an instance of the class,
+        #       for all Segmentation models; we need to obtain the property value (passing a bogus self)
+        classes = classes.fget(0)
+    return list(classes)
+
+
 class MxnetLoader(ModelLoader):
     def __init__(self, ctx=None):
         self.model = None
+        self.model_name = None
         self.model_type = None
+        self.classes = None
+        self.debug = True
         default_ctx = mx.context.gpu() if mx.context.num_gpus() else mx.context.cpu()
         self.ctx = ctx or default_ctx
+        self.preprocessors = {}       # (mean, std) -> Preprocessor
+        self.inputs = OrderedDict()   # input shape -> reused input tensor on self.ctx
+
+    def load(self, model_name: str, model_type: ModelType = None, debug : bool = True,
+             warmup: Sequence[Tuple[int, int]] = ((480, 640),), quantize: str = None) -> None:
+        """
+        Load a model (shared with other loaders in this process, see get_model)
 
-    def load(self, model_name: str, model_type: ModelType = None, debug : bool = True) -> None:
+        warmup: expected image sizes (height, width); the model is run once at the
+                corresponding input shapes, so the first real frame doesn't pay for
+                graph construction and memory allocation
+        quantize: directory with calibration images; runs an INT8 version of the model
+                  (CPU only, see get_quantized_model), calibrated for the first warmup size
+        """
         _model_name, _model_type = FRIENDLY_NAMES.get(model_name) or (model_name, model_type)
+        self.debug = debug
         if debug:
-            print("[mxnet] loading {} model {} on {}".format(_model_type.name, _model_name, self.ctx))
+            print("[mxnet] loading {} model {} on {}{}".format(
+                _model_type.name, _model_name, self.ctx, " (INT8)" if quantize else ""))
 
-        self.model = gcv.model_zoo.get_model(_model_name, pretrained=True, ctx=self.ctx)
-        self.model.hybridize()
+        if quantize:
+            self.model_name = _model_name + "-int8"
+            self.model, self.classes = get_quantized_model(
+                _model_name, self.ctx, quantize, input_size=warmup[0] if warmup else (480, 640), debug=debug)
+        else:
+            self.model_name = _model_name
+            self.model = get_model(_model_name, self.ctx, debug)
+            self.classes = class_names(self.model)
         self.model_type = _model_type
 
+        for height, width in warmup:
+            self.warmup(height, width)
+
+    def warmup(self, height: int, width: int, batch_size: int = 1, short=512, max_size=640):
+        """Run the model once on an empty input, for images of the given size"""
+        shape = (batch_size, 3) + resize_geometry(height, width, short, max_size)
+        key = (self.model_name, str(self.ctx), shape)
+        if key in WARM_SHAPES:
+            return
+
+        _start = time.perf_counter()
+        inputs = cached(self.inputs, shape, lambda: mx.nd.empty(shape, ctx=self.ctx))
+        inputs[:] = 0
+        self.forward(inputs)
+        mx.nd.waitall()
+        WARM_SHAPES.add(key)
+        if self.debug:
+            print("[mxnet] warmed up {} for input {} in {:.2f}s".format(
+                self.model_name, shape, time.perf_counter() - _start))
+
     def process(self, image: Image, short=512, max_size=640,
                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)) -> Dict[str, Any]:
+        return self.process_batch([image], short, max_size, mean, std)[0]
+
+    def process_batch(self, images: Sequence[Image], short=512, max_size=640,
+                      mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)) -> List[Dict[str, Any]]:
+        """
+        Run inference on several images (e.g., one per stream) with as few forward passes as possible
+
+        Images with the same model input size (after resizing) are stacked into a single NCHW
+        batch. Returns the results per image, in the same format as process().
+        """
         if not self.model:
             raise RuntimeError("[mxnet] No model has been loaded. Run load() first.")
 
-        # preprocess
-        np_img = image.asnumpy()
-        mx_img = mx.nd.array(np_img).astype('uint8')
-        mx_img = gcv.data.transforms.image.resize_short_within(mx_img, short=short, max_size=max_size, mult_base=32)
-        ts_img = mx.nd.image.to_tensor(mx_img).copyto(self.ctx)
-        ts_img = mx.nd.image.normalize(ts_img, mean=mean, std=std).expand_dims(0)
+        metadata = [None] * len(images)
+        with timed("mxnet.process"):
+            if (mean, std) not in self.preprocessors:
+                self.preprocessors[(mean, std)] = Preprocessor(mean, std)
+            preprocessor = self.preprocessors[(mean, std)]
+
+            batches = defaultdict(list)
+            for i, image in enumerate(images):
+                batches[preprocessor.target_size(image, short, max_size)].append(i)
+
+            # run model, once per input size
+            for size, indices in batches.items():
+                # preprocess (into reused buffers), scales: model input -> image coordinates
+                batch, scales = preprocessor.batch([images[i] for i in indices], size)
+                inputs = cached(self.inputs, batch.shape, lambda: mx.nd.empty(batch.shape, ctx=self.ctx))
+                inputs[:] = batch
 
-        # run model
+                outputs = self.forward(inputs)
+                for j, i in enumerate(indices):
+                    metadata[i] = self.split_outputs(outputs, j, scales[j])
+
+            if PROFILER.enabled:
+                # mxnet runs asynchronously; wait for the results to time the actual computation
+                mx.nd.waitall()
+
+        return metadata
+
+    def forward(self, batch):
         if hasattr(self.model, "predict"):
             # Some models have this method (i.e., segmentation models), some don't
-            outputs = self.model.predict(ts_img)
-        else:
-            outputs = self.model(ts_img)
+            return self.model.predict(batch)
 
+        outputs = self.model(batch)
+        if self.model_type is ModelType.SEGMENTATION and isinstance(outputs, (list, tuple)):
+            # exported (quantized) segmentation networks also return the auxiliary output
+            outputs = outputs[0]
+        return outputs
+
+    def split_outputs(self, outputs, index: int, scale) -> Dict[str, Any]:
+        """Metadata for one image of a batch (keeping a batch dimension of 1)"""
         if self.model_type is ModelType.CLASSIFICATION:
             return {
-                "class_ids": outputs
+                "class_ids": outputs[index:index+1]
             }
         elif self.model_type is ModelType.DETECTION:
             return {
-                "class_ids": outputs[0],
-                "scores": outputs[1],
-                "bounding_boxes": outputs[2]
+                "class_ids": outputs[0][index:index+1],
+                "scores": outputs[1][index:index+1],
+                "bounding_boxes": outputs[2][index:index+1],
+                "scale": scale,
             }
         elif self.model_type is ModelType.SEGMENTATION:
             return {
-                "mask": outputs
+                "mask": outputs[index:index+1],
+                "scale": scale,
             }
         else:
             return {
                 "outputs": outputs
             }
 
+    def results(self, image: Image, metadata: Dict[str, Any], thresh=0.5, top_k=5) -> Dict[str, Any]:
+        if "boxes" in metadata or "label_map" in metadata:
+            # already results (e.g., from tiled processing, see dnn.tiling)
+            return metadata
+
+        elif all(key in metadata for key in ["bounding_boxes", "scores", "class_ids"]):
+            # object detection: drop padding (class -1) and low scores, scale boxes to the image
+            class_ids = metadata["class_ids"][0].asnumpy().ravel()
+            scores = metadata["scores"][0].asnumpy().ravel()
+            boxes = metadata["bounding_boxes"][0].asnumpy()
+            keep = (class_ids >= 0) & (scores >= thresh)
+            scale_x, scale_y = metadata.get("scale", (1, 1))
+            class_names = self.class_names()
+
+            labels = class_ids[keep].astype(np.int32)
+            return {
+                "boxes": (boxes[keep] * np.array([scale_x, scale_y, scale_x, scale_y])).astype(np.float32),
+                "scores": scores[keep].astype(np.float32),
+                "labels": labels,
+                "names": [class_names[label] for label in labels],
+            }
+
+        elif "class_ids" in metadata:
+            # classification: top-k classes
+            scores = mx.nd.softmax(metadata["class_ids"])[0].asnumpy()
+            labels = np.argsort(scores)[::-1][:top_k].astype(np.int32)
+            class_names = self.class_names()
+
+            return {
+                "labels": labels,
+                "scores": scores[labels].astype(np.float32),
+                "names": [class_names[label] for label in labels],
+            }
+
+        elif "mask" in metadata:
+            # segmentation: label map at image resolution
+            width, height = image.size
+            return {
+                "label_map": cv2.resize(label_map(metadata["mask"]), (width, height), interpolation=cv2.INTER_NEAREST),
+                "names": self.class_names(),
+            }
+
+        else:
+            raise ValueError(
+                "Don't know how to get results from metadata with keys " + ",".join(metadata.keys()))
+
+    def class_names(self):
+        return self.classes
+
     def visualise(self, image: Image, metadata: Dict[str, Any], blend=0.5, show_labels=True):
+        with timed("mxnet.visualise"):
+            return self._visualise(image, metadata, blend, show_labels)
+
+    def _visualise(self, image: Image, metadata: Dict[str, Any], blend, show_labels):
         np_img = image.asnumpy()
-        mx_img = mx.nd.array(np_img).astype('uint8')
 
         img = None
-        if all(key in metadata for key in ["bounding_boxes", "scores", "class_ids"]):
-            # object detection results
-            bounding_boxes = metadata["bounding_boxes"]
-            scores = metadata["scores"]
-            class_ids = metadata["class_ids"]
+        if "boxes" in metadata or all(key in metadata for key in ["bounding_boxes", "scores", "class_ids"]):
+            # object detection results (boxes scaled to the full image)
+            results = self.results(image, metadata)
 
             img = gcv.utils.viz.cv_plot_bbox(
-                mx_img, bounding_boxes[0], scores[0], class_ids[0], class_names=self.model.classes)
+                np_img.copy(), results["boxes"], results["scores"], results["labels"],
+                thresh=0, class_names=self.class_names())
 
         elif "class_ids" in metadata:
             # classification results
@@ -107,44 +370,28 @@ class MxnetLoader(ModelLoader):
             scores = mx.nd.softmax(class_ids)[0].asnumpy()
 
             top_ids = mx.nd.topk(class_ids, k=3)[0].astype("int").asnumpy()
-            captions = ["{}: {:.3}".format(self.model.classes[id], scores[id])
+            captions = ["{}: {:.3}".format(self.classes[id], scores[id])
                         for id in top_ids]
-            img = draw_captions(np_img, captions) if show_labels else np_img
+            img = draw_captions(np_img.copy(), captions) if show_labels else np_img.copy()
 
         elif "mask" in metadata:
-            # segmentation results
+            # segmentation results, at model resolution
             mask = metadata["mask"]
-            img_resized = gcv.data.transforms.image.imresize(mx_img, mask.shape[3], mask.shape[2]).asnumpy()
-
-            predict = mx.nd.argmax(mask, 1)[0].astype("int").asnumpy()
-            mask_colour = gcv.utils.viz.get_color_pallete(predict, "pascal_voc")
-            mask_colour = np.array(mask_colour.convert("RGB")) # PIL with palette -> numpy RGB
-            img = cv2.addWeighted(img_resized, 1 - blend, mask_colour, blend, 0)
-
-            if show_labels:
-                classfreqs = list(zip(*np.unique(predict, return_counts=True)))
-                classfreqs = sorted(classfreqs, key=lambda cf: cf[1], reverse=True)
-                # NOTE: a bug in gluoncv currently returns a property of a class, instead of an instance of the class,
-                #       for all Segmentation models; we need to obtain the property value (passing a bogus self)
-                model_classes = self.model.classes.fget(0)
-                captions = ["{} ({}px)".format(model_classes[id], freq)
-                            for (id, freq) in classfreqs[1:5]]
-                img = draw_captions(img, captions)
+            img_resized = cv2.resize(np_img, (mask.shape[3], mask.shape[2]), interpolation=cv2.INTER_LINEAR)
+            img = draw_segmentation(img_resized, label_map(mask), self.classes, blend, show_labels, inplace=True)
+
+        elif "label_map" in metadata:
+            # segmentation results, at image resolution (e.g., stitched tiles)
+            img = draw_segmentation(np_img, metadata["label_map"], self.classes, blend, show_labels)
 
         else:
             raise ValueError(
                 "Don't know how to visualise metadata with keys " + ",".join(metadata.keys()))
 
-        img_result = Image(img, opencv=False)
+        img_result = Image(img, copy=False, opencv=False)
         return img_result
 
 
-def draw_captions(img: np.ndarray, captions, colour=(255, 255, 255), thickness=3, scale=1,
-                  offset=(20, 20), font=cv2.FONT_HERSHEY_SIMPLEX):
-    """Draw one or more strings at the bottom of the image"""
-    for i, caption in enumerate(reversed(captions)):
-        location = (offset[0], img.shape[0] - 40*i - offset[1])
-        cv2.putText(img, caption, location,
-                    fontFace=font, fontScale=scale, color=colour, thickness=thickness)
-
-    return img
+def label_map(mask) -> np.ndarray:
+    """(1, classes, H, W) segmentation scores -> (H, W) uint8 labels (argmax and conversion on the device)"""
+    return mx.nd.argmax(mask, 1)[0].astype("uint8").asnumpy()
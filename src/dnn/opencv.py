@@ -0,0 +1,327 @@
+from typing import Dict, Any, List, Sequence, Tuple
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+from constants import MODELS_DIR
+from images.image import Image
+from images.image_type import ImageType
+from profiling import timed
+from .draw import draw_boxes, draw_captions, draw_segmentation
+from .loader import ModelLoader, ModelType
+from .preprocess import resize_geometry
+
+
+# Input parameters: model input size (width, height), and normalisation ((x - mean) * scale, RGB or BGR)
+CAFFE_IMAGENET = {"size": (224, 224), "mean": (104, 117, 123), "scale": 1.0, "swap_rb": False}
+DARKNET = {"size": (416, 416), "mean": (0, 0, 0), "scale": 1 / 255, "swap_rb": True}
+
+FRIENDLY_NAMES = {
+    # name: (model file, config file, model type, input parameters, class names file), in MODELS_DIR
+    # See https://github.com/opencv/opencv/blob/master/samples/dnn/models.yml for downloads
+
+    # CLASSIFICATION
+    "resnet": ("ResNet-50-model.caffemodel", "ResNet-50-deploy.prototxt", ModelType.CLASSIFICATION,
+               CAFFE_IMAGENET, "classification_classes_ILSVRC2012.txt"),
+    "googlenet": ("bvlc_googlenet.caffemodel", "bvlc_googlenet.prototxt", ModelType.CLASSIFICATION,
+                  CAFFE_IMAGENET, "classification_classes_ILSVRC2012.txt"),
+    "squeezenet": ("squeezenet_v1.1.caffemodel", "squeezenet_v1.1.prototxt", ModelType.CLASSIFICATION,
+                   dict(CAFFE_IMAGENET, size=(227, 227)), "classification_classes_ILSVRC2012.txt"),
+
+    # DETECTION
+    "yolo": ("yolov3-tiny.weights", "yolov3-tiny.cfg", ModelType.DETECTION,
+             DARKNET, "object_detection_classes_yolov3.txt"),
+    "yolo-full": ("yolov3.weights", "yolov3.cfg", ModelType.DETECTION,
+                  DARKNET, "object_detection_classes_yolov3.txt"),
+    "ssd": ("MobileNetSSD_deploy.caffemodel", "MobileNetSSD_deploy.prototxt", ModelType.DETECTION,
+            {"size": (300, 300), "mean": (127.5, 127.5, 127.5), "scale": 0.007843, "swap_rb": False},
+            "object_detection_classes_pascal_voc.txt"),
+
+    # SEGMENTATION
+    "fcn": ("fcn8s-heavy-pascal.caffemodel", "fcn8s-heavy-pascal.prototxt", ModelType.SEGMENTATION,
+            {"size": (500, 500), "mean": (0, 0, 0), "scale": 1.0, "swap_rb": False},
+            "object_detection_classes_pascal_voc.txt"),
+    "enet": ("Enet-model-best.net", None, ModelType.SEGMENTATION,
+             {"size": (1024, 512), "mean": (0, 0, 0), "scale": 1 / 255, "swap_rb": True}, "enet-classes.txt"),
+}
+
+# Defaults for models given by path, per model type; override with a <model>.json next to the model file
+DEFAULT_INPUTS = {
+    ModelType.CLASSIFICATION: {"size": (224, 224), "mean": (0, 0, 0), "scale": 1 / 255, "swap_rb": True},
+    ModelType.DETECTION: {"size": (416, 416), "mean": (0, 0, 0), "scale": 1 / 255, "swap_rb": True},
+    ModelType.SEGMENTATION: {"size": (512, 512), "mean": (0, 0, 0), "scale": 1 / 255, "swap_rb": True},
+}
+CONFIG_EXTENSIONS = (".prototxt", ".pbtxt", ".cfg")
+
+# "backend[:target]" names, see cv2.dnn.DNN_BACKEND_* and cv2.dnn.DNN_TARGET_*
+BACKENDS = {
+    "default": "DNN_BACKEND_DEFAULT",
+    "opencv": "DNN_BACKEND_OPENCV",
+    "inference_engine": "DNN_BACKEND_INFERENCE_ENGINE",
+    "halide": "DNN_BACKEND_HALIDE",
+    "vulkan": "DNN_BACKEND_VKCOM",
+    "cuda": "DNN_BACKEND_CUDA",
+}
+TARGETS = {
+    "cpu": "DNN_TARGET_CPU",
+    "opencl": "DNN_TARGET_OPENCL",
+    "opencl_fp16": "DNN_TARGET_OPENCL_FP16",
+    "myriad": "DNN_TARGET_MYRIAD",
+    "vulkan": "DNN_TARGET_VULKAN",
+    "fpga": "DNN_TARGET_FPGA",
+    "cuda": "DNN_TARGET_CUDA",
+    "cuda_fp16": "DNN_TARGET_CUDA_FP16",
+}
+
+
+def _dnn_constant(table: dict, name: str, kind: str) -> int:
+    if name not in table:
+        raise ValueError("[opencv] unknown {} '{}', options: {}".format(kind, name, ", ".join(table)))
+    value = getattr(cv2.dnn, table[name], None)
+    if value is None:
+        raise ValueError("[opencv] {} '{}' is not supported by OpenCV {}".format(kind, name, cv2.__version__))
+    return value
+
+
+class OpencvLoader(ModelLoader):
+    """
+    Model loader using OpenCV's dnn module, for model files on disk (Caffe, Darknet, TensorFlow, ONNX, Torch)
+
+    Lightweight alternative to the MxnetLoader (OpenCV is needed anyway), e.g. for the Raspberry Pi.
+    Models are either FRIENDLY_NAMES (files in CVLAB_MODELS, default ~/.cvlab/models/) or paths to
+    a model file, with an optional config file (same name, .prototxt/.pbtxt/.cfg), class names
+    (same name, .txt) and input parameters (same name, .json; see DEFAULT_INPUTS) next to it.
+    """
+    def __init__(self, backend: str = "default", threads: int = None):
+        """
+        backend: "backend[:target]", e.g. "opencv", "inference_engine:myriad", "cuda:cuda_fp16" (see BACKENDS, TARGETS)
+        threads: number of threads used by OpenCV (process-wide setting)
+        """
+        backend, _, target = (backend or "default").partition(":")
+        self.backend = _dnn_constant(BACKENDS, backend, "backend")
+        self.target = _dnn_constant(TARGETS, target or "cpu", "target")
+        if threads:
+            cv2.setNumThreads(threads)
+
+        self.net = None
+        self.model_name = None
+        self.model_type = None
+        self.inputs = None
+        self.classes = []
+        self.output_names = None
+        self.output_type = None
+
+    def load(self, model_name: str, model_type: ModelType = None, debug: bool = True,
+             warmup: Sequence[Tuple[int, int]] = ((480, 640),)) -> None:
+        """
+        Load a model from local files
+
+        warmup: run the model once, so the first frame doesn't pay for memory allocation
+                (the model input size is fixed, so the image sizes don't matter)
+        """
+        model_file, config_file, _model_type, inputs, classes_file = self._resolve(model_name, model_type)
+        if debug:
+            print("[opencv] loading {} model {} ({})".format(_model_type.name, model_name, model_file))
+
+        self.net = cv2.dnn.readNet(model_file, config_file or "")
+        self.net.setPreferableBackend(self.backend)
+        self.net.setPreferableTarget(self.target)
+        self.model_name = model_name
+        self.model_type = _model_type
+        self.inputs = inputs
+        self.classes = _read_lines(classes_file) if classes_file and os.path.exists(classes_file) else []
+
+        # detection networks end in a DetectionOutput layer (SSD) or in one or more Region layers (YOLO)
+        self.output_names = self.net.getUnconnectedOutLayersNames()
+        last_layer = self.net.getLayer(self.net.getLayerId(self.output_names[-1]))
+        self.output_type = last_layer.type
+
+        if warmup:
+            _start = time.perf_counter()
+            self.forward(np.zeros((1, 3, inputs["size"][1], inputs["size"][0]), dtype=np.float32))
+            print("[opencv] warmed up {} in {:.2f}s".format(model_name, time.perf_counter() - _start))
+
+    def _resolve(self, model_name: str, model_type: ModelType):
+        """Model name -> (model file, config file, model type, input parameters, class names file)"""
+        if model_name in FRIENDLY_NAMES:
+            model_file, config_file, _model_type, inputs, classes_file = FRIENDLY_NAMES[model_name]
+            files = [os.path.join(MODELS_DIR, f) if f else None for f in (model_file, config_file, classes_file)]
+            missing = [f for f in files if f and not os.path.exists(f)]
+            if missing:
+                raise FileNotFoundError("[opencv] model files for '{}' not found: {}".format(
+                    model_name, ", ".join(missing)))
+            return files[0], files[1], _model_type, inputs, files[2]
+
+        if not os.path.exists(model_name):
+            known = [name for (name, spec) in FRIENDLY_NAMES.items() if model_type in (None, spec[2])]
+            raise FileNotFoundError("[opencv] unknown model '{}'; give a model file, or one of: {}".format(
+                model_name, ", ".join(known)))
+        if model_type is None:
+            raise ValueError("[opencv] model type needed for model file {}".format(model_name))
+
+        base = os.path.splitext(model_name)[0]
+        inputs = dict(DEFAULT_INPUTS[model_type])
+        if os.path.exists(base + ".json"):
+            with open(base + ".json") as fp:
+                inputs.update(json.load(fp))
+        config_file = next((base + ext for ext in CONFIG_EXTENSIONS if os.path.exists(base + ext)), None)
+        return model_name, config_file, model_type, inputs, base + ".txt"
+
+    def forward(self, blob: np.ndarray):
+        self.net.setInput(blob)
+        return self.net.forward(self.output_names)
+
+    def process(self, image: Image, short=None, max_size=None, conf_thresh=0.25, nms_thresh=0.45) -> Dict[str, Any]:
+        return self.process_batch([image], short, max_size, conf_thresh, nms_thresh)[0]
+
+    def process_batch(self, images: Sequence[Image], short=None, max_size=None,
+                      conf_thresh=0.25, nms_thresh=0.45) -> List[Dict[str, Any]]:
+        """
+        Run inference on several images with a single forward pass
+
+        The model input size is the one of the model, unless short and max_size are given
+        (as for the MxnetLoader; only for fully convolutional models, e.g., detection and segmentation).
+
+        Returns numpy results per image, in image coordinates:
+        - classification -> scores (probability per class)
+        - object detection -> bounding_boxes (x1, y1, x2, y2), scores, class_ids (after NMS)
+        - segmentation -> mask (label map at model resolution)
+        """
+        if self.net is None:
+            raise RuntimeError("[opencv] No model has been loaded. Run load() first.")
+
+        with timed("opencv.process"):
+            imgs = [image.get(ImageType.OPENCV) for image in images]
+            size = tuple(self.inputs["size"])
+            if short and max_size:
+                height, width = resize_geometry(imgs[0].shape[0], imgs[0].shape[1], short, max_size)
+                size = (width, height)
+            blob = cv2.dnn.blobFromImages(
+                imgs, self.inputs["scale"], size, tuple(self.inputs["mean"]),
+                swapRB=self.inputs["swap_rb"], crop=False)
+            outputs = self.forward(blob)
+            sizes = [img.shape[1::-1] for img in imgs]
+
+            if self.model_type is ModelType.CLASSIFICATION:
+                scores = outputs[0].reshape(len(images), -1)
+                if scores.min() < 0 or not np.allclose(scores.sum(axis=1), 1, atol=1e-3):
+                    scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+                    scores /= scores.sum(axis=1, keepdims=True)
+                return [{"scores": s} for s in scores]
+
+            elif self.model_type is ModelType.DETECTION:
+                return [self._detections(outputs, i, len(images), size, conf_thresh, nms_thresh)
+                        for (i, size) in enumerate(sizes)]
+
+            elif self.model_type is ModelType.SEGMENTATION:
+                label_maps = outputs[0].argmax(axis=1).astype(np.uint8)
+                return [{"mask": label_map} for label_map in label_maps]
+
+            else:
+                return [{"outputs": outputs} for _ in images]
+
+    def _detections(self, outputs, index: int, batch_size: int, size: Tuple[int, int],
+                    conf_thresh, nms_thresh) -> Dict[str, Any]:
+        width, height = size
+        if self.output_type == "DetectionOutput":
+            # [1, 1, N, 7]: image id, class id, score, x1, y1, x2, y2 (relative); already suppressed
+            detections = outputs[0].reshape(-1, 7)
+            detections = detections[(detections[:, 0] == index) & (detections[:, 2] >= conf_thresh)]
+            boxes = detections[:, 3:7] * np.array([width, height, width, height], dtype=np.float32)
+            return {"bounding_boxes": boxes, "scores": detections[:, 2], "class_ids": detections[:, 1].astype(np.int32)}
+
+        # Region layers (YOLO): per output, [batch size * rows, 5 + classes] with the images stacked along
+        # the rows: cx, cy, w, h (relative), objectness, class scores
+        detections = np.concatenate([out.reshape(batch_size, -1, out.shape[-1])[index] for out in outputs])
+        class_ids = detections[:, 5:].argmax(axis=1)
+        scores = detections[np.arange(len(detections)), 5 + class_ids]
+        keep = scores >= conf_thresh
+        detections, class_ids, scores = detections[keep], class_ids[keep], scores[keep]
+
+        centres, extents = detections[:, 0:2], detections[:, 2:4]
+        boxes = np.hstack([centres - extents / 2, centres + extents / 2]) * \
+            np.array([width, height, width, height], dtype=np.float32)
+
+        # class-aware NMS: offset the boxes per class, so boxes of different classes never overlap
+        offsets = (class_ids * (width + height)).astype(np.float32)[:, np.newaxis]
+        rects = np.hstack([boxes[:, :2] + offsets, boxes[:, 2:] - boxes[:, :2]])
+        indices = np.array(cv2.dnn.NMSBoxes(rects.tolist(), scores.tolist(), conf_thresh, nms_thresh),
+                           dtype=np.int64).reshape(-1)
+        return {"bounding_boxes": boxes[indices], "scores": scores[indices],
+                "class_ids": class_ids[indices].astype(np.int32)}
+
+    def results(self, image: Image, metadata: Dict[str, Any], thresh=0.5, top_k=5) -> Dict[str, Any]:
+        if "boxes" in metadata or "label_map" in metadata:
+            # already results (e.g., from tiled processing, see dnn.tiling)
+            return metadata
+
+        elif "bounding_boxes" in metadata:
+            keep = metadata["scores"] >= thresh
+            labels = metadata["class_ids"][keep]
+            return {
+                "boxes": metadata["bounding_boxes"][keep].astype(np.float32),
+                "scores": metadata["scores"][keep].astype(np.float32),
+                "labels": labels,
+                "names": [self.class_name(label) for label in labels],
+            }
+
+        elif "scores" in metadata:
+            scores = metadata["scores"]
+            labels = np.argsort(scores)[::-1][:top_k].astype(np.int32)
+            return {
+                "labels": labels,
+                "scores": scores[labels].astype(np.float32),
+                "names": [self.class_name(label) for label in labels],
+            }
+
+        elif "mask" in metadata:
+            width, height = image.size
+            label_map = cv2.resize(metadata["mask"], (width, height), interpolation=cv2.INTER_NEAREST)
+            return {
+                "label_map": label_map,
+                "names": self.class_names(),
+            }
+
+        else:
+            raise ValueError(
+                "Don't know how to get results from metadata with keys " + ",".join(metadata.keys()))
+
+    def class_names(self):
+        return self.classes
+
+    def class_name(self, label: int) -> str:
+        return self.classes[label] if label < len(self.classes) else str(label)
+
+    def visualise(self, image: Image, metadata: Dict[str, Any], blend=0.5, show_labels=True):
+        with timed("opencv.visualise"):
+            return self._visualise(image, metadata, blend, show_labels)
+
+    def _visualise(self, image: Image, metadata: Dict[str, Any], blend, show_labels):
+        img = image.get(ImageType.OPENCV).copy()
+
+        if "bounding_boxes" in metadata or "boxes" in metadata:
+            results = self.results(image, metadata)
+            draw_boxes(img, results["boxes"], results["scores"], results["labels"], self.classes)
+
+        elif "scores" in metadata:
+            results = self.results(image, metadata, top_k=3)
+            if show_labels:
+                captions = ["{}: {:.3}".format(name, score) for (name, score) in zip(results["names"], results["scores"])]
+                draw_captions(img, captions)
+
+        elif "mask" in metadata or "label_map" in metadata:
+            label_map = self.results(image, metadata)["label_map"]
+            img = draw_segmentation(img, label_map, self.classes, blend, show_labels, bgr=True, inplace=True)
+
+        else:
+            raise ValueError(
+                "Don't know how to visualise metadata with keys " + ",".join(metadata.keys()))
+
+        return Image(img, copy=False, opencv=True)
+
+
+def _read_lines(path: str) -> List[str]:
+    with open(path) as fp:
+        return [line.strip() for line in fp if line.strip()]
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from typing import Sequence, Tuple
+import cv2
+import numpy as np
+
+from images.image import Image
+from images.image_type import ImageType
+
+
+def resize_geometry(height: int, width: int, short: int, max_size: int, mult_base: int = 32) -> Tuple[int, int]:
+    """
+    Model input size (height, width) for an image
+
+    Same geometry as gluoncv.data.transforms.image.resize_short_within: the short side
+    is resized to `short`, unless the long side would exceed `max_size`; both sides
+    are rounded to a multiple of mult_base.
+    """
+    im_size_min, im_size_max = (height, width) if width > height else (width, height)
+    scale = float(short) / float(im_size_min)
+    if np.round(scale * im_size_max / mult_base) * mult_base > max_size:
+        scale = float(np.floor(max_size / mult_base) * mult_base) / float(im_size_max)
+    return (int(np.round(height * scale / mult_base) * mult_base),
+            int(np.round(width * scale / mult_base) * mult_base))
+
+
+def cached(cache: OrderedDict, key, factory, max_size: int = 8):
+    """Get (or create and add) an item of a size-limited cache of buffers"""
+    if key not in cache:
+        cache[key] = factory()
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+    return cache[key]
+
+
+class Preprocessor:
+    """
+    Resize, normalise and convert images to a planar (NCHW, RGB) float32 batch
+
+    Resize geometry and all intermediate buffers are cached per shape, so steady-state
+    preprocessing doesn't allocate full-frame arrays. Normalisation ((x / 255 - mean) / std)
+    is a single multiply-add per channel, written straight into the planar batch, which also
+    takes care of the channel order (BGR inputs don't need a separate conversion).
+
+    The returned batch is a reused buffer: copy it (e.g., into a framework tensor) before
+    the next call.
+    """
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), mult_base=32):
+        mean, std = np.array(mean, dtype=np.float32), np.array(std, dtype=np.float32)
+        self.scale = 1 / (255 * std)
+        self.offset = -mean / std
+        self.mult_base = mult_base
+        self.geometry = OrderedDict()  # (height, width, short, max_size) -> model input (height, width)
+        self.resized = OrderedDict()   # model input (height, width) -> uint8 HWC buffer
+        self.batches = OrderedDict()   # (n, height, width) -> float32 NCHW buffer
+
+    def target_size(self, image: Image, short: int, max_size: int) -> Tuple[int, int]:
+        width, height = image.size
+        return cached(self.geometry, (height, width, short, max_size),
+                      lambda: resize_geometry(height, width, short, max_size, self.mult_base))
+
+    def batch(self, images: Sequence[Image], size: Tuple[int, int]) -> Tuple[np.ndarray, list]:
+        """
+        Preprocess images into one (n, 3, height, width) batch of the given model input size
+
+        Returns the batch, and per image the scale (x, y) from model input to image coordinates.
+        """
+        height, width = size
+        batch = cached(self.batches, (len(images), height, width),
+                       lambda: np.empty((len(images), 3, height, width), dtype=np.float32))
+        scales = []
+
+        for n, image in enumerate(images):
+            # use the image as it is (OpenCV/BGR or numpy/RGB), to avoid a colour conversion
+            bgr = image.orig_type == ImageType.OPENCV
+            img = image.get(ImageType.OPENCV if bgr else ImageType.NUMPY)
+
+            if img.shape[:2] != (height, width):
+                resized = cached(self.resized, (height, width),
+                             lambda: np.empty((height, width, 3), dtype=np.uint8))
+                img = cv2.resize(img, (width, height), dst=resized, interpolation=cv2.INTER_LINEAR)
+
+            for c in range(3):
+                channel = img[:, :, 2 - c if bgr else c]
+                np.multiply(channel, self.scale[c], out=batch[n, c])
+                batch[n, c] += self.offset[c]
+
+            scales.append((image.size[0] / width, image.size[1] / height))
+
+        return batch, scales
@@ -0,0 +1,171 @@
+from typing import Dict, Any, List, Tuple
+import numpy as np
+
+from images.image import Image
+from images.image_type import ImageType
+from profiling import timed
+from .loader import ModelLoader, ModelType
+
+
+def tile_grid(height: int, width: int, tile: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Overlapping tiles (x1, y1, x2, y2) covering a frame
+
+    Tiles are (at most) tile x tile pixels, overlapping at least `overlap` pixels;
+    the last row/column is aligned with the frame border instead of sticking out.
+    """
+    def starts(size):
+        if size <= tile:
+            return [0]
+        step = tile - overlap
+        n = int(np.ceil((size - tile) / step)) + 1
+        return [int(round(i * (size - tile) / (n - 1))) for i in range(n)]
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of two sets of (x1, y1, x2, y2) boxes: (len(a), len(b))"""
+    top_left = np.maximum(a[:, np.newaxis, :2], b[np.newaxis, :, :2])
+    bottom_right = np.minimum(a[:, np.newaxis, 2:], b[np.newaxis, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, np.newaxis] + area_b[np.newaxis, :] - intersection, 1e-9)
+
+
+def box_overlaps(boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairwise intersection over union, and intersection over the smaller box, of (x1, y1, x2, y2) boxes"""
+    top_left = np.maximum(boxes[:, np.newaxis, :2], boxes[np.newaxis, :, :2])
+    bottom_right = np.minimum(boxes[:, np.newaxis, 2:], boxes[np.newaxis, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+    iou = intersection / np.maximum(area[:, np.newaxis] + area[np.newaxis, :] - intersection, 1e-9)
+    ios = intersection / np.maximum(np.minimum(area[:, np.newaxis], area[np.newaxis, :]), 1e-9)
+    return iou, ios
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray, iou_thresh: float = 0.5,
+        truncated: np.ndarray = None, ios_thresh: float = 0.6) -> np.ndarray:
+    """
+    Class-aware non-maximum suppression; returns the indices of the boxes to keep, by decreasing score
+
+    truncated: boxes cut off by a tile border; these are also suppressed when they are mostly
+               inside a better box (intersection over the smaller box >= ios_thresh), as their
+               IoU with the complete box (from a neighbouring tile) can be low
+    """
+    order = np.argsort(scores)[::-1]
+    boxes, labels = boxes[order], labels[order]
+    iou, ios = box_overlaps(boxes)
+    overlapping = iou >= iou_thresh
+    if truncated is not None:
+        truncated = truncated[order]
+        overlapping |= (truncated[:, np.newaxis] | truncated[np.newaxis, :]) & (ios >= ios_thresh)
+    suppresses = overlapping & (labels[:, np.newaxis] == labels[np.newaxis, :])
+
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if keep[i]:
+            keep[i + 1:] &= ~suppresses[i, i + 1:]
+    return order[keep]
+
+
+class TiledProcessor:
+    """
+    Detection or segmentation on overlapping tiles of high-resolution frames
+
+    Models resize their input to a fixed size (e.g., 512px), so small objects in large frames
+    disappear. Here, each tile is processed at (close to) its native resolution, in batches
+    of at most max_batch tiles, which bounds the memory use regardless of the frame size.
+    - detection: tile boxes are moved to frame coordinates and merged with NMS across the seams;
+      the downscaled full frame is processed too, for objects larger than a tile
+    - segmentation: each tile contributes the label map of its core region (without the
+      half overlaps), stitched into a full-resolution label map
+
+    Returns results in the ModelLoader.results() format, which the loaders also accept
+    as metadata for visualise().
+    """
+    def __init__(self, loader: ModelLoader, tile: int = 512, overlap: int = 64, max_batch: int = 4,
+                 full_frame: bool = True):
+        if loader.model_type not in (ModelType.DETECTION, ModelType.SEGMENTATION):
+            raise ValueError("[tiling] only detection and segmentation models can be tiled, not {}".format(
+                loader.model_type))
+        self.loader = loader
+        self.tile = tile
+        self.overlap = overlap
+        self.max_batch = max_batch
+        self.full_frame = full_frame
+
+    def process(self, image: Image) -> Dict[str, Any]:
+        with timed("tiling.process"):
+            bgr = image.orig_type == ImageType.OPENCV
+            img = image.get(ImageType.OPENCV if bgr else ImageType.NUMPY)
+            height, width = img.shape[:2]
+            tiles = tile_grid(height, width, self.tile, self.overlap)
+            if len(tiles) == 1:
+                return self.loader.results(image, self.loader.process(image))
+
+            crops = [Image(img[y1:y2, x1:x2], copy=False, opencv=bgr) for (x1, y1, x2, y2) in tiles]
+            if self.loader.model_type is ModelType.DETECTION:
+                return self._detect(image, tiles, crops)
+            else:
+                return self._segment(image, tiles, crops)
+
+    def _run(self, images: List[Image]) -> List[Dict[str, Any]]:
+        """Results per image, running at most max_batch images per forward pass"""
+        results = []
+        for start in range(0, len(images), self.max_batch):
+            chunk = images[start:start + self.max_batch]
+            metadata = self.loader.process_batch(chunk)
+            results.extend(self.loader.results(image, m) for (image, m) in zip(chunk, metadata))
+        return results
+
+    def _detect(self, image: Image, tiles, crops) -> Dict[str, Any]:
+        width, height = image.size
+        boxes, scores, labels, truncated = [], [], [], []
+
+        for (x1, y1, x2, y2), results in zip(tiles, self._run(crops)):
+            tile_boxes = results["boxes"] + np.array([x1, y1, x1, y1], dtype=np.float32)
+            # cut off by a tile border inside the frame?
+            margin = 2
+            truncated.append(((tile_boxes[:, 0] <= x1 + margin) & (x1 > 0)) |
+                             ((tile_boxes[:, 1] <= y1 + margin) & (y1 > 0)) |
+                             ((tile_boxes[:, 2] >= x2 - margin) & (x2 < width)) |
+                             ((tile_boxes[:, 3] >= y2 - margin) & (y2 < height)))
+            boxes.append(tile_boxes)
+            scores.append(results["scores"])
+            labels.append(results["labels"])
+
+        if self.full_frame:
+            results = self.loader.results(image, self.loader.process(image))
+            boxes.append(results["boxes"])
+            scores.append(results["scores"])
+            labels.append(results["labels"])
+            truncated.append(np.zeros(len(results["boxes"]), dtype=bool))
+
+        boxes, scores, labels, truncated = (np.concatenate(values) for values in (boxes, scores, labels, truncated))
+        keep = nms(boxes, scores, labels, truncated=truncated)
+        class_names = self.loader.class_names()
+        return {
+            "boxes": boxes[keep].astype(np.float32),
+            "scores": scores[keep].astype(np.float32),
+            "labels": labels[keep].astype(np.int32),
+            "names": [class_names[label] for label in labels[keep]],
+        }
+
+    def _segment(self, image: Image, tiles, crops) -> Dict[str, Any]:
+        width, height = image.size
+        label_map = np.zeros((height, width), dtype=np.uint8)
+        half = self.overlap // 2
+
+        for (x1, y1, x2, y2), results in zip(tiles, self._run(crops)):
+            # core region: the tile without half the overlap on the sides facing other tiles
+            cx1, cy1 = (x1 + half if x1 > 0 else 0), (y1 + half if y1 > 0 else 0)
+            cx2, cy2 = (x2 - half if x2 < width else width), (y2 - half if y2 < height else height)
+            label_map[cy1:cy2, cx1:cx2] = results["label_map"][cy1 - y1:cy2 - y1, cx1 - x1:cx2 - x1]
+
+        return {
+            "label_map": label_map,
+            "names": self.loader.class_names(),
+        }
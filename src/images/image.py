@@ -2,6 +2,7 @@ import io
 
 from . import convert
 from .image_type import ImageType
+from profiling import timed
 
 
 # Image abstraction supporting multiple image formats.
@@ -46,13 +47,20 @@ class Image:
 
         if self.img[target_type] is None:
             # Assuming we have a conversion from self.orig_type to target_type
-            img_conv = convert.convert(
-                self.img[self.orig_type], self.orig_type, target_type)
+            with timed("image.convert", "{}-{}".format(self.orig_type.name, target_type.name)):
+                img_conv = convert.convert(
+                    self.img[self.orig_type], self.orig_type, target_type)
             # Cache result
             self.img[target_type] = img_conv
 
         return self.img[target_type]
 
+    @property
+    def size(self):
+        """(width, height), without conversions"""
+        img = self.img[self.orig_type]
+        return img.size if self.orig_type == ImageType.PILLOW else (img.shape[1], img.shape[0])
+
     def asnumpy(self):
         return self.get(ImageType.NUMPY)
 
@@ -1,6 +1,8 @@
 from .inference import Inference
+from .tracking import PointTracker
 from images.image import Image
 from images.image_type import ImageType
+from profiling import PROFILER, timed
 
 import cv2
 import numpy as np
@@ -8,77 +10,194 @@ from typing import Sequence, Dict
 
 
 class OpticalFlow(Inference):
+    """Sparse optical flow (Lucas-Kanade), with the trails of the tracked points"""
     KEYSTROKES = {'r': "Reset tracking"}
-    FEATURE_PARAMS = {
-        "maxCorners": 100,
-        "qualityLevel": 0.3,
-        "minDistance": 7,
-        "blockSize": 7
+    ARGUMENTS = {
+        'points': int,  # maximum number of tracked points (default 100)
+        'trail': int,   # number of positions drawn per point (default 16)
     }
-    LK_PARAMS = {
-        "winSize": (15, 15),
-        "maxLevel": 2,
-        "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
-    }
-    COLOURS = np.random.randint(0, 255, (100, 3))
+    COLOURS = np.random.randint(0, 255, (16, 3))
 
-    def __init__(self):
-        self.reset_tracking()
+    def __init__(self, points=None, trail=None):
+        self.TRACKER = PointTracker(max_points=points or 100, trail=trail or 16)
 
     def reset_tracking(self):
-        self.img_prev = {}      # previous image to compare with
-        self.points_prev = {}   # features to track (since reset, per image)
-        self.mask = {}          # mask to keep drawing on
+        self.TRACKER.reset()
 
-    def process(self, images: Sequence[Image], count=[0]) -> Dict[str, Image]:
+    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
         # Based on:
         # https://docs.opencv.org/3.4/d4/dee/tutorial_optical_flow.html
         outputs = {}
+        self.results = {}
 
         for (i, image) in enumerate(images):
             key = str(i)
             if image is not None:
-
                 img = image.get(ImageType.OPENCV)
-                img_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+                img_grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
 
-                # on first image since reset, init
-                if key not in self.img_prev:
-                    self.img_prev[key] = img_grey
-                    self.mask[key] = np.zeros_like(img)
-                    self.points_prev[key] = cv2.goodFeaturesToTrack(
-                        img_grey, mask=None, **OpticalFlow.FEATURE_PARAMS)
+                state = self.TRACKER.update(key, img_grey)
+                self.results[key] = {"points": state["points"].copy(), "track_ids": state["track_ids"].copy()}
 
-                # track on all future frames
-                else:
-                    points, status, err = cv2.calcOpticalFlowPyrLK(
-                        self.img_prev[key], img_grey, self.points_prev[key], None, **OpticalFlow.LK_PARAMS)
+                if self.render:
+                    outputs[key] = Image(self.draw(img, state), copy=False, opencv=True)
 
-                    if points is not None:
+        return outputs
 
-                        points_good_curr = points[status == 1]
-                        points_good_prev = self.points_prev[key][status == 1]
+    def draw(self, img: np.ndarray, state: Dict[str, np.ndarray]) -> np.ndarray:
+        """Trails and points, one polylines() call per colour"""
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
+        trails = np.round(state["trails"]).astype(np.int32)
+        lengths = state["lengths"]
+        colours = state["track_ids"] % len(OpticalFlow.COLOURS)
+        for c, colour in enumerate(OpticalFlow.COLOURS.tolist()):
+            selected = np.flatnonzero(colours == c)
+            if len(selected) == 0:
+                continue
+            lines = [trails[j, -lengths[j]:] for j in selected if lengths[j] > 1]
+            if lines:
+                cv2.polylines(img, lines, False, colour, 2)
+            # points: zero-length lines with round caps
+            heads = trails[selected, -1:].repeat(2, axis=1)
+            cv2.polylines(img, list(heads), False, colour, 8)
+        return img
 
-                        # draw
-                        for j, (curr, prev) in enumerate(zip(points_good_curr, points_good_prev)):
-                            a, b = curr.ravel()
-                            c, d = prev.ravel()
-                            self.mask[key] = cv2.line(
-                                self.mask[key], (a, b), (c, d), OpticalFlow.COLOURS[j % 100].tolist(), 2)
-                            img = cv2.circle(img, (a, b), 5, OpticalFlow.COLOURS[j % 100].tolist(), -1)
-                        img = cv2.add(img, self.mask[key])
+    def handle_command(self, key):
+        if key == 'r':
+            print("Resetting tracking")
+            self.reset_tracking()
+
+
+class DenseOpticalFlow(Inference):
+    """Dense optical flow (DIS or Farneback), on a downscaled frame"""
+    KEYSTROKES = {'r': "Reset flow"}
+    ARGUMENTS = {
+        'method': str,  # dis (default), farneback
+        'scale': float, # process frames downscaled by this factor (default 0.25)
+        'roi': str,     # only this region of the frame: "x,y,w,h" (px)
+        'reuse': int,   # compute the flow every N frames, and reuse it in between (default 1: every frame)
+    }
+    METHODS = ("dis", "farneback")
+    FARNEBACK_PARAMS = {
+        "pyr_scale": 0.5,
+        "levels": 3,
+        "winsize": 15,
+        "iterations": 3,
+        "poly_n": 5,
+        "poly_sigma": 1.2,
+    }
+    MAX_MAGNITUDE = 20.0  # flow (px, full resolution) shown at full brightness
+    MIN_SIZE = 12  # smallest region (px, processing resolution) DIS can compute the flow of
+
+    def __init__(self, method=None, scale=None, roi=None, reuse=None):
+        self.method = method or "dis"
+        if self.method not in self.METHODS:
+            raise ValueError("Unknown method '{}', options: {}".format(self.method, ", ".join(self.METHODS)))
+        self.scale = scale or 0.25
+        self.roi = tuple(int(v) for v in roi.split(",")) if roi else None
+        if self.roi:
+            self.check_size(*self.roi[2:])
+        self.reuse = max(reuse or 1, 1)
+        self.reset_flow()
+
+    def reset_flow(self):
+        self.img_prev = {}  # per stream: previous (downscaled) greyscale frame
+        self.flow = {}      # per stream: last flow, at processing resolution (Farneback: warm start for the next)
+        self.age = {}       # per stream: frames since the flow was computed
+        self.frames = {}    # per stream: frames the last flow spans (more than 1 when reusing)
+        self.dis = {}       # per stream: DIS instance (keeps internal buffers)
+        self.too_small = set()  # streams warned about frames too small for the flow
+
+    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
+        outputs = {}
+        self.results = {}
 
-                        # update for next frame
-                        self.points_prev[key] = points_good_curr.reshape(-1, 1, 2)
+        for (i, image) in enumerate(images):
+            key = str(i)
+            if image is not None:
+                img = image.get(ImageType.OPENCV)
+                height, width = img.shape[:2]
+                x, y, w, h = self.roi or (0, 0, width, height)
+                x, y = min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+                w, h = min(w, width - x), min(h, height - y)
+                if min(w, h) * self.scale < self.MIN_SIZE:
+                    # no flow for this frame; start over when the frames are large enough again
+                    if key not in self.too_small:
+                        self.too_small.add(key)
+                        print("!! Stream {}: region of {}x{}px too small for flow at scale {}, skipping".format(
+                            key, w, h, self.scale))
+                    PROFILER.count("flow.too_small")
+                    for state in (self.img_prev, self.flow, self.age):
+                        state.pop(key, None)
+                    continue
+
+                if key in self.flow and self.age[key] + 1 < self.reuse:
+                    self.age[key] += 1
+                    PROFILER.count("flow.reused")
+                else:
+                    with timed("flow.dense", key):
+                        self._update(key, img[y:y + h, x:x + w])
 
-                    self.img_prev[key] = img_grey
+                if key not in self.flow:
+                    continue  # first frame
+                # flow vectors in full resolution pixels per frame
+                flow = self.flow[key] / (self.scale * self.frames[key])
+                self.results[key] = {"flow": flow, "scale": self.scale, "roi": (x, y, w, h)}
 
-                outputs[key] = Image(img, opencv=True)
+                if self.render:
+                    outputs[key] = Image(self.visualise(img, flow, (x, y, w, h)), copy=False, opencv=True)
 
         return outputs
 
+    def _update(self, key: str, img: np.ndarray):
+        small = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+        previous = self.img_prev.get(key)
+        self.img_prev[key] = grey
+        if previous is None or previous.shape != grey.shape:
+            self.flow.pop(key, None)
+            self.age[key] = 0
+            return
+
+        frames = self.age.get(key, 0) + 1  # frames since the previous frame
+        if self.method == "dis":
+            # (the Python bindings don't take an initial flow for DIS)
+            if key not in self.dis:
+                self.dis[key] = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST)
+            self.flow[key] = self.dis[key].calc(previous, grey, None)
+        else:
+            # warm start from the previous flow, rescaled to the frames this flow spans
+            flow = self.flow.get(key)
+            if flow is not None:
+                flow = flow * (frames / self.frames[key])
+            flags = cv2.OPTFLOW_USE_INITIAL_FLOW if flow is not None else 0
+            self.flow[key] = cv2.calcOpticalFlowFarneback(previous, grey, flow, flags=flags, **self.FARNEBACK_PARAMS)
+        self.frames[key] = frames
+        self.age[key] = 0
+
+    def check_size(self, w: int, h: int):
+        """Raise a ValueError if a region (e.g., the roi argument) is too small for the flow"""
+        if min(w, h) * self.scale < self.MIN_SIZE:
+            raise ValueError("Region of {}x{}px too small for flow at scale {}: at least {}px per side".format(
+                w, h, self.scale, int(np.ceil(self.MIN_SIZE / self.scale))))
+
+    def visualise(self, img: np.ndarray, flow: np.ndarray, roi) -> np.ndarray:
+        """Flow direction as hue, magnitude as brightness (upsampled to the ROI), on the dimmed frame"""
+        magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1], angleInDegrees=True)
+        hsv = cv2.merge([
+            (angle / 2).astype(np.uint8),
+            np.full(angle.shape, 255, dtype=np.uint8),
+            np.clip(magnitude * (255 / self.MAX_MAGNITUDE), 0, 255).astype(np.uint8),
+        ])
+        x, y, w, h = roi
+        output = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
+        output //= 3
+        output[y:y + h, x:x + w] = cv2.resize(cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR), (w, h),
+                                               interpolation=cv2.INTER_LINEAR)
+        return output
+
     def handle_command(self, key):
         if key == 'r':
-            print("Resetting tracking")
-            self.reset_tracking()
-
+            print("Resetting flow")
+            self.reset_flow()
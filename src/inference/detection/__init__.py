@@ -1,2 +1,3 @@
-from .faces import Faces
-from .objects import Objects
+from .faces import Faces, CloudFaces
+from .objects import Objects, CloudObjects
+from .text import CloudText
@@ -1,70 +1,166 @@
-from cloud.aws import AWSInference, InferenceType
+from cloud.provider import InferenceType
 from images.image import Image
 from images.image_type import ImageType
+from dnn.draw import draw_boxes
+from dnn.tiling import nms
+from profiling import timed
 from ..inference import Inference
+from ..remote import CloudInference
+from ..tracking import BoxTracker
 
 from typing import Sequence, Dict
 import os
+import threading
 import cv2
+import numpy as np
 
-CASCADE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(cv2.__file__)), "data")
+CASCADE_NAME = 'haarcascade_frontalface_default.xml'
+_CASCADES = threading.local()  # cascade classifiers aren't thread-safe: one instance per thread
+
+
+def face_cascade() -> "cv2.CascadeClassifier":
+    """The face cascade of the calling thread (loaded on first use)"""
+    cascade = getattr(_CASCADES, "face", None)
+    if cascade is None:
+        folder = getattr(getattr(cv2, "data", None), "haarcascades", None) or \
+            os.path.join(os.path.dirname(os.path.abspath(cv2.__file__)), "data")
+        cascade = _CASCADES.face = cv2.CascadeClassifier(os.path.join(folder, CASCADE_NAME))
+        if cascade.empty():
+            raise FileNotFoundError("Face cascade not found: {}".format(os.path.join(folder, CASCADE_NAME)))
+    return cascade
 
 
 class Faces(Inference):
     """Classic face detection, using Haar Cascades"""
+    ARGUMENTS = {
+        'detect_every': int,  # run the detector every N frames, and track the faces in between
+        'scale': float,       # detect on frames downscaled by this factor, e.g. 0.5
+        'full_every': int,    # scan the full frame every N detections, and only around the last faces in between
+    }
 
-    FACE_CASCADE = cv2.CascadeClassifier(CASCADE_FOLDER + os.sep + 'haarcascade_frontalface_default.xml')
     BOX_COLOUR = (255, 0, 0)
+    BATCHABLE = True
+    SEARCH_MARGIN = 0.5  # re-search regions extend this fraction of the face size on each side
+
+    def __init__(self, detect_every=None, scale=None, full_every=None):
+        face_cascade()  # fail early if the cascade is missing
+        self.scale = min(scale or 1.0, 1.0)
+        self.full_every = full_every
+        self.previous = {}    # per stream: last faces (detected, or tracked in between; full resolution)
+        self.since_full = {}  # per stream: detections since the last full scan
+
+        self.TRACKER = None
+        if detect_every:
+            self.TRACKER = BoxTracker(detect_every)
+        if detect_every or full_every:
+            self.BATCHABLE = False  # faces are tracked/searched between consecutive frames per stream
+
+    def detect(self, key: str, img: np.ndarray) -> np.ndarray:
+        """Faces in a frame: N x 4 array of (x1, y1, x2, y2)"""
+        img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        if self.scale < 1:
+            img_gray = cv2.resize(img_gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+        previous = self.previous.get(key)
+        # (without previous faces, there's nothing to search around: new faces need a full scan)
+        if self.full_every and previous is not None and len(previous) and self.since_full[key] + 1 < self.full_every:
+            with timed("faces.search", key):
+                boxes = self._search(img_gray, previous * self.scale)
+            self.since_full[key] += 1
+        else:
+            with timed("faces.scan", key):
+                faces = face_cascade().detectMultiScale(img_gray, 1.3, 5)
+                boxes = np.array(faces, dtype=np.float32).reshape(-1, 4)
+                boxes[:, 2:] += boxes[:, :2]
+            self.since_full[key] = 0
+
+        boxes /= self.scale
+        self.previous[key] = boxes
+        return boxes
+
+    def _search(self, img_gray: np.ndarray, previous: np.ndarray) -> np.ndarray:
+        """Faces near the previous ones (boxes in img_gray coordinates)"""
+        height, width = img_gray.shape[:2]
+        found = []
+        for x1, y1, x2, y2 in previous:
+            size = max(x2 - x1, y2 - y1)
+            margin = size * self.SEARCH_MARGIN
+            rx1, ry1 = int(max(x1 - margin, 0)), int(max(y1 - margin, 0))
+            rx2, ry2 = int(min(x2 + margin, width)), int(min(y2 + margin, height))
+            faces = face_cascade().detectMultiScale(
+                img_gray[ry1:ry2, rx1:rx2], 1.1, 5,
+                minSize=(int(size * 0.7),) * 2, maxSize=(int(size * 1.4) + 1,) * 2)
+            for (x, y, w, h) in faces:
+                found.append((x + rx1, y + ry1, x + rx1 + w, y + ry1 + h))
+
+        boxes = np.array(found, dtype=np.float32).reshape(-1, 4)
+        if len(boxes) > 1:
+            # regions of nearby faces overlap
+            boxes = boxes[nms(boxes, np.ones(len(boxes)), np.zeros(len(boxes)), iou_thresh=0.3)]
+        return boxes
 
     def process(self, images: Sequence[Image]) -> Dict[str, Image]:
         outputs = {}
+        self.results = {}
         for (i, image) in enumerate(images):
             if image is not None:
+                key = str(i)
                 img = image.get(ImageType.OPENCV)
-                img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-                # detect
-                faces = Faces.FACE_CASCADE.detectMultiScale(img_gray, 1.3, 5)
+                if self.TRACKER and not self.TRACKER.needs_detection(key):
+                    self.results[key] = self.TRACKER.track(key, image)
+                else:
+                    self.results[key] = {"boxes": self.detect(key, img)}
+                    if self.TRACKER:
+                        self.results[key] = self.TRACKER.update(key, image, self.results[key])
+                if self.TRACKER:
+                    # search around where the faces are now, rather than where they were last detected
+                    self.previous[key] = self.results[key]["boxes"]
 
                 # draw
-                for x, y, w, h in faces:
-                    img = cv2.rectangle(img, (x, y), (x+w, y+h), Faces.BOX_COLOUR, 2)
-
-                outputs[str(i)] = Image(img, opencv=True)
+                if self.render:
+                    img = img.copy()
+                    results = self.results[key]
+                    if "track_ids" in results:
+                        draw_boxes(img, results["boxes"], results["scores"], results["labels"], ["face"],
+                                   track_ids=results["track_ids"])
+                    else:
+                        for x1, y1, x2, y2 in results["boxes"].astype(np.int32):
+                            img = cv2.rectangle(img, (x1, y1), (x2, y2), Faces.BOX_COLOUR, 2)
+
+                    outputs[key] = Image(img, copy=False, opencv=True)
 
         return outputs
 
 
-class CloudFaces(Inference):
+class CloudFaces(CloudInference):
     """Face detection, using a Cloud provider"""
-    ARGUMENTS = {
-        'cloud': str
-    }
-    KEYSTROKES = {}
-
-
-    def __init__(self, cloud=None):
-        cloud = cloud or "aws"
-
-        if cloud == "aws":
-            self.PROVIDER = AWSInference()
-        else:
-            raise ValueError(f"Unknown cloud provider: {cloud}")
-
-        self.PROVIDER.load(InferenceType.FACE_DETECTION)
-        if self.PROVIDER.KEYSTROKES:
-            self.KEYSTROKES.update(self.PROVIDER.KEYSTROKES)
-
-    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
-        outputs = {}
-        for (i, image) in enumerate(images):
-            if image is not None:
-                metadata = self.PROVIDER.process(image)
-                visualised = self.PROVIDER.visualise(image, metadata)
-
-                outputs[str(i)] = visualised
-
-        return outputs
+    ARGUMENTS = dict(
+        CloudInference.ARGUMENTS,
+        prefilter=str,  # only send frames with faces found locally (Haar cascade): frame, or crops around them
+        padding=float,  # with crops: padding around the local faces, as a fraction of their size (default 0.5)
+    )
+    INFERENCE_TYPE = InferenceType.FACE_DETECTION
+    PREFILTER_SIZE = 320  # local detection on frames downscaled to this width
+
+    def __init__(self, prefilter=None, padding=None, **kwargs):
+        super().__init__(**kwargs)
+        self.PREFILTER = None
+        if prefilter:
+            from cloud.prefilter import PrefilteredProvider
+            face_cascade()
+            self.PREFILTER = PrefilteredProvider(self.PROVIDER, self.candidates, prefilter, padding or 0.5)
+            self.PROVIDER = self.PREFILTER
+            if self.PIPELINE:
+                self.PIPELINE.provider = self.PREFILTER
+
+    def candidates(self, img: np.ndarray) -> np.ndarray:
+        """Faces found by the (permissive) local detector: N x 4 array of (x1, y1, x2, y2)"""
+        scale = min(1.0, self.PREFILTER_SIZE / img.shape[1])
+        img_gray = cv2.cvtColor(cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA),
+                                cv2.COLOR_BGR2GRAY)
+        faces = face_cascade().detectMultiScale(img_gray, 1.2, 3, minSize=(20, 20))
+        boxes = np.array(faces, dtype=np.float32).reshape(-1, 4) / scale
+        boxes[:, 2:] += boxes[:, :2]
+        return boxes
 
-    def handle_command(self, key):
-        self.PROVIDER.handle_command(key)
@@ -1,66 +1,85 @@
-from dnn.mxnet import MxnetLoader, ModelType
-from cloud.aws import AWSInference, InferenceType
+from cloud import mosaic
+from cloud.provider import InferenceType
+from dnn.loader import ModelType
 from images.image import Image
-from ..inference import Inference
+from profiling import PROFILER
+from ..neural import NeuralInference
+from ..remote import CloudInference
 
-from typing import Sequence, Dict
+from typing import Sequence, Dict, Any
+import weakref
 
 
-class Objects(Inference):
+class Objects(NeuralInference):
     """Object detection, using neural nets"""
-    ARGUMENTS = {
-        'model': str
-    }
+    ARGUMENTS = dict(
+        NeuralInference.ARGUMENTS,
+        **NeuralInference.TILE_ARGUMENTS,
+        detect_every=int,  # run the model every N frames, and track the boxes in between
+    )
+    MODEL_TYPE = ModelType.DETECTION
+    DEFAULT_MODEL = {"mxnet": "yolo", "opencv": "yolo"}
 
-    def __init__(self, model=None):
-        self.LOADER = MxnetLoader()
-        self.LOADER.load(model or "yolo", ModelType.DETECTION)
 
-    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
-        outputs = {}
-        for (i, image) in enumerate(images):
-            if image is not None:
-                metadata = self.LOADER.process(image)
-                visualised = self.LOADER.visualise(image, metadata)
-
-                outputs[str(i)] = visualised
-
-        return outputs
-
-
-class CloudObjects(Inference):
+class CloudObjects(CloudInference):
     """Object detection, using a Cloud provider"""
-    ARGUMENTS = {
-        'cloud': str
-    }
-    KEYSTROKES = {}
-
-
-    def __init__(self, cloud=None):
-        cloud = cloud or "aws"
-
-        if cloud == "aws":
-            self.PROVIDER = AWSInference()
-        else:
-            raise ValueError(f"Unknown cloud provider: {cloud}")
-
-        self.PROVIDER.load(InferenceType.DETECTION)
-        if self.PROVIDER.KEYSTROKES:
-            self.KEYSTROKES.update(self.PROVIDER.KEYSTROKES)
+    ARGUMENTS = dict(
+        CloudInference.ARGUMENTS,
+        mosaic=int,  # pack the (changed) frames of all streams into one request, downscaled to this width
+    )
+    INFERENCE_TYPE = InferenceType.DETECTION
+    MOSAIC_KEY = "mosaic"
+
+    def __init__(self, mosaic=None, **kwargs):
+        if mosaic and kwargs.get("priority"):
+            raise ValueError("priority can't be combined with mosaic (all streams share each request)")
+        super().__init__(**kwargs)
+        self.MOSAIC = mosaic
+        self.LAYOUTS = weakref.WeakKeyDictionary()  # mosaic Image -> ({stream: placement}, mosaic size)
 
     def process(self, images: Sequence[Image]) -> Dict[str, Image]:
+        if not self.MOSAIC:
+            return super().process(images)
+
         outputs = {}
-        for (i, image) in enumerate(images):
-            if image is not None:
-                metadata = self.PROVIDER.process(image)
-                visualised = self.PROVIDER.visualise(image, metadata)
+        self.results = {}
+        frames = {str(i): image for (i, image) in enumerate(images) if image is not None}
+
+        self.frames.update(frames)
+
+        todo = [key for (key, image) in frames.items() if not self.GATE.reuse(key, image)]
+        if todo:
+            img, placements = mosaic.pack([frames[key] for key in todo], self.MOSAIC)
+            packed = Image(img, copy=False, opencv=True)
+            self.LAYOUTS[packed] = (dict(zip(todo, placements)), (img.shape[1], img.shape[0]))
+            PROFILER.count("cloud.mosaic.frames", len(todo))
+            self.request(self.MOSAIC_KEY, packed)
+        if self.PIPELINE:
+            self.collect(self.MOSAIC_KEY, None)
+
+        for key, image in frames.items():
+            self.output(key, image, outputs)
+        return outputs
 
-                outputs[str(i)] = visualised
+    def flush(self) -> Dict[str, Image]:
+        if not (self.MOSAIC and self.PIPELINE):
+            return super().flush()
 
+        outputs = {}
+        self.results = {}
+        self.PIPELINE.wait()
+        self.collect(self.MOSAIC_KEY, None)
+        for key, image in self.frames.items():
+            self.output(key, image, outputs)
         return outputs
 
-    def handle_command(self, key):
-        self.PROVIDER.handle_command(key)
-
+    def deliver(self, key: str, image: Image, metadata: Dict[str, Any]):
+        if key != self.MOSAIC_KEY:
+            return super().deliver(key, image, metadata)
 
-# TODO add class for AWS[Rekognition]Objects
\ No newline at end of file
+        # split the mosaic response by tile
+        layout, size = self.LAYOUTS[image]
+        keys = list(layout)
+        labels = mosaic.split_labels(metadata["detections"], [layout[k] for k in keys], size)
+        for stream, stream_labels in zip(keys, labels):
+            super().deliver(stream, image, dict(metadata, detections=stream_labels, mosaic=len(keys)))
@@ -7,11 +7,14 @@ import cv2
 
 
 class Nothing(Inference):
+    BATCHABLE = True
+
     def process(self, images: Sequence[Image]) -> Dict[str, Image]:
         return {str(i): img for (i, img) in enumerate(images)}
 
 
 class Edges(Inference):
+    BATCHABLE = True
     thr1 = 60
     thr2 = 120
 
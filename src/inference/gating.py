@@ -0,0 +1,82 @@
+import time
+import cv2
+
+from images.image import Image
+from images.image_type import ImageType
+from profiling import PROFILER
+
+from typing import Any, Callable
+
+
+class MotionGate:
+    """
+    Skip expensive inference on frames that didn't change
+
+    Each stream's frame is compared to the last frame that was actually processed,
+    on a small greyscale thumbnail (mean absolute difference, 0-255). While the
+    score stays below the threshold, the previous results are reused, until they
+    are older than max_age seconds.
+
+    A gate without threshold is disabled (always processes).
+    """
+
+    def __init__(self, threshold: float = None, max_age: float = None, size=(64, 48)):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self.references = {}  # per stream: thumbnail of the last processed frame
+        self.timestamps = {}  # per stream: time of the last processed frame
+        self.results = {}     # per stream: results of the last processed frame
+        self.pending = {}     # per stream: (thumbnail, time) of a frame that is being processed
+
+    def thumbnail(self, image: Image):
+        img = image.get(ImageType.OPENCV)
+        thumbnail = cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        return thumbnail
+
+    def score(self, key: str, thumbnail) -> float:
+        """Change since the last processed frame of this stream (inf if there is none)"""
+        if key not in self.references:
+            return float("inf")
+        return cv2.norm(thumbnail, self.references[key], cv2.NORM_L1) / thumbnail.size
+
+    def reuse(self, key: str, image: Image) -> bool:
+        """
+        Whether the previous results of this stream (self.results[key]) can be used for this frame
+
+        If not, the frame should be processed and its results passed to update().
+        """
+        if self.threshold is None:
+            return False
+
+        thumbnail = self.thumbnail(image)
+        now = time.time()
+        expired = self.max_age is not None and now - self.timestamps.get(key, 0) > self.max_age
+
+        if not expired and key in self.results and self.score(key, thumbnail) < self.threshold:
+            PROFILER.count("gate.skipped")
+            return True
+
+        PROFILER.count("gate.processed")
+        self.pending[key] = (thumbnail, now)
+        return False
+
+    def update(self, key: str, results: Any):
+        """Store the results of a processed frame"""
+        if key in self.pending:
+            self.references[key], self.timestamps[key] = self.pending.pop(key)
+        self.results[key] = results
+
+    def run(self, key: str, image: Image, func: Callable[[Image], Any]) -> Any:
+        """Results of func(image), or the previous results of this stream if the frame didn't change enough"""
+        if self.reuse(key, image):
+            return self.results[key]
+
+        results = func(image)
+        self.update(key, results)
+        return results
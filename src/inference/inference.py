@@ -1,6 +1,6 @@
 from images.image import Image
 
-from typing import Sequence, Dict
+from typing import Sequence, Dict, Any
 
 
 class Inference:
@@ -8,13 +8,36 @@ class Inference:
     KEYSTROKES = {}  # Dict of {character: description} to be handled by handle_keystroke
     ARGUMENTS = {}   # Dict of {key: type} to be passed as kwargs to __init__ (may have None value)
 
+    BATCHABLE = False  # Whether images are processed independently (i.e., images of several frames may
+                       # be passed to process() at once, as extra streams)
+
+    render = True    # Set to False if the output images aren't used (e.g., headless runs); see results
+    results = {}     # Structured results of the last process() call, if supported (see process)
+
     def process(self, images: Sequence[Image]) -> Dict[str, Image]:
         """
         The process method takes an ordered list of images (each Image or None),
         and produces a dict with named output images.
+
+        Classes producing structured results (e.g., detections) also store them in
+        self.results, as a dict of {image name: {result name: np.ndarray (or list)}};
+        when self.render is False, these classes may skip drawing the output images.
         """
         raise NotImplementedError()
 
+    def flush(self) -> Dict[str, Image]:
+        """
+        Outputs of work still in progress when the streams end (e.g., cloud requests in flight),
+        like process() (including self.results); called once, after the last frame
+        """
+        return {}  # optional to implement
+
+    def close(self):
+        """
+        Release resources (e.g., worker threads) at the end of a run
+        """
+        pass  # optional to implement
+
     def handle_command(self, key):
         """
         Handle single-character commands (e.g., keyboard strokes for the interactive viewer)
@@ -27,6 +27,7 @@ class StereoVision(Inference):
         'c': "Calibrate cameras",
         ' ': "Start taking snapshots (during calibration)",
         'a': "Switch algorithm",
+        'u': "Show/hide undistorted images",
     }
     CACHE = os.path.expanduser("~/.cvlab/")
     STAGES = {"CALIBRATE_WAIT": 1, "CALIBRATING": 2, "RUNNING": 3}
@@ -36,6 +37,7 @@ class StereoVision(Inference):
 
     def __init__(self):
         self.sgbm = True
+        self.show_undistorted = False
         self.reset_calibration()
         loaded = self.load_params()
         if loaded:
@@ -52,6 +54,7 @@ class StereoVision(Inference):
         # final calibration parameters
         self.camparams = {}
         self.pairparams = {}
+        self.undistort_maps = {}  # per camera: (image size, fixed-point undistortion maps), when shown
 
         self.stereo_matcher = None
 
@@ -179,18 +182,16 @@ class StereoVision(Inference):
             print("Recalibrate (touch 'c') if old parameters were loaded from the cache.")
             return {str(i): image for (i, image) in enumerate(images)}
 
-        # return undistorted images
-        for i, image in enumerate(images):
-            key = str(i)
-            img = image.get(ImageType.OPENCV)
-            camparams = self.camparams[key]
-
-            img_undistort = cv2.undistort(
-                img, camparams["intrinsic"], camparams["distortion"],
-                None, camparams["intrinsic_crop"])
-            #x, y, w, h = camparams["intrinsic_roi"]
-            #img_undistort = img_undistort[y:y+h, x:x+w]
-            outputs[key] = Image(img_undistort, opencv=True)
+        # undistorted images (a separate remap; rectification below doesn't need them)
+        if self.show_undistorted:
+            for i, image in enumerate(images):
+                key = str(i)
+                img = image.get(ImageType.OPENCV)
+                img_size = img.shape[1::-1]
+                if self.undistort_maps.get(key, (None,))[0] != img_size:
+                    self.undistort_maps[key] = (img_size, mvutils.undistort_maps(self.camparams[key], img_size))
+                map1, map2 = self.undistort_maps[key][1]
+                outputs[key] = Image(cv2.remap(img, map1, map2, cv2.INTER_LINEAR), copy=False, opencv=True)
 
         # return depth image(s)
         if not self.stereo_matcher:
@@ -210,19 +211,19 @@ class StereoVision(Inference):
             key_l, key_r = str(index_l), str(index_r)
             pairkey = "{}|{}".format(key_l, key_r)
 
-            img_l = outputs[key_l].get(ImageType.OPENCV)
-            img_r = outputs[key_r].get(ImageType.OPENCV)
+            img_l = images[index_l].get(ImageType.OPENCV)
+            img_r = images[index_r].get(ImageType.OPENCV)
             pairparams = self.pairparams[(key_l, key_r)]
 
-            img_l_rect = cv2.remap(
-                img_l, pairparams["map_x"][0], pairparams["map_y"][0], cv2.INTER_LINEAR)
-            img_r_rect = cv2.remap(
-                img_r, pairparams["map_x"][1], pairparams["map_y"][1], cv2.INTER_LINEAR)
+            # undistort + rectify the original images in one pass (fixed-point maps)
+            (map1_l, map2_l), (map1_r, map2_r) = pairparams["maps"]
+            img_l_rect = cv2.remap(img_l, map1_l, map2_l, cv2.INTER_LINEAR)
+            img_r_rect = cv2.remap(img_r, map1_r, map2_r, cv2.INTER_LINEAR)
 
             img_l_gray = cv2.cvtColor(img_l_rect, cv2.COLOR_BGR2GRAY)
             img_r_gray = cv2.cvtColor(img_r_rect, cv2.COLOR_BGR2GRAY)
-            outputs[key_l + "_rect_" + pairkey] = Image(img_l_rect, opencv=True)
-            outputs[key_r + "_rect_" + pairkey] = Image(img_r_rect, opencv=True)
+            outputs[key_l + "_rect_" + pairkey] = Image(img_l_rect, copy=False, opencv=True)
+            outputs[key_r + "_rect_" + pairkey] = Image(img_r_rect, copy=False, opencv=True)
 
             img_depth = self.stereo_matcher.compute(img_l_gray, img_r_gray)
 
@@ -246,7 +247,7 @@ class StereoVision(Inference):
             return False
         else:
             self.camparams = camparams
-            self.pairparams = pairparams
+            self.pairparams = {pair: mvutils.upgrade_pairparams(params) for (pair, params) in pairparams.items()}
             return True
 
     def handle_command(self, key):
@@ -258,4 +259,7 @@ class StereoVision(Inference):
             self.sgbm = not self.sgbm
             self.stereo_matcher = None
             print("Now using", "SGBM" if self.sgbm else "BM")
+        elif key == 'u':
+            self.show_undistorted = not self.show_undistorted
+            print("Showing" if self.show_undistorted else "Hiding", "undistorted images")
 
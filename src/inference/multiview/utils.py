@@ -49,6 +49,12 @@ def calibrate_camera_pair(world_coords, img_coords_l, img_coords_r,
         camparams_l["intrinsic"], camparams_l["distortion"],
         camparams_r["intrinsic"], camparams_r["distortion"],
         img_size)
+
+    return rectify_camera_pair(camparams_l, camparams_r, img_size, R, T)
+
+
+def rectify_camera_pair(camparams_l, camparams_r, img_size, R, T):
+    """Rectification parameters and maps for a camera pair with known R/T between them"""
     rect_l, rect_r, proj_l, proj_r, disparity2depth, roi_l, roi_r = cv2.stereoRectify(
         camparams_l["intrinsic"], camparams_l["distortion"],
         camparams_r["intrinsic"], camparams_r["distortion"],
@@ -68,8 +74,32 @@ def calibrate_camera_pair(world_coords, img_coords_l, img_coords_r,
         "proj": (proj_l, proj_r),
         "roi": (roi_l, roi_r),
         "disparity2depth": disparity2depth,
-        "map_x": (map_x_l, map_x_r),
-        "map_y": (map_y_l, map_y_r),
+        # undistortion + rectification, in one remap() per image
+        "maps": (fixed_point_maps(map_x_l, map_y_l), fixed_point_maps(map_x_r, map_y_r)),
     }
 
     return pairparams
+
+
+def fixed_point_maps(map_x, map_y):
+    """
+    Float (CV_32FC1) remap maps -> fixed-point (CV_16SC2 + interpolation table) maps
+
+    remap() is considerably faster with fixed-point maps, at 1/32 pixel precision.
+    """
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+def undistort_maps(camparams, img_size):
+    """Fixed-point remap maps for undistortion only (to the cropped intrinsic matrix)"""
+    return cv2.initUndistortRectifyMap(
+        camparams["intrinsic"], camparams["distortion"],
+        None, camparams["intrinsic_crop"], img_size, cv2.CV_16SC2)
+
+
+def upgrade_pairparams(pairparams):
+    """Add fixed-point maps to pair parameters cached before they existed (float map_x/map_y only)"""
+    if "maps" not in pairparams and "map_x" in pairparams:
+        pairparams["maps"] = tuple(fixed_point_maps(map_x, map_y)
+                                   for (map_x, map_y) in zip(pairparams.pop("map_x"), pairparams.pop("map_y")))
+    return pairparams
@@ -0,0 +1,121 @@
+from dnn.draw import draw_boxes
+from dnn.loader import ModelType
+from images.image import Image
+from images.image_type import ImageType
+from .inference import Inference
+from .gating import MotionGate
+from .tracking import BoxTracker
+
+from typing import Sequence, Dict, Any
+import time
+
+
+class NeuralInference(Inference):
+    """
+    Base class for inference using a (deep) neural network model per image
+
+    Subclasses set the MODEL_TYPE and DEFAULT_MODEL (per loader), and may customise visualise().
+    """
+    ARGUMENTS = {
+        'model': str,
+        'gate': float,     # reuse results while frames change less than this (mean abs. difference, 0-255)
+        'max_age': float,  # ..but at most this many seconds
+        'warmup': str,     # expected frame sizes to prepare the model for, e.g. "640x480,1280x720"
+        'quantize': str,   # directory with calibration images: run an INT8 model (CPU only, mxnet)
+        'loader': str,     # model framework: mxnet (default), opencv
+        'backend': str,    # opencv backend[:target], e.g. "opencv", "inference_engine:myriad", "cuda:cuda_fp16"
+        'threads': int,    # opencv threads
+    }
+    # for detection and segmentation classes (see Objects, Segmentation)
+    TILE_ARGUMENTS = {
+        'tile': int,       # process large frames in overlapping tiles of this size (px), e.g. 512
+        'fps': float,      # adapt the model input resolution to hold this frame rate
+    }
+    MODEL_TYPE = None
+    DEFAULT_MODEL = {}  # loader name -> model name
+    BATCHABLE = True
+
+    def __init__(self, model=None, gate=None, max_age=None, warmup=None, quantize=None,
+                 loader=None, backend=None, threads=None, tile=None, detect_every=None, fps=None):
+        from dnn.loader import create_loader  # loaders import their (heavy) framework only when used
+
+        # "WxH,.." -> [(height, width), ..]
+        warmup_sizes = [tuple(int(v) for v in reversed(size.split("x"))) for size in (warmup or "640x480").split(",")]
+        loader = loader or "mxnet"
+        if loader != "opencv" and (backend or threads):
+            raise ValueError("backend and threads are only supported by the opencv loader")
+        if loader != "mxnet" and quantize:
+            raise ValueError("quantize is only supported by the mxnet loader")
+        if (tile or fps) and self.MODEL_TYPE not in (ModelType.DETECTION, ModelType.SEGMENTATION):
+            raise ValueError("tile and fps need a detection or segmentation model")
+        if detect_every and self.MODEL_TYPE is not ModelType.DETECTION:
+            raise ValueError("detect_every needs a detection model")
+        options = {"quantize": quantize} if quantize else {}
+        self.LOADER = create_loader(loader, backend=backend, threads=threads)
+        self.LOADER.load(model or self.DEFAULT_MODEL.get(loader), self.MODEL_TYPE, warmup=warmup_sizes, **options)
+        self.TILER = None
+        if tile:
+            from dnn.tiling import TiledProcessor
+            self.TILER = TiledProcessor(self.LOADER, tile=tile)
+        self.GATE = MotionGate(gate, max_age)
+        if gate is not None:
+            self.BATCHABLE = False  # the gate compares consecutive frames per stream
+
+        self.TRACKER = None
+        if detect_every:
+            if gate is not None:
+                raise ValueError("detect_every can't be combined with gate (the tracker already skips frames)")
+            self.TRACKER = BoxTracker(detect_every)
+            self.BATCHABLE = False  # boxes are tracked between consecutive frames per stream
+
+        self.ADAPTIVE = None
+        if fps:
+            from dnn.adaptive import ResolutionController
+            if tile:
+                raise ValueError("fps can't be combined with tile (tiles are processed at full resolution)")
+            self.ADAPTIVE = ResolutionController(fps)
+
+    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
+        _start = time.perf_counter()
+        outputs = {}
+        self.results = {}
+        frames = {str(i): image for (i, image) in enumerate(images) if image is not None}
+
+        # run all (changed, or not tracked) frames through the model at once
+        if self.TRACKER:
+            todo = [key for key in frames if self.TRACKER.needs_detection(key)]
+        else:
+            todo = [key for (key, image) in frames.items() if not self.GATE.reuse(key, image)]
+        if todo:
+            if self.TILER:
+                # tiles of each frame are batched instead
+                batch = [self.TILER.process(frames[key]) for key in todo]
+            elif self.ADAPTIVE:
+                short, max_size = self.ADAPTIVE.resolution
+                batch = self.LOADER.process_batch([frames[key] for key in todo], short, max_size)
+            else:
+                batch = self.LOADER.process_batch([frames[key] for key in todo])
+            for key, metadata in zip(todo, batch):
+                self.GATE.update(key, metadata)
+
+        for key, image in frames.items():
+            metadata = self.GATE.results[key]
+            if self.TRACKER:
+                # tracked results (with track ids) replace the metadata
+                metadata = self.TRACKER.update(key, image, self.LOADER.results(image, metadata)) \
+                    if key in todo else self.TRACKER.track(key, image)
+            self.results[key] = self.LOADER.results(image, metadata)
+
+            if self.render:
+                outputs[key] = self.visualise(image, metadata)
+
+        if self.ADAPTIVE and todo:
+            self.ADAPTIVE.update(time.perf_counter() - _start)
+        return outputs
+
+    def visualise(self, image: Image, metadata: Dict[str, Any]) -> Image:
+        if "track_ids" in metadata:
+            img = draw_boxes(image.get(ImageType.OPENCV).copy(), metadata["boxes"], metadata["scores"],
+                             metadata["labels"], self.LOADER.class_names(), track_ids=metadata["track_ids"])
+            return Image(img, copy=False, opencv=True)
+        return self.LOADER.visualise(image, metadata)
@@ -0,0 +1,185 @@
+from images.image import Image
+from profiling import PROFILER
+from .inference import Inference
+from .gating import MotionGate
+
+from typing import Sequence, Dict, Any
+
+
+class CloudInference(Inference):
+    """
+    Base class for inference using a cloud provider
+
+    Subclasses set the INFERENCE_TYPE.
+    """
+    ARGUMENTS = {
+        'cloud': str,      # aws (default), or fake[:latency[:kB/s]] for a local stand-in (no network, no cost)
+        'gate': float,     # reuse results while frames change less than this (mean abs. difference, 0-255)
+        'max_age': float,  # ..but at most this many seconds
+        'concurrency': int,  # keep up to this many requests in flight per stream
+        'delivery': str,   # with concurrency: latest (default; newest results win), ordered (in frame order)
+        'cache': int,      # reuse responses of near-identical frames (perceptual hash distance, 0-64 bits), e.g. 4
+        'cache_ttl': float,   # ..for at most this many seconds (default 300)
+        'cache_disk': float,  # ..and keep them on disk (under CVLAB_CACHE) for this many hours
+        'upload_size': int,   # downscale frames for upload to at most this many pixels on the long side
+        'upload_kb': int,     # ..and/or re-encode them to at most this many kB
+        'tps': float,      # send at most this many requests per second (over all streams)
+        'budget': int,     # ..and at most this many per day (counted across runs)
+        'priority': str,   # weights of the streams when requests are limited, e.g. "2,1,1"
+    }
+    KEYSTROKES = {}
+    INFERENCE_TYPE = None
+
+    def __init__(self, cloud=None, gate=None, max_age=None, concurrency=None, delivery=None,
+                 cache=None, cache_ttl=None, cache_disk=None, upload_size=None, upload_kb=None,
+                 tps=None, budget=None, priority=None):
+        from cloud.encoder import UploadEncoder
+
+        cloud = cloud or "aws"
+        options = {"encoder": UploadEncoder(upload_size, upload_kb and upload_kb * 1024)}
+        if concurrency and concurrency > 1:
+            # one pooled connection per request in flight (grown per stream by the pipeline);
+            # retries are done by the pipeline
+            options.update(connections=concurrency, retries=1)
+
+        if cloud == "aws":
+            from cloud.aws import AWSInference  # heavy import, only when used
+            self.PROVIDER = AWSInference()
+        elif cloud.split(":")[0] == "fake":
+            from cloud.aws import AWSInference
+            from cloud.fake import FakeRekognitionClient
+            self.PROVIDER = AWSInference()
+            # fake[:latency[:bandwidth (kB/s)]]
+            settings = [float(value) for value in cloud.split(":")[1:]]
+            latency = settings[0] if settings else 0.2
+            bandwidth = settings[1] * 1024 if len(settings) > 1 else None
+            options["client"] = FakeRekognitionClient(latency, bandwidth=bandwidth)
+        else:
+            raise ValueError(f"Unknown cloud provider: {cloud}")
+
+        self.PROVIDER.load(self.INFERENCE_TYPE, **options)
+        self.KEYSTROKES = dict(self.KEYSTROKES, **self.PROVIDER.KEYSTROKES)
+        self.GATE = MotionGate(gate, max_age)
+        self.frames = {}  # latest frame per stream (see flush)
+
+        self.GOVERNOR = None
+        if tps or budget is not None or priority:
+            from cloud.governor import RequestGovernor
+            priorities = {str(i): float(weight) for (i, weight) in enumerate((priority or "").split(",")) if weight}
+            self.GOVERNOR = RequestGovernor(tps, budget, priorities)
+            self.KEYSTROKES = dict(self.KEYSTROKES, g="Print cloud request counts")
+
+        self.PIPELINE = None
+        if concurrency and concurrency > 1:
+            from cloud.pipeline import PipelinedProvider
+            self.PIPELINE = PipelinedProvider(self.PROVIDER, workers=concurrency, delivery=delivery or "latest",
+                                              governor=self.GOVERNOR)
+
+        self.CACHE = None
+        if cache is not None:
+            from cloud.cache import ResponseCache
+            self.CACHE = ResponseCache(cache, ttl=cache_ttl or 300, disk_ttl=cache_disk and cache_disk * 3600)
+            self.KEYSTROKES = dict(self.KEYSTROKES, c="Print cloud cache statistics")
+
+    def request(self, key: str, image: Image):
+        """
+        Get a response for a frame: from the cache, or from the provider if the governor allows
+
+        Responses are delivered to the gate (see deliver()); when the request is denied, the
+        stream keeps its previous (stale) results.
+        """
+        if self.CACHE:
+            cached = self.CACHE.get(self.INFERENCE_TYPE, image)
+            if cached is not None:
+                self.deliver(key, image, cached)
+                return
+
+        calls = self.PROVIDER.calls(image)
+        if calls == 0:
+            # nothing to send (e.g., no faces found locally, see PrefilteredProvider)
+            self.deliver(key, image, self.PROVIDER.process(image))
+            return
+
+        if self.PIPELINE and not self.PIPELINE.accepts(key):
+            return
+        if self.GOVERNOR and not self.GOVERNOR.acquire(key, calls):
+            if key in self.GATE.results:
+                PROFILER.count("cloud.governor.stale")
+            return
+
+        if self.PIPELINE:
+            self.PIPELINE.submit(key, image)
+        else:
+            metadata = self.PROVIDER.process(image)
+            if self.GOVERNOR:
+                self.GOVERNOR.charge(metadata.get("retries", 0))
+            if self.CACHE:
+                self.CACHE.put(self.INFERENCE_TYPE, image, metadata)
+            self.deliver(key, image, metadata)
+
+    def collect(self, key: str, image: Image) -> Image:
+        """Deliver the completed requests of a stream (with concurrency); returns the frame to show"""
+        for frame, metadata in self.PIPELINE.collect(key):
+            if self.CACHE:
+                self.CACHE.put(self.INFERENCE_TYPE, frame, metadata)
+            self.deliver(key, frame, metadata)
+            if self.PIPELINE.delivery == "ordered":
+                image = frame  # show results on the frame they belong to
+        return image
+
+    def deliver(self, key: str, image: Image, metadata: Dict[str, Any]):
+        """Store the response for a frame of a stream"""
+        self.GATE.update(key, metadata)
+
+    def output(self, key: str, image: Image, outputs: Dict[str, Image]):
+        """Results (and output image) of a stream, from its latest response"""
+        metadata = self.GATE.results.get(key)
+        if metadata is None:
+            return  # no results for this stream yet
+        self.results[key] = self.PROVIDER.results(image, metadata)
+
+        if self.render:
+            outputs[key] = self.PROVIDER.visualise(image, metadata)
+
+    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
+        outputs = {}
+        self.results = {}
+        frames = {str(i): image for (i, image) in enumerate(images) if image is not None}
+        self.frames.update(frames)
+        keys = self.GOVERNOR.order(list(frames)) if self.GOVERNOR else list(frames)
+
+        for key in keys:
+            image = frames[key]
+            if not self.GATE.reuse(key, image):
+                self.request(key, image)
+
+            if self.PIPELINE:
+                image = self.collect(key, image)
+            self.output(key, image, outputs)
+
+        return outputs
+
+    def flush(self) -> Dict[str, Image]:
+        """Wait for the requests in flight (with concurrency), and deliver them on the latest frames"""
+        outputs = {}
+        self.results = {}
+        if not self.PIPELINE:
+            return outputs
+
+        self.PIPELINE.wait()
+        for key, image in self.frames.items():
+            self.output(key, self.collect(key, image), outputs)
+        return outputs
+
+    def close(self):
+        if self.PIPELINE:
+            self.PIPELINE.close()
+        if self.GOVERNOR:
+            self.GOVERNOR.close()
+
+    def handle_command(self, key):
+        if key == 'c' and self.CACHE:
+            print("Cloud cache: {}".format(self.CACHE.report()))
+        elif key == 'g' and self.GOVERNOR:
+            print("Cloud requests: {}".format(self.GOVERNOR.report()))
+        self.PROVIDER.handle_command(key)
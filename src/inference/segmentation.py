@@ -1,37 +1,28 @@
-from dnn.mxnet import MxnetLoader, ModelType
+from dnn.loader import ModelType
 from images.image import Image
-from inference.inference import Inference
+from inference.neural import NeuralInference
 
-from typing import Sequence, Dict
+from typing import Dict, Any
 
 
-class Segmentation(Inference):
+class Segmentation(NeuralInference):
     """Segmentation, using neural nets"""
     KEYSTROKES = {
         '-': "Decrease segmentation mask visibility (more original image)",
         '+': "Increase segmentation mask visibility",
         'l': "Show/hide class labels"
     }
-    ARGUMENTS = {
-        'model': str
-    }
+    ARGUMENTS = dict(NeuralInference.ARGUMENTS, **NeuralInference.TILE_ARGUMENTS)
+    MODEL_TYPE = ModelType.SEGMENTATION
+    DEFAULT_MODEL = {"mxnet": "deeplab", "opencv": "fcn"}
 
-    def __init__(self, model=None):
+    def __init__(self, **kwargs):
         self.blend = 0.75
         self.show_labels = True
-        self.LOADER = MxnetLoader()
-        self.LOADER.load(model or "deeplab", ModelType.SEGMENTATION)
-
-    def process(self, images: Sequence[Image]) -> Dict[str, Image]:
-        outputs = {}
-        for (i, image) in enumerate(images):
-            if image is not None:
-                metadata = self.LOADER.process(image)
-                visualised = self.LOADER.visualise(image, metadata, blend=self.blend, show_labels=self.show_labels)
-
-                outputs[str(i)] = visualised
+        super().__init__(**kwargs)
 
-        return outputs
+    def visualise(self, image: Image, metadata: Dict[str, Any]) -> Image:
+        return self.LOADER.visualise(image, metadata, blend=self.blend, show_labels=self.show_labels)
 
     def handle_command(self, key):
         if key == '-':
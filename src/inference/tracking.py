@@ -0,0 +1,290 @@
+import cv2
+import numpy as np
+
+from dnn.tiling import box_iou
+from images.image import Image
+from images.image_type import ImageType
+from profiling import PROFILER, timed
+
+from typing import Any, Dict
+
+
+class BoxTracker:
+    """
+    Detect-then-track: propagate detected boxes between (expensive) detections
+
+    A detector runs every detect_every frames per stream, or sooner when the tracks become
+    unreliable; in between, boxes follow the sparse optical flow (Lucas-Kanade) of a grid of
+    points inside each box, which costs a few ms per frame. Detections are associated with
+    the (propagated) tracks by IoU, so objects keep a stable track id.
+
+    Usage, per stream (key) and frame:
+        if tracker.needs_detection(key):
+            results = tracker.update(key, image, detector(image))  # {"boxes": .., "scores": .., ..}
+        else:
+            results = tracker.track(key, image)
+    """
+    LK_PARAMS = {
+        "winSize": (21, 21),
+        "maxLevel": 3,
+        "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+    }
+
+    def __init__(self, detect_every: int = 5, min_confidence: float = 0.5, iou_thresh: float = 0.3,
+                 grid: int = 4, max_fb_error: float = 1.0):
+        """
+        detect_every: run the detector at least every this many frames
+        min_confidence: ..and as soon as a track's confidence (fraction of its points that
+                        still track reliably, compounded since its detection) drops below this
+        iou_thresh: minimum IoU to associate a detection with a track
+        grid: points per box side used for tracking
+        max_fb_error: maximum forward-backward error (px) of a reliable point
+        """
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.iou_thresh = iou_thresh
+        self.grid = grid
+        self.max_fb_error = max_fb_error
+        self.reset()
+
+    def reset(self):
+        self.previous = {}  # per stream: previous greyscale frame
+        self.tracks = {}    # per stream: {"boxes", "scores", "labels", "track_ids", "confidence"} arrays
+        self.names = {}     # per stream: {label: name}
+        self.age = {}       # per stream: frames since the last detection
+        self.next_id = 0
+
+    def needs_detection(self, key: str) -> bool:
+        if key not in self.tracks or self.age[key] + 1 >= self.detect_every:
+            return True
+        confidence = self.tracks[key]["confidence"]
+        return len(confidence) > 0 and confidence.min() < self.min_confidence
+
+    def track(self, key: str, image: Image) -> Dict[str, Any]:
+        """Propagate the tracks of this stream to a new frame"""
+        with timed("tracking.track", key):
+            grey = self._grey(image)
+            self.tracks[key] = self._propagate(self.tracks[key], self.previous[key], grey)
+            self.previous[key] = grey
+            self.age[key] += 1
+            PROFILER.count("tracking.tracked")
+            return self._results(key)
+
+    def update(self, key: str, image: Image, detections: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Start or correct the tracks of this stream with new detections
+
+        detections: {"boxes": (N x 4: x1, y1, x2, y2)}, and optionally "scores", "labels" and "names"
+        """
+        with timed("tracking.update", key):
+            grey = self._grey(image)
+            boxes = np.asarray(detections["boxes"], dtype=np.float32).reshape(-1, 4)
+            n = len(boxes)
+            scores = np.asarray(detections.get("scores", np.ones(n)), dtype=np.float32)
+            labels = np.asarray(detections.get("labels", np.zeros(n)), dtype=np.int32)
+            self.names.setdefault(key, {}).update(zip(labels.tolist(), detections.get("names", [])))
+
+            track_ids = np.full(n, -1, dtype=np.int64)
+            if key in self.tracks and len(self.tracks[key]["boxes"]) and n:
+                # associate with the tracks, moved to this frame
+                tracks = self._propagate(self.tracks[key], self.previous[key], grey)
+                overlaps = box_iou(tracks["boxes"], boxes)
+                overlaps[tracks["labels"][:, np.newaxis] != labels[np.newaxis, :]] = 0
+                # greedy matching, by decreasing IoU
+                for t, d in zip(*np.unravel_index(np.argsort(overlaps, axis=None)[::-1], overlaps.shape)):
+                    if overlaps[t, d] < self.iou_thresh:
+                        break
+                    if track_ids[d] == -1 and tracks["track_ids"][t] not in track_ids:
+                        track_ids[d] = tracks["track_ids"][t]
+
+            new = track_ids == -1
+            track_ids[new] = np.arange(self.next_id, self.next_id + new.sum())
+            self.next_id += int(new.sum())
+
+            self.tracks[key] = {
+                "boxes": boxes,
+                "scores": scores,
+                "labels": labels,
+                "track_ids": track_ids,
+                "confidence": np.ones(n, dtype=np.float32),
+            }
+            self.previous[key] = grey
+            self.age[key] = 0
+            PROFILER.count("tracking.detected")
+            return self._results(key)
+
+    def _grey(self, image: Image) -> np.ndarray:
+        img = image.get(ImageType.OPENCV)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+    def _propagate(self, tracks: Dict[str, np.ndarray], previous: np.ndarray, grey: np.ndarray) -> Dict[str, np.ndarray]:
+        """Move the boxes with the median flow of their points (and scale with their spread); drops lost tracks"""
+        boxes = tracks["boxes"]
+        if len(boxes) == 0:
+            return tracks
+
+        # grid of points in the inner part of each box: (boxes, grid * grid, 2)
+        steps = (np.arange(self.grid) + 0.5) / self.grid * 0.8 + 0.1
+        fx, fy = np.meshgrid(steps, steps)
+        sizes = boxes[:, 2:] - boxes[:, :2]
+        points = boxes[:, np.newaxis, :2] + np.stack([fx.ravel(), fy.ravel()], axis=1)[np.newaxis] * sizes[:, np.newaxis]
+        points = points.reshape(-1, 1, 2).astype(np.float32)
+
+        # forward and backward flow; reliable points come back where they started
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(previous, grey, points, None, **self.LK_PARAMS)
+        backward, status_back, _ = cv2.calcOpticalFlowPyrLK(grey, previous, forward, None, **self.LK_PARAMS)
+        fb_error = np.linalg.norm((backward - points).reshape(-1, 2), axis=1)
+        valid = ((status.ravel() == 1) & (status_back.ravel() == 1) & (fb_error < self.max_fb_error))
+
+        per_box = self.grid * self.grid
+        valid = valid.reshape(-1, per_box)
+        old, new = points.reshape(-1, per_box, 2), forward.reshape(-1, per_box, 2)
+
+        moved = np.empty_like(boxes)
+        for i in range(len(boxes)):
+            if valid[i].sum() < 3:
+                moved[i] = np.nan
+                continue
+            p0, p1 = old[i][valid[i]], new[i][valid[i]]
+            shift = np.median(p1 - p0, axis=0)
+            spread0 = np.linalg.norm(p0 - p0.mean(axis=0), axis=1)
+            spread1 = np.linalg.norm(p1 - p1.mean(axis=0), axis=1)
+            scale = np.median(spread1[spread0 > 0] / spread0[spread0 > 0]) if (spread0 > 0).any() else 1.0
+            centre = (boxes[i, :2] + boxes[i, 2:]) / 2 + shift
+            half = sizes[i] / 2 * scale
+            moved[i] = np.concatenate([centre - half, centre + half])
+
+        height, width = grey.shape[:2]
+        confidence = tracks["confidence"] * valid.mean(axis=1)
+        keep = ~np.isnan(moved[:, 0]) & (moved[:, 2] > 0) & (moved[:, 3] > 0) & \
+               (moved[:, 0] < width) & (moved[:, 1] < height)
+        np.clip(moved, 0, [width, height, width, height], out=moved)
+
+        propagated = {name: values[keep] for (name, values) in tracks.items()}
+        propagated["boxes"] = moved[keep]
+        propagated["confidence"] = confidence[keep].astype(np.float32)
+        return propagated
+
+    def _results(self, key: str) -> Dict[str, Any]:
+        tracks = self.tracks[key]
+        results = {name: values.copy() for (name, values) in tracks.items()}
+        results["detected"] = self.age[key] == 0
+        names = self.names.get(key)
+        if names:
+            results["names"] = [names.get(label, str(label)) for label in tracks["labels"].tolist()]
+        return results
+
+
+class PointTracker:
+    """
+    Sparse feature tracking (Lucas-Kanade) for long-running streams
+
+    Points are kept in compact arrays per stream: positions, track ids, and a bounded trail
+    of their last positions. Points are dropped when they fail the forward-backward check
+    (tracked back to the previous frame, they should end up where they started), and new
+    features are detected in the empty regions of the frame whenever fewer than `replenish`
+    of max_points are left, so the point set doesn't shrink over time.
+    """
+    FEATURE_PARAMS = {
+        "qualityLevel": 0.3,
+        "blockSize": 7
+    }
+    LK_PARAMS = {
+        "winSize": (15, 15),
+        "maxLevel": 2,
+        "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03)
+    }
+
+    def __init__(self, max_points: int = 100, min_distance: int = 7, trail: int = 16,
+                 max_fb_error: float = 1.0, replenish: float = 0.8):
+        """
+        max_points: maximum number of tracked points per stream
+        min_distance: minimum distance between (new) points (px)
+        trail: number of positions kept per point
+        max_fb_error: maximum forward-backward error (px) of a reliable point
+        replenish: detect new features when fewer than this fraction of max_points are left
+        """
+        self.max_points = max_points
+        self.min_distance = min_distance
+        self.trail = trail
+        self.max_fb_error = max_fb_error
+        self.replenish = replenish
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * min_distance + 1,) * 2)
+        self.reset()
+
+    def reset(self):
+        self.previous = {}  # per stream: previous greyscale frame
+        self.points = {}    # per stream: {"points": N x 2, "track_ids": N, "trails": N x trail x 2, "lengths": N}
+        self.next_id = 0
+
+    def update(self, key: str, grey: np.ndarray) -> Dict[str, np.ndarray]:
+        """Track the points of this stream into a new (greyscale) frame; returns its point arrays"""
+        with timed("tracking.points", key):
+            if key not in self.points:
+                self.points[key] = self._empty()
+            else:
+                self.points[key] = self._track(self.points[key], self.previous[key], grey)
+
+            if len(self.points[key]["points"]) < self.replenish * self.max_points:
+                self.points[key] = self._replenish(self.points[key], grey)
+
+            self.previous[key] = grey
+            PROFILER.count("tracking.points", len(self.points[key]["points"]))
+            return self.points[key]
+
+    def _empty(self) -> Dict[str, np.ndarray]:
+        return {
+            "points": np.empty((0, 2), dtype=np.float32),
+            "track_ids": np.empty(0, dtype=np.int64),
+            "trails": np.empty((0, self.trail, 2), dtype=np.float32),
+            "lengths": np.empty(0, dtype=np.int32),
+        }
+
+    def _track(self, state: Dict[str, np.ndarray], previous: np.ndarray, grey: np.ndarray) -> Dict[str, np.ndarray]:
+        points = state["points"]
+        if len(points) == 0:
+            return state
+
+        p0 = points.reshape(-1, 1, 2)
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(previous, grey, p0, None, **self.LK_PARAMS)
+        backward, status_back, _ = cv2.calcOpticalFlowPyrLK(grey, previous, forward, None, **self.LK_PARAMS)
+        fb_error = np.linalg.norm((backward - p0).reshape(-1, 2), axis=1)
+        height, width = grey.shape[:2]
+        forward = forward.reshape(-1, 2)
+        keep = (status.ravel() == 1) & (status_back.ravel() == 1) & (fb_error < self.max_fb_error) & \
+               (forward[:, 0] >= 0) & (forward[:, 1] >= 0) & (forward[:, 0] < width) & (forward[:, 1] < height)
+
+        # shift the trails, newest position last
+        trails = np.concatenate([state["trails"][keep, 1:], forward[keep, np.newaxis]], axis=1)
+        return {
+            "points": forward[keep],
+            "track_ids": state["track_ids"][keep],
+            "trails": trails,
+            "lengths": np.minimum(state["lengths"][keep] + 1, self.trail),
+        }
+
+    def _replenish(self, state: Dict[str, np.ndarray], grey: np.ndarray) -> Dict[str, np.ndarray]:
+        """Add features away from the current points"""
+        mask = np.full(grey.shape[:2], 255, dtype=np.uint8)
+        if len(state["points"]):
+            occupied = np.zeros_like(mask)
+            # points up to the last pixel's edge (x < width) may round to width
+            xy = np.clip(np.round(state["points"]), 0, [mask.shape[1] - 1, mask.shape[0] - 1]).astype(np.int32)
+            occupied[xy[:, 1], xy[:, 0]] = 255
+            mask[cv2.dilate(occupied, self.kernel) > 0] = 0
+
+        features = cv2.goodFeaturesToTrack(grey, maxCorners=self.max_points - len(state["points"]), mask=mask,
+                                           minDistance=self.min_distance, **self.FEATURE_PARAMS)
+        if features is None:
+            return state
+
+        new = features.reshape(-1, 2).astype(np.float32)
+        n = len(new)
+        PROFILER.count("tracking.replenished", n)
+        self.next_id += n
+        return {
+            "points": np.concatenate([state["points"], new]),
+            "track_ids": np.concatenate([state["track_ids"], np.arange(self.next_id - n, self.next_id)]),
+            "trails": np.concatenate([state["trails"], np.repeat(new[:, np.newaxis], self.trail, axis=1)]),
+            "lengths": np.concatenate([state["lengths"], np.ones(n, dtype=np.int32)]),
+        }
@@ -0,0 +1,149 @@
+import ast
+import os
+from collections import namedtuple
+
+from streams.utils import STREAM_TYPES
+
+# Registry of the available inference classes and stream types.
+#
+# Inference modules are parsed rather than imported, so listing classes with
+# their ARGUMENTS and KEYSTROKES doesn't load any (heavy) framework.
+
+INFERENCE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inference")
+ARGUMENT_TYPES = {"str": str, "int": int, "float": float, "bool": bool}
+PLUGIN_BASE = "Inference"
+
+# dict(Base.ARGUMENTS, **Base.OTHER_ARGUMENTS, extra=int): the bases' entries are looked up with the
+# other classes (see _inherited)
+Derived = namedtuple("Derived", ["bases", "entries"])
+
+
+def _literal(node):
+    """
+    Evaluate a literal, allowing builtin type names as values (e.g., {'model': str}),
+    and dicts extending those of other classes (e.g., dict(Base.ARGUMENTS, **Base.TILE_ARGUMENTS, extra=int))
+    """
+    if isinstance(node, ast.Dict):
+        return {_literal(key): _literal(value) for (key, value) in zip(node.keys, node.values)}
+    if isinstance(node, ast.Name) and node.id in ARGUMENT_TYPES:
+        return ARGUMENT_TYPES[node.id]
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "dict":
+        bases = list(node.args) + [keyword.value for keyword in node.keywords if keyword.arg is None]
+        if not all(isinstance(base, ast.Attribute) and isinstance(base.value, ast.Name) for base in bases):
+            raise ValueError("dict() of something else than class attributes")
+        return Derived([(base.value.id, base.attr) for base in bases],
+                       {keyword.arg: _literal(keyword.value) for keyword in node.keywords if keyword.arg is not None})
+    return ast.literal_eval(node)
+
+
+def _scan(folder):
+    """Parse all modules: {class name: class info}, and {(module, class name): exported name} from __init__ files"""
+    classes = {}
+    exports = {}
+
+    for root, _, files in os.walk(folder):
+        package = os.path.relpath(root, folder).replace(os.sep, ".").lstrip(".")
+        for filename in sorted(files):
+            if not filename.endswith(".py"):
+                continue
+            with open(os.path.join(root, filename)) as fp:
+                tree = ast.parse(fp.read())
+
+            if filename == "__init__.py":
+                for node in tree.body:
+                    if isinstance(node, ast.ImportFrom) and node.level == 1 and package:
+                        for alias in node.names:
+                            exports[(package + "." + node.module, alias.name)] = \
+                                package + "." + (alias.asname or alias.name)
+                continue
+
+            module = ".".join(filter(None, [package, filename[:-3]]))
+            for node in tree.body:
+                if not isinstance(node, ast.ClassDef):
+                    continue
+                info = {
+                    "module": module,
+                    "bases": [base.id if isinstance(base, ast.Name) else getattr(base, "attr", None)
+                              for base in node.bases],
+                    "doc": (ast.get_docstring(node) or "").strip().split("\n")[0],
+                }
+                for statement in node.body:
+                    if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and \
+                            isinstance(statement.targets[0], ast.Name) and \
+                            (statement.targets[0].id in ("ARGUMENTS", "KEYSTROKES") or
+                             statement.targets[0].id.endswith("_ARGUMENTS")):
+                        try:
+                            info[statement.targets[0].id] = _literal(statement.value)
+                        except ValueError:
+                            pass  # not a literal; can't know without importing
+                classes[node.name] = info
+
+    return classes, exports
+
+
+def _inherited(classes, name, attribute):
+    """Class attribute, looked up through the (parsed) base classes"""
+    info = classes.get(name)
+    if info is None:
+        return None
+    if attribute in info:
+        value = info[attribute]
+        if isinstance(value, Derived):
+            merged = {}
+            for base, base_attribute in value.bases:
+                merged.update(_inherited(classes, base, base_attribute) or {})
+            return dict(merged, **value.entries)
+        return value
+    for base in info["bases"]:
+        value = _inherited(classes, base, attribute)
+        if value is not None:
+            return value
+    return None
+
+
+def _is_plugin(classes, name):
+    info = classes.get(name)
+    return info is not None and any(base == PLUGIN_BASE or _is_plugin(classes, base) for base in info["bases"])
+
+
+def inference_classes(folder=INFERENCE_FOLDER) -> dict:
+    """
+    Available inference classes, by the name to pass to the viewer (-f):
+        {'detection.Faces': {'doc': .., 'ARGUMENTS': {..}, 'KEYSTROKES': {..}}, ..}
+
+    Base classes (named *Inference) are left out.
+    """
+    classes, exports = _scan(folder)
+
+    plugins = {}
+    for name, info in classes.items():
+        if not _is_plugin(classes, name) or name.endswith(PLUGIN_BASE):
+            continue
+        qualified = exports.get((info["module"], name), info["module"] + "." + name)
+        plugins[qualified] = {
+            "doc": info["doc"],
+            "ARGUMENTS": _inherited(classes, name, "ARGUMENTS") or {},
+            "KEYSTROKES": _inherited(classes, name, "KEYSTROKES") or {},
+        }
+
+    return dict(sorted(plugins.items()))
+
+
+def stream_types() -> dict:
+    """Available stream types: {name: identifier format}"""
+    return {name: identifier for (name, (identifier, _, _)) in STREAM_TYPES.items()}
+
+
+def print_plugins():
+    print("Inference classes (-f):")
+    for name, info in inference_classes().items():
+        print("  {:<32} {}".format(name, info["doc"]))
+        for argument, _type in info["ARGUMENTS"].items():
+            print("  {:<32}   --{} ({})".format("", argument, _type.__name__))
+        for key, description in info["KEYSTROKES"].items():
+            print("  {:<32}   '{}' {}".format("", key, description))
+
+    print()
+    print("Stream types (-i):")
+    for name, identifier in stream_types().items():
+        print("  {:<32} {}".format(name, identifier))
@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import cv2
+
+# Latency histogram bucket edges (ms)
+HISTOGRAM_EDGES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Profiler:
+    """
+    Per-stage timing instrumentation
+
+    Durations are kept in a rolling window per (stage, stream) key, from which
+    statistics and histograms are computed on request. Optionally, all timed
+    events are also collected as a Chrome trace (chrome://tracing, Perfetto),
+    which shows the overlap between threads (e.g., camera readers and inference).
+
+    Disabled by default; timing a stage is (nearly) free while disabled.
+    """
+
+    def __init__(self, window: int = 120, max_trace_events: int = 1000000):
+        self.enabled = False
+        self.window = window
+        self.max_trace_events = max_trace_events
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(lambda: deque(maxlen=self.window))  # (stage, stream) -> durations (s)
+            self.counters = defaultdict(int)
+            self.trace_events = None
+            self.trace_path = None
+            self.thread_names = {}
+            self.origin = time.perf_counter()
+
+    def enable(self, trace_path: str = None):
+        """Start collecting timings (and a trace, if a path is given)"""
+        self.enabled = True
+        if trace_path:
+            self.trace_path = trace_path
+            self.trace_events = []
+
+    def timed(self, stage: str, stream=None):
+        """Context manager timing the enclosed block"""
+        return _Timer(self, stage, stream)
+
+    def record(self, stage: str, duration: float, stream=None, start: float = None):
+        """Record a duration (in seconds) measured elsewhere; start is a time.perf_counter() value"""
+        if not self.enabled:
+            return
+
+        key = (stage, None if stream is None else str(stream))
+        with self.lock:
+            self.timings[key].append(duration)
+
+            if self.trace_events is not None and len(self.trace_events) < self.max_trace_events:
+                thread = threading.current_thread()
+                self.thread_names[thread.ident] = thread.name
+                start = start if start is not None else time.perf_counter() - duration
+                self.trace_events.append({
+                    "name": stage,
+                    "cat": key[1] or "",
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": duration * 1e6,
+                    "pid": os.getpid(),
+                    "tid": thread.ident,
+                })
+
+    def count(self, counter: str, amount: int = 1):
+        """Increment a named counter (e.g., cloud calls, cache hits)"""
+        if self.enabled:
+            with self.lock:
+                self.counters[counter] += amount
+
+    def stats(self) -> dict:
+        """Statistics (ms) over the rolling window, per 'stage' or 'stage[stream]'"""
+        with self.lock:
+            windows = {key: sorted(durations) for (key, durations) in self.timings.items() if durations}
+
+        stats = {}
+        for (stage, stream), durations in sorted(windows.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+            n = len(durations)
+            mean = sum(durations) / n
+            stats[stage if stream is None else "{}[{}]".format(stage, stream)] = {
+                "count": n,
+                "mean_ms": 1000 * mean,
+                "p50_ms": 1000 * durations[n // 2],
+                "p95_ms": 1000 * durations[min(n - 1, int(n * 0.95))],
+                "max_ms": 1000 * durations[-1],
+                "rate": 1 / mean if mean > 0 else 0.0,
+            }
+        return stats
+
+    def histogram(self, stage: str, stream=None, edges=HISTOGRAM_EDGES) -> list:
+        """Counts per latency bucket (ms) over the rolling window; the last bucket is > edges[-1]"""
+        key = (stage, None if stream is None else str(stream))
+        with self.lock:
+            durations = list(self.timings.get(key, []))
+
+        counts = [0] * (len(edges) + 1)
+        for duration in durations:
+            bucket = next((i for (i, edge) in enumerate(edges) if 1000 * duration <= edge), len(edges))
+            counts[bucket] += 1
+        return counts
+
+    def dump(self):
+        """Print the current statistics and counters"""
+        print("---- timings (ms) ----------------------------------------------")
+        print("{:<36} {:>8} {:>8} {:>8} {:>8}".format("stage", "mean", "p50", "p95", "max"))
+        for name, stat in self.stats().items():
+            print("{:<36} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+                name, stat["mean_ms"], stat["p50_ms"], stat["p95_ms"], stat["max_ms"]))
+
+        print("---- latency histogram (timings per bucket, ms) ---------------")
+        print("{:<36} ".format("stage") + " ".join("{:>6}".format("<=" + str(edge)) for edge in HISTOGRAM_EDGES) +
+              " {:>6}".format(">" + str(HISTOGRAM_EDGES[-1])))
+        with self.lock:
+            keys = sorted((key for (key, durations) in self.timings.items() if durations),
+                          key=lambda key: (key[0], key[1] or ""))
+        for stage, stream in keys:
+            name = stage if stream is None else "{}[{}]".format(stage, stream)
+            print("{:<36} ".format(name) + " ".join("{:>6}".format(n) for n in self.histogram(stage, stream)))
+
+        with self.lock:
+            counters = dict(self.counters)
+        for name, value in sorted(counters.items()):
+            print("{:<36} {:>8}".format(name, value))
+
+    def write_trace(self):
+        """Write the collected events as a Chrome trace (json)"""
+        if self.trace_events is None:
+            return
+
+        with self.lock:
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for (tid, name) in self.thread_names.items()
+            ]
+            events = metadata + list(self.trace_events)
+
+        with open(self.trace_path, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+    def overlay(self, img, stages=None, colour=(0, 255, 0), scale=0.5):
+        """Draw the frame rate and per-stage mean timings on an (opencv) image"""
+        stats = self.stats()
+        lines = []
+        if "frame" in stats:
+            lines.append("{:.1f} fps".format(stats["frame"]["rate"]))
+        for name, stat in stats.items():
+            if name != "frame" and (stages is None or name.split("[")[0] in stages):
+                lines.append("{} {:.1f}ms".format(name, stat["mean_ms"]))
+
+        for i, line in enumerate(lines):
+            cv2.putText(img, line, (10, 20 + int(40 * scale) * i), cv2.FONT_HERSHEY_SIMPLEX,
+                        scale, colour, 1, cv2.LINE_AA)
+        return img
+
+
+class _Timer:
+    __slots__ = ("profiler", "stage", "stream", "start")
+
+    def __init__(self, profiler: Profiler, stage: str, stream):
+        self.profiler = profiler
+        self.stage = stage
+        self.stream = stream
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler.enabled:
+            self.profiler.record(self.stage, time.perf_counter() - self.start, self.stream, self.start)
+
+
+# Process-wide profiler
+PROFILER = Profiler()
+timed = PROFILER.timed
@@ -3,6 +3,7 @@ from queue import Queue, Empty
 
 from .stream import Stream
 from images.image import Image
+from profiling import timed
 
 import cv2
 
@@ -19,14 +20,15 @@ class CameraStream(Stream):
         self.camera_stream = cv2.VideoCapture(identifier)
         self.image_queue = Queue()
 
-        self.thread = threading.Thread(target=self._image_reader)
+        self.thread = threading.Thread(target=self._image_reader, name="camera-{}".format(identifier))
         self.thread.daemon = True
         self.thread.start()
 
     def _image_reader(self):
         """Asynchronous reading of images from the camera"""
         while True:
-            ret, frame = self.camera_stream.read()
+            with timed("camera.read", self.identifier):
+                ret, frame = self.camera_stream.read()
             if not ret:
                 break
 
@@ -0,0 +1,47 @@
+import os
+
+from .stream import Stream
+from images.image import Image
+
+import cv2
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"}
+
+
+class DirectoryStream(Stream):
+    """
+    Stream of images from a directory, in filename order.
+
+    The stream is finite and seekable; get() returns None once all images have been read.
+    """
+    def __init__(self, identifier: str):
+        super().__init__(identifier)
+
+        self.files = sorted(
+            os.path.join(identifier, filename) for filename in os.listdir(identifier)
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS)
+        self.position = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def seek(self, index: int):
+        self.position = index
+
+    def source(self):
+        """Path of the image that will be returned by the next get()"""
+        return self.files[self.position] if self.position < len(self.files) else None
+
+    def get(self, latest=False):
+        if self.position >= len(self.files):
+            return None
+
+        img = cv2.imread(self.files[self.position])
+        self.position += 1
+        if img is None:
+            return None  # unreadable image
+
+        return Image(img, copy=False, opencv=True)
+
+    def stop(self):
+        pass
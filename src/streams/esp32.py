@@ -7,6 +7,7 @@ from queue import Queue, Empty
 
 from .stream import Stream
 from images.image import Image
+from profiling import timed
 
 
 class Esp32(Stream):
@@ -32,7 +33,7 @@ class Esp32(Stream):
         # resolution: /control?var=framesize&val=7
         self.image_queue = Queue()
 
-        self.thread = threading.Thread(target=self._image_reader)
+        self.thread = threading.Thread(target=self._image_reader, name="esp32-{}".format(identifier))
         self.thread.daemon = True
         self.thread.start()
 
@@ -43,7 +44,8 @@ class Esp32(Stream):
             url = "http://{}/capture".format(self.camera_ip)
             response = None
             try:
-                response = requests.get(url, timeout=2)
+                with timed("esp32.capture", self.camera_ip):
+                    response = requests.get(url, timeout=2)
             except requests.exceptions.ConnectTimeout \
             or requests.exceptions.ConnectionError as ex:
                 print("[!!] timeout reading from stream", url)
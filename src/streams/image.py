@@ -11,6 +11,16 @@ class ImageStream(Stream):
 
         self.image = Image(cv2.imread(identifier), opencv=True)
 
+    def __len__(self):
+        # a single frame when processed as a (finite) sequence
+        return 1
+
+    def seek(self, index: int):
+        pass
+
+    def source(self):
+        return self.identifier
+
     def get(self, latest=False):
         return self.image
 
@@ -1,19 +1,39 @@
+import importlib
 import os
 
-from .camera import CameraStream
-from .camerapi import CameraPiStream
-from .esp32 import Esp32
-from .image import ImageStream
+from .directory import IMAGE_EXTENSIONS
+from .video import VIDEO_EXTENSIONS
+
+# Stream types: name -> (identifier format, module, class).
+# Stream modules are only imported when a stream of that type is created,
+# so optional dependencies (picamera, requests) aren't loaded otherwise.
+STREAM_TYPES = {
+    "camera": ("<device index>, e.g. 0", ".camera", "CameraStream"),
+    "directory": ("<directory with images>", ".directory", "DirectoryStream"),
+    "video": ("<video file: {}>".format(", ".join(sorted(VIDEO_EXTENSIONS))), ".video", "VideoStream"),
+    "image": ("<image file: {}>".format(", ".join(sorted(IMAGE_EXTENSIONS))), ".image", "ImageStream"),
+    "pi": ("pi<camera index>, e.g. pi0", ".camerapi", "CameraPiStream"),
+    "esp32": ("esp<ip address>, e.g. esp192.168.1.20", ".esp32", "Esp32"),
+}
+
+
+def stream_class(stream_type: str):
+    _, module, classname = STREAM_TYPES[stream_type]
+    return getattr(importlib.import_module(module, package=__package__), classname)
 
 
 def create_stream(identifier):
     if identifier.isnumeric():
-        return CameraStream(int(identifier))
+        return stream_class("camera")(int(identifier))
+    elif os.path.isdir(identifier):
+        return stream_class("directory")(identifier)
+    elif os.path.isfile(identifier) and os.path.splitext(identifier)[1].lower() in VIDEO_EXTENSIONS:
+        return stream_class("video")(identifier)
+    elif os.path.isfile(identifier):
+        return stream_class("image")(identifier)
     elif identifier.startswith("pi"):
-        return CameraPiStream(int(identifier[2:]))
+        return stream_class("pi")(int(identifier[2:]))
     elif identifier.startswith("esp"):
-        return Esp32(identifier[3:])
-    elif os.path.isfile(identifier):
-        return ImageStream(identifier)
+        return stream_class("esp32")(identifier[3:])
     else:
         raise ValueError("Unknown stream type: {}".format(identifier))
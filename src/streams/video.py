@@ -0,0 +1,43 @@
+from .stream import Stream
+from images.image import Image
+
+import cv2
+
+VIDEO_EXTENSIONS = {".avi", ".mp4", ".mov", ".mkv", ".mjpeg", ".webm"}
+
+
+class VideoStream(Stream):
+    """
+    Stream of frames from a video file.
+
+    The stream is finite and seekable; get() returns None at the end of the video.
+    Sequential reads don't seek, so reading consecutive frames stays cheap.
+    """
+    def __init__(self, identifier: str):
+        super().__init__(identifier)
+
+        self.video = cv2.VideoCapture(identifier)
+        self.frame_count = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position = 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def seek(self, index: int):
+        if index != self.position:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.position = index
+
+    def source(self):
+        return "{}#{}".format(self.identifier, self.position)
+
+    def get(self, latest=False):
+        ret, frame = self.video.read()
+        if not ret:
+            return None
+        self.position += 1
+
+        return Image(frame, copy=False, opencv=True)
+
+    def stop(self):
+        self.video.release()
@@ -0,0 +1,130 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import utils
+from cloud import governor
+from cloud.governor import RequestGovernor
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RequestGovernorTest(unittest.TestCase):
+    """Run from src: python -m pytest tests (or python -m unittest discover tests)"""
+
+    def setUp(self):
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        self.clock = FakeClock()
+        self.day = "2024-03-01"
+        for patch in (mock.patch.object(utils, "CACHE", cache.name),
+                      mock.patch.object(governor.time, "perf_counter", self.clock),
+                      mock.patch.object(governor, "_today", lambda: self.day)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def stored(self):
+        return utils.load_from_cache(governor.GOVERNOR_CACHE, "calls")
+
+    def test_token_bucket(self):
+        gov = RequestGovernor(tps=2, burst=2)
+        self.assertTrue(gov.acquire("0"))
+        self.assertTrue(gov.acquire("0"))
+        self.assertFalse(gov.acquire("0"))  # bucket empty
+
+        self.clock.now += 0.5  # one token back
+        self.assertTrue(gov.acquire("0"))
+        self.assertFalse(gov.acquire("0"))
+
+        self.clock.now += 10  # refills up to burst
+        self.assertTrue(gov.acquire("0"))
+        self.assertTrue(gov.acquire("0"))
+        self.assertFalse(gov.acquire("0"))
+
+    def test_requests_of_several_calls_go_into_debt(self):
+        gov = RequestGovernor(tps=1, burst=1)
+        self.assertTrue(gov.acquire("0", calls=3))
+        self.clock.now += 1.5
+        self.assertFalse(gov.acquire("0"))  # -2 + 1.5 tokens
+        self.clock.now += 1.5
+        self.assertTrue(gov.acquire("0"))
+
+    def test_budget(self):
+        gov = RequestGovernor(daily_budget=5)
+        self.assertTrue(gov.acquire("0", calls=3))
+        self.assertTrue(gov.acquire("1", calls=2))
+        self.assertFalse(gov.acquire("0"))
+        self.assertFalse(gov.retry())
+        self.assertEqual(gov.report()["budget_left"], 0)
+        self.assertEqual(self.stored(), {self.day: 5})
+
+    def test_budget_is_shared_across_runs(self):
+        first = RequestGovernor(daily_budget=4)
+        second = RequestGovernor(daily_budget=4)
+        self.assertTrue(first.acquire("0", calls=3))
+        self.assertFalse(second.acquire("0", calls=2))
+        self.assertTrue(second.acquire("0"))
+        self.assertFalse(first.acquire("0"))
+
+    def test_calls_are_synced_in_batches(self):
+        gov = RequestGovernor()
+        for _ in range(governor.SYNC_CALLS - 1):
+            gov.acquire("0")
+        self.assertIsNone(self.stored())
+        gov.charge(1)  # e.g., a retry inside the client
+        self.assertEqual(self.stored(), {self.day: governor.SYNC_CALLS})
+
+        gov.acquire("0")
+        self.clock.now += governor.SYNC_INTERVAL + 1
+        gov.acquire("0")
+        self.assertEqual(self.stored(), {self.day: governor.SYNC_CALLS + 2})
+
+    def test_day_change(self):
+        gov = RequestGovernor(daily_budget=1000)
+        for _ in range(5):
+            gov.acquire("0")
+        self.assertIsNone(self.stored())  # not synced yet
+
+        self.day = "2024-03-02"
+        self.assertTrue(gov.acquire("0"))
+        self.assertEqual(self.stored(), {"2024-03-01": 5})  # the previous day's calls aren't lost
+        self.assertEqual(gov.report()["calls_today"], 1)
+
+        gov.close()
+        self.assertEqual(self.stored(), {"2024-03-01": 5, "2024-03-02": 1})
+
+    def test_old_days_are_dropped(self):
+        gov = RequestGovernor()
+        gov.acquire("0")
+        self.day = "2024-03-20"
+        gov.acquire("0")
+        gov.close()
+        self.assertEqual(self.stored(), {"2024-03-20": 1})
+
+    def test_priority_order(self):
+        gov = RequestGovernor(priorities={"0": 2.0})
+        self.assertEqual(gov.order(["1", "0"]), ["0", "1"])  # nothing served yet: weight first
+
+        gov.acquire("0")
+        self.clock.now += 1
+        gov.acquire("1")
+        self.clock.now += 1
+        gov.acquire("2")
+        self.clock.now += 1
+        # waiting for 3s at weight 2, 2s and 1s at weight 1
+        self.assertEqual(gov.order(["2", "1", "0"]), ["0", "1", "2"])
+
+        gov.acquire("0")
+        self.clock.now += 1
+        # 3s for 1; 1s at weight 2 for 0 ties with 2s for 2 (same order as given)
+        self.assertEqual(gov.order(["0", "1", "2"]), ["1", "0", "2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+import numpy as np
+
+from cloud.mosaic import pack, split_labels
+from images.image import Image
+
+
+def label(name, *boxes, confidence=90.0):
+    """Rekognition label with instances at (left, top, width, height), relative to the mosaic"""
+    return {
+        "Name": name,
+        "Confidence": confidence,
+        "Parents": [],
+        "Instances": [{"BoundingBox": {"Left": left, "Top": top, "Width": width, "Height": height},
+                       "Confidence": confidence - i}
+                      for (i, (left, top, width, height)) in enumerate(boxes)],
+    }
+
+
+class MosaicTest(unittest.TestCase):
+    """Run from src: python -m pytest tests (or python -m unittest discover tests)"""
+
+    # 2 x 2 tiles of 100 x 50 px in a 200 x 100 mosaic; the last frame is narrower than its tile
+    PLACEMENTS = [(0, 0, 100, 50), (100, 0, 100, 50), (0, 50, 100, 50), (100, 50, 50, 50)]
+    SIZE = (200, 100)
+
+    def assertBox(self, instance, left, top, width, height):
+        box = instance["BoundingBox"]
+        np.testing.assert_allclose([box["Left"], box["Top"], box["Width"], box["Height"]],
+                                   [left, top, width, height], atol=1e-6)
+
+    def test_pack(self):
+        wide = Image(np.full((50, 200, 3), 255, dtype=np.uint8))
+        tall = Image(np.full((100, 50, 3), 128, dtype=np.uint8))
+        mosaic, placements = pack([wide, tall, wide], tile_width=100)
+
+        # 2 x 2 grid, tiles as high as the tall frame needs at 100px wide
+        self.assertEqual(mosaic.shape, (400, 200, 3))
+        self.assertEqual(placements, [(0, 0, 100, 25), (100, 0, 100, 200), (0, 200, 100, 25)])
+        self.assertEqual(mosaic[10, 50, 0], 255)
+        self.assertEqual(mosaic[100, 150, 0], 128)
+        self.assertEqual(mosaic[100, 50, 0], 0)  # padding
+
+    def test_boxes_map_back_to_their_frames(self):
+        labels = [label("Person", (0.6, 0.1, 0.2, 0.3), (0.1, 0.6, 0.2, 0.2))]
+        frames = split_labels(labels, self.PLACEMENTS, self.SIZE)
+
+        self.assertEqual([len(frame) for frame in frames], [0, 1, 1, 0])
+        # (120, 10, 40, 30) px in the second tile
+        self.assertBox(frames[1][0]["Instances"][0], 0.2, 0.2, 0.4, 0.6)
+        # (20, 60, 40, 20) px in the third tile
+        self.assertBox(frames[2][0]["Instances"][0], 0.2, 0.2, 0.4, 0.4)
+
+    def test_boxes_crossing_a_tile_edge_are_dropped(self):
+        labels = [
+            label("Person", (0.4, 0.1, 0.2, 0.2)),  # across the vertical edge at x = 100
+            label("Car", (0.1, 0.4, 0.2, 0.2)),     # across the horizontal edge at y = 50
+            label("Dog", (0.7, 0.6, 0.1, 0.2)),     # out of the last frame, into its padding
+        ]
+        self.assertEqual(split_labels(labels, self.PLACEMENTS, self.SIZE), [[], [], [], []])
+
+    def test_boxes_just_over_a_tile_edge_are_clipped(self):
+        # 1px over the edge at x = 100 (2% tolerance of 100px = 2px)
+        labels = [label("Person", (0.3, 0.1, 0.205, 0.2))]
+        frames = split_labels(labels, self.PLACEMENTS, self.SIZE)
+
+        self.assertEqual([len(frame) for frame in frames], [1, 0, 0, 0])
+        self.assertBox(frames[0][0]["Instances"][0], 0.6, 0.2, 0.4, 0.4)
+
+    def test_labels_per_frame(self):
+        labels = [
+            label("Person", (0.05, 0.05, 0.1, 0.1), (0.6, 0.1, 0.1, 0.1), (0.3, 0.1, 0.1, 0.1), confidence=95.0),
+            label("Outdoors"),  # no instances: can't be attributed to a frame
+        ]
+        frames = split_labels(labels, self.PLACEMENTS, self.SIZE)
+
+        self.assertEqual([len(frame) for frame in frames], [1, 1, 0, 0])
+        self.assertEqual(len(frames[0][0]["Instances"]), 2)
+        self.assertEqual(frames[0][0]["Name"], "Person")
+        # confidence of the label: of its best instance in the frame
+        self.assertEqual(frames[0][0]["Confidence"], 95.0)
+        self.assertEqual(frames[1][0]["Confidence"], 94.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
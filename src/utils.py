@@ -1,3 +1,5 @@
+import contextlib
+import fcntl
 import os
 import pickle
 
@@ -26,3 +28,17 @@ def load_from_cache(namespace, key):
 
     with open(full_path, "rb") as fp:
         return pickle.load(fp)
+
+
+@contextlib.contextmanager
+def cache_lock(namespace, key):
+    """Exclusive lock on a cache entry, across processes (e.g., for a read-modify-write)."""
+    directory = os.path.join(CACHE, namespace)
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, "{}.lock".format(key)), "w") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)